@@ -1,9 +1,12 @@
 from django.contrib import admin
+from django.db import transaction
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from django.utils import timezone
-from .models import DebateTopic, DebateSession, Participant, Message
+from .models import DebateTopic, DebateSession, Participant, Message, MessageArchive
+from .recent_messages import recent_messages
+from .versions import bump_version
 
 
 @admin.register(DebateTopic)
@@ -67,15 +70,18 @@ class DebateSessionAdmin(admin.ModelAdmin):
     topic_title.admin_order_field = 'topic__title'
     
     def participant_count(self, obj):
-        count = obj.participants.filter(is_active=True).count()
+        count = obj.participants_count
         if count > 0:
             url = reverse('admin:debates_participant_changelist') + f'?session__id__exact={obj.id}'
             return format_html('<a href="{}">{} participants</a>', url, count)
         return count
     participant_count.short_description = 'Participants'
+    participant_count.admin_order_field = 'participants_count'
     
     def message_count(self, obj):
         count = obj.messages.filter(is_deleted=False).count()
+        # Archived messages are no longer in the Message table
+        count += MessageArchive.objects.filter(session=obj).values_list('message_count', flat=True).first() or 0
         if count > 0:
             url = reverse('admin:debates_message_changelist') + f'?session__id__exact={obj.id}'
             return format_html('<a href="{}">{} messages</a>', url, count)
@@ -111,6 +117,7 @@ class ParticipantAdmin(admin.ModelAdmin):
 class MessageAdmin(admin.ModelAdmin):
     """Enhanced admin interface for Message"""
     list_display = ['sender', 'session_topic', 'content_preview', 'timestamp', 'is_deleted']
+    list_select_related = ['sender', 'session__topic']
     list_filter = ['is_deleted', 'timestamp', 'sender__role']
     search_fields = ['sender__username', 'content', 'session__topic__title']
     readonly_fields = ['timestamp']
@@ -140,15 +147,49 @@ class MessageAdmin(admin.ModelAdmin):
     content_preview.short_description = 'Content'
     
     def delete_messages(self, request, queryset):
-        updated = queryset.update(is_deleted=True)
+        updated = self._update_messages(queryset, is_deleted=True)
         self.message_user(request, f'{updated} messages marked as deleted.')
     delete_messages.short_description = "Mark selected messages as deleted"
     
     def restore_messages(self, request, queryset):
-        updated = queryset.update(is_deleted=False)
+        updated = self._update_messages(queryset, is_deleted=False)
         self.message_user(request, f'{updated} messages restored.')
     restore_messages.short_description = "Restore selected messages"
 
+    @staticmethod
+    def _update_messages(queryset, **fields):
+        """
+        Bulk update messages; update() sends no signals, so invalidate the
+        sessions' cached history here, in this worker and through the
+        shared versions in every other
+        """
+        session_ids = set(queryset.values_list('session_id', flat=True))
+        updated = queryset.update(**fields)
+        for session_id in session_ids:
+            recent_messages.discard(session_id)
+            transaction.on_commit(lambda session_id=session_id: bump_version('messages', session_id))
+        return updated
+
+
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    """Read-only view of the message archives written by archive_messages"""
+    list_display = ['session', 'message_count', 'compressed_size', 'last_sequence', 'archived_at']
+    list_select_related = ['session__topic']
+    search_fields = ['session__topic__title']
+    date_hierarchy = 'archived_at'
+    exclude = ['data']
+
+    def compressed_size(self, obj):
+        return f"{len(obj.data) / 1024:.1f} KB"
+    compressed_size.short_description = 'Size'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 # Custom admin site configuration
 admin.site.site_header = "Online Debate Platform Administration"
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DebatesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.debates'
+
+    def ready(self):
+        from . import signals
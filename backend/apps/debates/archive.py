@@ -0,0 +1,187 @@
+import bisect
+import gzip
+import json
+import threading
+from collections import Counter, OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.metrics.registry import registry
+from .conf import realtime_setting
+from .models import ArchivedMessageCount, Message, MessageArchive
+
+ARCHIVED_MESSAGES = registry.counter(
+    'messages_archived_total', 'Messages moved out of the Message table into session archives'
+)
+ARCHIVE_LOOKUPS = registry.counter(
+    'message_archive_lookups_total', 'Archived history requests by decoded archive cache outcome',
+    labels=('outcome',)
+)
+
+# Message columns kept in an archive line
+FIELDS = ('id', 'sender_id', 'content', 'timestamp', 'sequence', 'is_deleted')
+
+# Rows deleted per statement, under every database's parameter limit
+DELETE_BATCH_SIZE = 500
+
+
+def row_key(row):
+    return row['timestamp'], row['id']
+
+
+def encode_messages(rows):
+    """Gzipped JSON lines from message rows (dicts of FIELDS)"""
+    lines = (
+        json.dumps({**row, 'timestamp': row['timestamp'].isoformat()}, separators=(',', ':'))
+        for row in rows
+    )
+    return gzip.compress('\n'.join(lines).encode())
+
+
+def decode_messages(data):
+    """The message rows of an archive, in (timestamp, id) order"""
+    rows = []
+    for line in gzip.decompress(data).decode().splitlines():
+        row = json.loads(line)
+        row['timestamp'] = parse_datetime(row['timestamp'])
+        rows.append(row)
+    return rows
+
+
+def archive_session(session_id):
+    """
+    Move a session's messages into its archive, merged with any archived
+    before (messages can still arrive after a session ends). Returns the
+    number of messages moved.
+    """
+    with transaction.atomic():
+        messages = [
+            dict(zip(FIELDS, values))
+            for values in Message.objects.filter(session_id=session_id).values_list(*FIELDS)
+        ]
+        if not messages:
+            return 0
+
+        archive = MessageArchive.objects.select_for_update().filter(session_id=session_id).first()
+        rows = decode_messages(archive.data) if archive is not None else []
+        rows.extend(messages)
+        rows.sort(key=row_key)
+        visible = [row for row in rows if not row['is_deleted']]
+        archive, created = MessageArchive.objects.update_or_create(session_id=session_id, defaults={
+            'data': encode_messages(rows),
+            'message_count': len(visible),
+            'last_sequence': max((row['sequence'] for row in rows if row['sequence'] is not None), default=None),
+            'archived_at': timezone.now(),
+        })
+        # Per sender, for user stats; archived messages can outlive their senders
+        sender_counts = Counter(row['sender_id'] for row in visible)
+        senders = get_user_model().objects.filter(id__in=sender_counts).values_list('id', flat=True)
+        archive.sender_counts.all().delete()
+        ArchivedMessageCount.objects.bulk_create([
+            ArchivedMessageCount(archive=archive, user_id=user_id, count=sender_counts[user_id])
+            for user_id in senders
+        ])
+
+        # Message's post_delete signal invalidates the session's cached history
+        ids = [message['id'] for message in messages]
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            Message.objects.filter(id__in=ids[start:start + DELETE_BATCH_SIZE]).delete()
+
+    ARCHIVED_MESSAGES.inc(len(messages))
+    return len(messages)
+
+
+def sessions_to_archive(ended_before):
+    """Ids of sessions that ended before a time and still have messages in the table"""
+    return Message.objects.filter(
+        session__end_time__lt=ended_before
+    ).values_list('session_id', flat=True).order_by('session_id').distinct()
+
+
+def archived_message_count(user):
+    """Messages a user sent that are now archived"""
+    return ArchivedMessageCount.objects.filter(user=user).aggregate(total=Sum('count'))['total'] or 0
+
+
+class _SessionArchive:
+    __slots__ = ('session_id', 'archived_at', 'rows', 'keys')
+
+    def __init__(self, session_id, archived_at, rows):
+        self.session_id = session_id
+        self.archived_at = archived_at
+        # Messages that aren't deleted, oldest first, and their (timestamp, id) keys
+        self.rows = [row for row in rows if not row['is_deleted']]
+        self.keys = [row_key(row) for row in self.rows]
+
+    def window(self, since, before=None, after=None, limit=50):
+        """
+        Up to `limit` messages from `since` on, oldest first: those after
+        the (timestamp, id) key `after`, else the latest ones before
+        `before` (or overall). Messages with their senders loaded.
+        """
+        low = bisect.bisect_left(self.keys, (since,)) if since is not None else 0
+        if after is not None:
+            start = max(low, bisect.bisect_right(self.keys, after))
+            rows = self.rows[start:start + limit]
+        else:
+            end = bisect.bisect_left(self.keys, before) if before is not None else len(self.rows)
+            rows = self.rows[max(low, end - limit):end]
+
+        senders = get_user_model().objects.in_bulk({row['sender_id'] for row in rows})
+        return [
+            Message(session_id=self.session_id, sender=senders[row['sender_id']], **{
+                field: row[field] for field in FIELDS if field != 'sender_id'
+            })
+            for row in rows
+            if row['sender_id'] in senders
+        ]
+
+
+class ArchiveCache:
+    """
+    Decoded archives of the sessions whose history was read most recently.
+
+    Each read checks the archive's archived_at, one small indexed query,
+    so an archive rewritten by archive_messages in another process is
+    never served stale; the blob itself is only fetched and decompressed
+    when that changes or the session isn't cached.
+    """
+
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """A session's archive, or None if it has none"""
+        archived_at = MessageArchive.objects.filter(
+            session_id=session_id
+        ).values_list('archived_at', flat=True).first()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if archived_at is None:
+                self._sessions.pop(session_id, None)
+                return None
+            if entry is not None and entry.archived_at == archived_at:
+                self._sessions.move_to_end(session_id)
+                ARCHIVE_LOOKUPS.inc(outcome='hit')
+                return entry
+
+        ARCHIVE_LOOKUPS.inc(outcome='miss')
+        archive = MessageArchive.objects.filter(session_id=session_id).only('archived_at', 'data').first()
+        if archive is None:
+            return None
+        entry = _SessionArchive(session_id, archive.archived_at, decode_messages(archive.data))
+        with self._lock:
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return entry
+
+
+message_archive = ArchiveCache(max_sessions=realtime_setting('ARCHIVE_CACHE_SESSIONS'))
@@ -0,0 +1,99 @@
+from django.conf import settings
+
+
+# Defaults for the DEBATE_REALTIME settings dictionary
+DEFAULTS = {
+    'REDIS_URL': 'redis://127.0.0.1:6379/0',
+    # Where online users are tracked; config/settings.py picks the Redis
+    # backend outside DEBUG so every worker shares one count
+    'PRESENCE_BACKEND': 'apps.debates.presence.InMemoryPresenceBackend',
+    # Seconds between presence snapshots written to OnlineParticipant
+    'PRESENCE_FLUSH_INTERVAL': 5.0,
+    # Open connections are re-marked as seen every PRESENCE_TOUCH_INTERVAL
+    # seconds; anything not seen for PRESENCE_STALE_AFTER seconds (say, left
+    # behind by a crashed worker) is removed by a sweep every
+    # PRESENCE_SWEEP_INTERVAL seconds
+    'PRESENCE_TOUCH_INTERVAL': 30.0,
+    'PRESENCE_STALE_AFTER': 120.0,
+    'PRESENCE_SWEEP_INTERVAL': 60.0,
+    # Typing indicators are ephemeral; set TYPING_PERSIST to also write TypingIndicator rows
+    'TYPING_TIMEOUT': 3.0,
+    'TYPING_BROADCAST_INTERVAL': 1.0,
+    'TYPING_PERSIST': False,
+    # 'sync' inserts each chat message before broadcasting it; 'batched'
+    # broadcasts first and inserts in bulk every MESSAGE_FLUSH_INTERVAL
+    # seconds or MESSAGE_FLUSH_SIZE messages, whichever comes first
+    'MESSAGE_WRITE_MODE': 'batched',
+    'MESSAGE_FLUSH_SIZE': 100,
+    'MESSAGE_FLUSH_INTERVAL': 0.2,
+    # Inserts a buffered message gets before it is dead-lettered (logged in
+    # full at ERROR and counted in chat_message_write_failures_total)
+    'MESSAGE_WRITE_ATTEMPTS': 3,
+    # Required in 'batched' mode outside DEBUG: a number from 0 to 31 that
+    # no other worker process uses, since message ids are built from it.
+    # Workers fail to start without it
+    'MESSAGE_WRITER_WORKER_ID': None,
+    # Consumer database calls use Django's async ORM API (aget, acreate, ...)
+    # instead of database_sync_to_async; compare with benchmark_db_access
+    'ASYNC_ORM': False,
+    # Users resolved from WebSocket tokens, cached by token jti; user changes
+    # in any worker invalidate them through a version in the shared cache
+    'JWT_USER_CACHE_SIZE': 4096,
+    'JWT_USER_CACHE_TTL': 300,
+    # Session memberships used for authorization; the TTL bounds how long
+    # changes made by another worker process can go unnoticed
+    'MEMBERSHIP_CACHE_SIZE': 2048,
+    'MEMBERSHIP_CACHE_TTL': 60,
+    # Mutes in force per session, checked before each chat message; the TTL
+    # bounds staleness in workers that missed a sanction.update event
+    'SANCTION_CACHE_SIZE': 2048,
+    'SANCTION_CACHE_TTL': 60,
+    # Frames queued per WebSocket client; typing and online count updates
+    # are dropped past this, and a client kept full of chat messages for
+    # OUTBOUND_OVER_BUDGET_SECONDS is disconnected
+    'OUTBOUND_QUEUE_SIZE': 256,
+    'OUTBOUND_OVER_BUDGET_SECONDS': 10.0,
+    # Where chat message sequence numbers are allocated; Redis outside DEBUG
+    'SEQUENCE_BACKEND': 'apps.debates.sequences.InMemorySequenceBackend',
+    # Recent chat broadcasts kept per session for clients resuming with
+    # resume_from; older gaps are read from the database, up to
+    # REPLAY_MAX_MESSAGES before the client is told to reload history
+    'REPLAY_BUFFER_SIZE': 256,
+    'REPLAY_BUFFER_SESSIONS': 1024,
+    'REPLAY_MAX_MESSAGES': 500,
+    # Serialized recent messages kept per live session for the REST history
+    'RECENT_MESSAGES_SIZE': 200,
+    'RECENT_MESSAGES_SESSIONS': 256,
+    # Debate sessions one multiplexed ws/ connection may subscribe to
+    'MAX_SESSION_SUBSCRIPTIONS': 20,
+    # Unread notification counts are cached, kept current as notifications
+    # are created and read, and recounted at least this often (seconds)
+    'UNREAD_COUNT_TTL': 300,
+    # Sending DRAIN_SIGNAL to a worker stops it accepting sockets and asks
+    # its clients to reconnect elsewhere: DRAIN_BATCH_SIZE at a time over
+    # DRAIN_CLOSE_SPREAD seconds, each waiting a random retry_after of up
+    # to DRAIN_RECONNECT_JITTER seconds. See apps/debates/drain.py
+    'DRAIN_SIGNAL': 'SIGUSR2',
+    'DRAIN_CLOSE_SPREAD': 10.0,
+    'DRAIN_BATCH_SIZE': 100,
+    'DRAIN_RECONNECT_JITTER': 15.0,
+    'DRAIN_TIMEOUT': 10.0,
+    # archive_messages compacts the messages of sessions that ended more
+    # than ARCHIVE_AFTER_DAYS days ago into one gzipped blob per session;
+    # history reads decode the last ARCHIVE_CACHE_SESSIONS of them once
+    'ARCHIVE_AFTER_DAYS': 30,
+    'ARCHIVE_CACHE_SESSIONS': 32,
+    # Token buckets per client frame type as (tokens per second, burst),
+    # for each connection and for each user across their connections
+    'RATE_LIMITS': {
+        'chat_message': {'connection': (1.0, 5), 'user': (2.0, 10)},
+        'typing': {'connection': (2.0, 6), 'user': (4.0, 12)},
+        'ping': {'connection': (0.5, 3), 'user': (1.0, 6)},
+        'default': {'connection': (1.0, 5)},
+    },
+}
+
+
+def realtime_setting(name):
+    """Return a DEBATE_REALTIME setting, falling back to its default"""
+    return getattr(settings, 'DEBATE_REALTIME', {}).get(name, DEFAULTS[name])
@@ -1,202 +1,273 @@
-import json
-import asyncio
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from django.utils import timezone
-from .models import DebateSession, Message, Participant, OnlineParticipant, TypingIndicator
+from apps.metrics.registry import registry
+from .conf import realtime_setting
+from .drain import drain
+from .outbound import OutboundQueue
+from .rate_limits import rate_limiter
+from .protocol import MSGPACK_SUBPROTOCOL, decode_json, decode_msgpack, encode_json, encode_msgpack
+from .streams import SESSION_FRAME_TYPES, SessionStream
+
+
+WS_CONNECTIONS = registry.counter(
+    'ws_connections_total', 'Debate WebSocket connection attempts by outcome', labels=('outcome',)
+)
+WS_ACTIVE = registry.gauge('ws_connections_active', 'Open debate WebSocket connections')
+WS_RECEIVED = registry.counter('ws_messages_received_total', 'Frames received from clients by type', labels=('type',))
+WS_SENT = registry.counter('ws_messages_sent_total', 'Frames sent to clients by type', labels=('type',))
+WS_BYTES_SENT = registry.counter(
+    'ws_bytes_sent_total', 'Payload bytes sent to clients by wire protocol', labels=('protocol',)
+)
 
 
-class DebateConsumer(AsyncJsonWebsocketConsumer):
+class RealtimeConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Connection handling shared by the debate WebSocket consumers: wire
+    protocol negotiation, the outbound queue and client rate limits.
+
+    Clients may negotiate the MessagePack subprotocol from protocol.py;
+    everyone else talks JSON. Open connections are tracked for drain.py.
+    """
+    use_msgpack = False
+    outbound = None
+    # Client frame types handled; ws_messages_received_total counts the rest as 'unknown'
+    frame_types = SESSION_FRAME_TYPES
+
+    async def accept_client(self):
+        """Accept the socket in the negotiated protocol and set up per-connection state"""
+        if MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', []):
+            self.use_msgpack = True
+            await self.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+        else:
+            await self.accept()
+        WS_CONNECTIONS.inc(outcome='accepted')
+        WS_ACTIVE.inc()
+        self.outbound = OutboundQueue(
+            self.write_frame,
+            max_size=realtime_setting('OUTBOUND_QUEUE_SIZE'),
+            over_budget_seconds=realtime_setting('OUTBOUND_OVER_BUDGET_SECONDS'),
+            on_over_budget=self.close_slow_client
+        )
+        # Token buckets for this connection's frames, see rate_limits.py
+        self.rate_buckets = {}
+        self.rate_limited_types = set()
+        drain.track(self)
+
+    async def reject_while_draining(self):
+        """Refuse a new socket while this worker drains; returns True if refused"""
+        if not drain.draining:
+            return False
+        WS_CONNECTIONS.inc(outcome='rejected_draining')
+        await self.close()
+        return True
+
+    async def ask_to_reconnect(self, retry_after):
+        """Ask the client to reconnect, to another worker, after retry_after seconds"""
+        await self.send_json({
+            'type': 'reconnect',
+            'reason': 'server_restart',
+            'retry_after': round(retry_after, 1)
+        })
+        await self.outbound.flush()
+        await self.close(code=1012)  # Service restart
+
+    def query_param(self, name):
+        query_params = parse_qs(self.scope.get('query_string', b'').decode())
+        return query_params.get(name, [None])[0]
+
+    def get_resume_from(self):
+        try:
+            return max(int(self.query_param('resume_from')), 0)
+        except (TypeError, ValueError):
+            return None
+
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection"""
+        if self.outbound is not None:
+            self.outbound.close()
+            WS_ACTIVE.dec()
+            drain.untrack(self)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.use_msgpack:
+            try:
+                content = decode_msgpack(bytes_data)
+            except Exception as e:
+                print(f"Error decoding MessagePack frame: {e}")
+                await self.send_json({
+                    'type': 'error',
+                    'message': 'Invalid frame'
+                })
+                return
+            await self.receive_json(content, **kwargs)
+        else:
+            await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
+    async def read_frame_type(self, content, default=None):
+        """
+        Count a client frame and return its type, or None, after telling the
+        client, if it has no string type
+        """
+        message_type = content.get('type', default) if isinstance(content, dict) else None
+        # Label values come from a fixed set, however many types clients invent
+        WS_RECEIVED.inc(type=message_type if message_type in self.frame_types else 'unknown')
+        if not isinstance(message_type, str):
+            # Still limited, under 'default'
+            if not await self.check_rate_limit(None):
+                return None
+            await self.send_json({
+                'type': 'error',
+                'code': 'invalid_frame',
+                'message': 'Frames must be objects with a string type'
+            })
+            return None
+        return message_type
+
+    async def check_rate_limit(self, message_type):
+        """Take a token for a client frame, telling the client once when it runs out"""
+        rejection = rate_limiter.check(self.rate_buckets, self.user.id, message_type)
+        limit_type = rate_limiter.limit_type(message_type)
+        if rejection is None:
+            self.rate_limited_types.discard(limit_type)
+            return True
+
+        if limit_type not in self.rate_limited_types:
+            self.rate_limited_types.add(limit_type)
+            scope, retry_after = rejection
+            await self.send_json({
+                'type': 'error',
+                'code': 'rate_limited',
+                'message': 'You are sending messages too quickly. Please slow down.',
+                'event': message_type,
+                'scope': scope,
+                'retry_after': round(retry_after, 2)
+            })
+        return False
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return decode_json(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return encode_json(content)
+
+    async def send_json(self, content, close=False):
+        event = content.get('type', 'unknown')
+        WS_SENT.inc(type=event)
+        if self.use_msgpack:
+            await self.send_encoded(event, bytes_data=encode_msgpack(content), close=close)
+        else:
+            await self.send_encoded(event, text_data=await self.encode_json(content), close=close)
+
+    async def send_broadcast(self, event):
+        """Send the client a broadcast.frame group event in its wire format"""
+        WS_SENT.inc(type=event['event'])
+        coalesce_key = event.get('coalesce_key')
+        if coalesce_key is not None and 'session_id' in event:
+            # Keys are per session; one socket may carry several
+            coalesce_key = (event['session_id'], coalesce_key)
+        if self.use_msgpack:
+            await self.send_encoded(event['event'], bytes_data=event['bytes'], coalesce_key=coalesce_key)
+        else:
+            await self.send_encoded(event['event'], text_data=event['text'], coalesce_key=coalesce_key)
+
+    async def send_encoded(self, event, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+        """Queue an already encoded frame for the client"""
+        if self.outbound is None or close:
+            await self.write_frame(text_data=text_data, bytes_data=bytes_data, close=close)
+        else:
+            self.outbound.put(event, text_data=text_data, bytes_data=bytes_data, coalesce_key=coalesce_key)
+
+    async def write_frame(self, text_data=None, bytes_data=None, close=False):
+        """Write a frame to the socket; called by the outbound queue's writer"""
+        if self.use_msgpack:
+            WS_BYTES_SENT.inc(len(bytes_data), protocol='msgpack')
+        else:
+            WS_BYTES_SENT.inc(len(text_data), protocol='json')
+        await self.send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def close_slow_client(self):
+        """Disconnect a client that has fallen too far behind"""
+        print(f"Closing WebSocket for {self.user.username}: outbound queue over budget")
+        await self.close(code=4008)  # Custom close code for a client too slow to keep up
+
+
+class DebateConsumer(RealtimeConsumer):
     """
     WebSocket consumer for real-time debate messaging.
     Supports async operations for better performance.
+
+    One socket per debate session; the session itself is handled by a
+    SessionStream from streams.py.
     """
+    stream = None
 
     async def connect(self):
         """Handle WebSocket connection"""
         self.session_id = self.scope['url_route']['kwargs']['session_id']
-        self.room_group_name = f'debate_{self.session_id}'
         self.user = self.scope['user']
 
+        if await self.reject_while_draining():
+            return
+
         # Check if user is authenticated
         if isinstance(self.user, AnonymousUser):
             print(f"WebSocket connection rejected: Anonymous user trying to connect to session {self.session_id}")
+            WS_CONNECTIONS.inc(outcome='rejected_auth')
             await self.close(code=4001)  # Custom close code for authentication error
             return
 
         # Check if session exists and user is a participant
-        if not await self.is_valid_participant():
+        stream = SessionStream(self, self.session_id)
+        if not await stream.is_valid_participant():
             print(f"WebSocket connection rejected: User {self.user.username} is not a valid participant in session {self.session_id}")
+            WS_CONNECTIONS.inc(outcome='rejected_participant')
             await self.close(code=4003)  # Custom close code for invalid participant
             return
 
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
-
-        await self.accept()
-
-        # Add user to online participants
-        await self.add_online_participant()
-
-        # Send connection confirmation with online count
-        online_count, total_participants = await self.get_participant_counts()
-        
-        await self.send_json({
-            'type': 'connection_established',
-            'message': f'Connected to debate session {self.session_id}',
-            'session_id': self.session_id,
-            'online_count': online_count,
-            'total_participants': total_participants
-        })
-
-        # Broadcast updated online count to all participants
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'online_count_update',
-                'online_count': online_count,
-                'total_participants': total_participants,
-                'user_joined': {
-                    'id': self.user.id,
-                    'username': self.user.username
-                }
-            }
-        )
+        await self.accept_client()
+        self.stream = stream
+        await stream.open(resume_from=self.get_resume_from())
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        # Remove user from online participants
-        await self.remove_online_participant()
-        
-        # Clear typing indicator
-        await self.clear_typing_indicator()
-
-        # Get updated counts and broadcast
-        online_count, total_participants = await self.get_participant_counts()
-        
-        # Leave room group
-        if hasattr(self, 'room_group_name'):
-            # Broadcast updated online count before leaving
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'online_count_update',
-                    'online_count': online_count,
-                    'total_participants': total_participants,
-                    'user_left': {
-                        'id': self.user.id,
-                        'username': self.user.username
-                    }
-                }
-            )
-            
-            await self.channel_layer.group_discard(
-                self.room_group_name,
-                self.channel_name
-            )
+        await super().disconnect(close_code)
+        if self.stream is not None:
+            await self.stream.close()
 
     async def receive_json(self, content):
         """Handle incoming WebSocket messages"""
-        message_type = content.get('type', 'chat_message')
-        
-        if message_type == 'chat_message':
-            await self.handle_chat_message(content)
-        elif message_type == 'typing':
-            await self.handle_typing_indicator(content)
-        elif message_type == 'ping':
-            await self.handle_ping()
-        else:
-            await self.send_json({
-                'type': 'error',
-                'message': 'Unknown message type'
-            })
-
-    async def handle_ping(self):
-        """Handle ping to keep connection alive and update last seen"""
-        await self.update_last_seen()
-        await self.send_json({
-            'type': 'pong',
-            'timestamp': timezone.now().isoformat()
-        })
+        message_type = await self.read_frame_type(content, default='chat_message')
+        if message_type is None:
+            return
 
-    async def handle_chat_message(self, content):
-        """Handle chat messages"""
-        print(f"Received message content: {content}")
-        message_content = content.get('content', '').strip()
-        
-        if not message_content:
-            print("Empty message content")
-            await self.send_json({
-                'type': 'error',
-                'message': 'Message cannot be empty'
-            })
+        if not await self.check_rate_limit(message_type):
             return
 
-        print(f"Processing message: {message_content}")
-        
-        # Clear typing indicator when message is sent
-        await self.clear_typing_indicator()
-        
-        # Save message to database
-        message = await self.save_message(message_content)
-        
-        if message:
-            print(f"Message saved successfully, broadcasting to group: {self.room_group_name}")
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': {
-                        'id': message.id,
-                        'content': message_content,
-                        'user': {
-                            'id': self.user.id,
-                            'username': self.user.username,
-                            'role': self.user.role
-                        },
-                        'timestamp': message.timestamp.isoformat()
-                    }
-                }
-            )
+        if message_type in SESSION_FRAME_TYPES:
+            await self.stream.receive(message_type, content)
         else:
-            print("Failed to save message")
             await self.send_json({
                 'type': 'error',
-                'message': 'Failed to save message'
+                'message': 'Unknown message type'
             })
 
-    async def handle_typing_indicator(self, content):
-        """Handle typing indicators"""
-        is_typing = content.get('is_typing', False)
-        
-        # Update typing status in database
-        await self.update_typing_status(is_typing)
-        
-        # Broadcast to other participants
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user': self.user.username,
-                'user_id': self.user.id,
-                'is_typing': is_typing
-            }
-        )
+    async def broadcast_frame(self, event):
+        """Forward a frame that was encoded once by groups.broadcast"""
+        await self.stream.deliver(event)
 
-        # If user started typing, set a timer to clear it after 3 seconds
-        if is_typing:
-            asyncio.create_task(self.clear_typing_after_delay())
-
-    async def clear_typing_after_delay(self):
-        """Clear typing indicator after 3 seconds of inactivity"""
-        await asyncio.sleep(3)
-        await self.clear_typing_indicator(broadcast=True)
+    async def sanction_update(self, event):
+        """Apply a moderation action; a removed user is disconnected"""
+        if await self.stream.apply_sanction(event):
+            # The moderation_action frame goes out before the close
+            await self.outbound.flush()
+            await self.close(code=4004)  # Custom close code for removal by the moderator
 
+    # Dict events below are still sent by workers running the previous
+    # release during a rolling deploy
     async def chat_message(self, event):
         """Send chat message to WebSocket"""
         await self.send_json({
@@ -222,138 +293,3 @@ class DebateConsumer(AsyncJsonWebsocketConsumer):
             'user_joined': event.get('user_joined'),
             'user_left': event.get('user_left')
         })
-
-    # Database operations
-    @database_sync_to_async
-    def is_valid_participant(self):
-        """Check if user is a valid participant in the session"""
-        try:
-            session = DebateSession.objects.get(id=self.session_id, is_active=True)
-            return Participant.objects.filter(
-                user=self.user,
-                session=session,
-                is_active=True
-            ).exists()
-        except DebateSession.DoesNotExist:
-            print(f"DebateSession with id {self.session_id} does not exist or is not active")
-            return False
-
-    @database_sync_to_async
-    def add_online_participant(self):
-        """Add user to online participants"""
-        try:
-            session = DebateSession.objects.get(id=self.session_id)
-            OnlineParticipant.objects.update_or_create(
-                user=self.user,
-                session=session,
-                defaults={
-                    'channel_name': self.channel_name,
-                    'last_seen': timezone.now()
-                }
-            )
-        except Exception as e:
-            print(f"Error adding online participant: {e}")
-
-    @database_sync_to_async
-    def remove_online_participant(self):
-        """Remove user from online participants"""
-        try:
-            OnlineParticipant.objects.filter(
-                user=self.user,
-                session_id=self.session_id
-            ).delete()
-        except Exception as e:
-            print(f"Error removing online participant: {e}")
-
-    @database_sync_to_async
-    def update_last_seen(self):
-        """Update last seen timestamp"""
-        try:
-            OnlineParticipant.objects.filter(
-                user=self.user,
-                session_id=self.session_id
-            ).update(last_seen=timezone.now())
-        except Exception as e:
-            print(f"Error updating last seen: {e}")
-
-    @database_sync_to_async
-    def get_participant_counts(self):
-        """Get online and total participant counts"""
-        try:
-            session = DebateSession.objects.get(id=self.session_id)
-            online_count = OnlineParticipant.objects.filter(session=session).count()
-            total_participants = Participant.objects.filter(session=session, is_active=True).count()
-            return online_count, total_participants
-        except DebateSession.DoesNotExist:
-            print(f"Error getting participant counts: DebateSession with id {self.session_id} does not exist.")
-            return 0, 0
-        except Exception as e:
-            print(f"Error getting participant counts: {e}")
-            return 0, 0
-
-    @database_sync_to_async
-    def update_typing_status(self, is_typing):
-        """Update typing status in database"""
-        try:
-            session = DebateSession.objects.get(id=self.session_id)
-            if is_typing:
-                TypingIndicator.objects.update_or_create(
-                    user=self.user,
-                    session=session,
-                    defaults={'is_typing': True, 'updated_at': timezone.now()}
-                )
-            else:
-                TypingIndicator.objects.filter(
-                    user=self.user,
-                    session=session
-                ).delete()
-        except Exception as e:
-            print(f"Error updating typing status: {e}")
-
-    @database_sync_to_async
-    def clear_typing_indicator(self, broadcast=False):
-        """Clear typing indicator"""
-        try:
-            TypingIndicator.objects.filter(
-                user=self.user,
-                session_id=self.session_id
-            ).delete()
-            
-            if broadcast:
-                # This will be called from async context, so we need to use channel layer
-                return True
-        except Exception as e:
-            print(f"Error clearing typing indicator: {e}")
-            return False
-
-    @database_sync_to_async
-    def save_message(self, content):
-        """Save message to database"""
-        try:
-            session = DebateSession.objects.get(id=self.session_id, is_active=True)
-            
-            # Check if user is still an active participant
-            participant = Participant.objects.get(
-                user=self.user,
-                session=session,
-                is_active=True
-            )
-            
-            # For testing, allow messages even if session is not ongoing
-            # TODO: Re-enable this check for production
-            # if not session.is_ongoing:
-            #     return None
-                
-            message = Message.objects.create(
-                session=session,
-                sender=self.user,
-                content=content
-            )
-            print(f"Message saved: {message.id} - {content[:50]}...")
-            return message
-        except (DebateSession.DoesNotExist, Participant.DoesNotExist):
-            print(f"Session {self.session_id} not found or user not a participant")
-            return None
-        except Exception as e:
-            print(f"Error saving message: {e}")
-            return None
\ No newline at end of file
@@ -0,0 +1,50 @@
+import functools
+
+from apps.metrics.registry import registry, timed_database_sync_to_async
+from .conf import realtime_setting
+
+DB_ASYNC_ORM_SECONDS = registry.histogram(
+    'db_async_orm_seconds',
+    "Time awaiting a database call made through Django's async ORM API",
+    labels=('operation',)
+)
+
+
+class database_operation:
+    """
+    A database call made from the WebSocket consumers, with a sync
+    implementation run through the thread pool and, optionally, a second
+    one written against Django's async ORM API (aget, acreate, ...):
+
+        @database_operation
+        def clear_typing_indicator(self):
+            TypingIndicator.objects.filter(...).delete()
+
+        @clear_typing_indicator.native
+        async def clear_typing_indicator(self):
+            await TypingIndicator.objects.filter(...).adelete()
+
+    The ASYNC_ORM setting picks which one runs, so the two can be compared
+    (see the benchmark_db_access command).
+    """
+
+    def __init__(self, func):
+        self.in_thread = timed_database_sync_to_async(func)
+        self.native_func = None
+        self.operation = func.__qualname__
+        functools.update_wrapper(self, func)
+
+    def native(self, func):
+        self.native_func = func
+        return self
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return functools.partial(self.__call__, instance)
+
+    async def __call__(self, *args, **kwargs):
+        if self.native_func is not None and realtime_setting('ASYNC_ORM'):
+            with DB_ASYNC_ORM_SECONDS.time(operation=self.operation):
+                return await self.native_func(*args, **kwargs)
+        return await self.in_thread(*args, **kwargs)
@@ -0,0 +1,118 @@
+import asyncio
+import random
+import signal
+import threading
+import time
+import weakref
+
+from apps.metrics.registry import registry
+from .conf import realtime_setting
+from .message_writer import message_writer
+from .presence import presence
+
+DRAIN_CLOSED = registry.counter(
+    'ws_drain_closed_total', 'Connections asked to reconnect elsewhere while draining'
+)
+
+
+class WorkerDrain:
+    """
+    Empties this worker of WebSocket clients ahead of a restart.
+
+    Deploys send DRAIN_SIGNAL (SIGUSR2 by default) to each worker, wait
+    for ws_drain_finished to read 1, then stop it. Once draining, new
+    sockets are refused and open ones are sent a reconnect frame with a
+    random retry_after of up to DRAIN_RECONNECT_JITTER seconds, then
+    closed with 1012 (service restart). Closes are spread over
+    DRAIN_CLOSE_SPREAD seconds, so clients come back spread out instead
+    of all re-running the connect path at once. Buffered chat messages
+    and presence are flushed once the clients are gone.
+    """
+
+    def __init__(self):
+        self._consumers = weakref.WeakSet()
+        self.draining = False
+        self.started_at = None
+        self.finished = False
+        self._loops = set()
+        self._task = None
+
+    @property
+    def remaining(self):
+        return len(self._consumers)
+
+    def track(self, consumer):
+        self._consumers.add(consumer)
+        self._install_signal_handler()
+
+    def untrack(self, consumer):
+        self._consumers.discard(consumer)
+
+    def _install_signal_handler(self):
+        """Listen for the drain signal on the running event loop, once"""
+        loop = asyncio.get_running_loop()
+        if loop in self._loops:
+            return
+        self._loops.add(loop)
+        signal_name = realtime_setting('DRAIN_SIGNAL')
+        if not signal_name:
+            return
+        if threading.current_thread() is not threading.main_thread():
+            # Signals are only delivered to the main thread's loop (tests, async_to_sync)
+            return
+        try:
+            loop.add_signal_handler(getattr(signal, signal_name), self.start)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError) as e:
+            print(f"Drain signal {signal_name} not installed: {e}")
+
+    def start(self):
+        """Begin draining; safe to call more than once"""
+        if self.draining:
+            return self._task
+        self.draining = True
+        self.started_at = time.monotonic()
+        print(f"Draining worker: {self.remaining} WebSocket connections to move")
+        self._task = asyncio.get_running_loop().create_task(self.drain())
+        return self._task
+
+    async def drain(self):
+        """Close every tracked connection, then flush buffered state"""
+        consumers = list(self._consumers)
+        spread = realtime_setting('DRAIN_CLOSE_SPREAD')
+        jitter = realtime_setting('DRAIN_RECONNECT_JITTER')
+        batch_size = realtime_setting('DRAIN_BATCH_SIZE')
+        batches = [consumers[i:i + batch_size] for i in range(0, len(consumers), batch_size)]
+        pause = spread / len(batches) if batches else 0
+
+        for number, batch in enumerate(batches, 1):
+            for consumer in batch:
+                try:
+                    await consumer.ask_to_reconnect(random.uniform(0, jitter))
+                    DRAIN_CLOSED.inc()
+                except Exception as e:
+                    print(f"Error draining connection: {e}")
+            print(f"Draining worker: closed batch {number}/{len(batches)}, {self.remaining} connections open")
+            if number < len(batches):
+                await asyncio.sleep(pause)
+
+        # Closed sockets leave their sessions in disconnect(); wait for that
+        # before flushing, so the presence snapshot includes the departures
+        deadline = time.monotonic() + realtime_setting('DRAIN_TIMEOUT')
+        while self.remaining and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        await message_writer.flush()
+        await presence.flush()
+        self.finished = True
+        print(
+            f"Worker drained in {time.monotonic() - self.started_at:.1f}s, "
+            f"{self.remaining} connections still open"
+        )
+
+
+drain = WorkerDrain()
+registry.register_collector(lambda: [
+    ('ws_draining', 'gauge', 'Whether this worker is draining (1) or accepting connections (0)', int(drain.draining)),
+    ('ws_drain_remaining', 'gauge', 'WebSocket connections still open on this worker', drain.remaining),
+    ('ws_drain_finished', 'gauge', 'Whether draining has finished flushing buffered state', int(drain.finished)),
+])
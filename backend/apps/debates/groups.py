@@ -0,0 +1,90 @@
+from channels.layers import get_channel_layer
+
+from apps.metrics.registry import registry
+from .membership import membership_cache
+from .protocol import encode_json, encode_msgpack
+from .recent_messages import recent_messages
+from .replay import replay_buffer
+
+BROADCAST_SECONDS = registry.histogram(
+    'ws_broadcast_seconds',
+    'Time to fan a group event out through the channel layer',
+    labels=('event',)
+)
+
+
+def room_group_name(session_id):
+    """Channel layer group for everyone connected to a debate session"""
+    return f'debate_{session_id}'
+
+
+def user_group_name(user_id):
+    """Channel layer group for a user's notification stream"""
+    return f'user_{user_id}'
+
+
+def encoded_event(payload):
+    """A broadcast.frame group event carrying payload in both wire formats"""
+    return {
+        'type': 'broadcast.frame',
+        'event': payload['type'],
+        'text': encode_json(payload),
+        'bytes': encode_msgpack(payload),
+    }
+
+
+async def broadcast(session_id, payload, exclude_user_id=None, coalesce_key=None, sequence=None, record=None,
+                    exclude_channel=None):
+    """
+    Send a frame to every consumer in a session's room group.
+
+    The payload is encoded once here, in both the JSON and MessagePack
+    wire formats, and travels through the channel layer pre-encoded, so
+    each recipient only writes the one its client negotiated instead of
+    re-encoding the same dict. Consumers of exclude_user_id, and the one
+    listening on exclude_channel, skip the frame.
+    A queued frame with the same coalesce_key is replaced by this one in
+    recipients' outbound queues. Chat messages pass their sequence and
+    their REST representation (record), which are kept here, once, in
+    this worker's replay buffer and recent message cache. Frames carry the
+    session_id for clients multiplexing several sessions over one socket.
+    """
+    event = encoded_event({**payload, 'session_id': session_id})
+    event['session_id'] = session_id
+    if exclude_user_id is not None:
+        event['exclude_user_id'] = exclude_user_id
+    if exclude_channel is not None:
+        event['exclude_channel'] = exclude_channel
+    if coalesce_key is not None:
+        event['coalesce_key'] = coalesce_key
+    if sequence is not None:
+        event['sequence'] = sequence
+        replay_buffer.add(session_id, sequence, event)
+    if record is not None:
+        found, membership = membership_cache.peek(session_id)
+        if membership is not None:
+            await recent_messages.add(session_id, record, membership.end_time)
+    with BROADCAST_SECONDS.time(event=payload['type']):
+        await get_channel_layer().group_send(room_group_name(session_id), event)
+
+
+async def send_to_user(user_id, payload):
+    """Send a frame, encoded once, to every socket subscribed to a user's notification stream"""
+    with BROADCAST_SECONDS.time(event=payload['type']):
+        await get_channel_layer().group_send(user_group_name(user_id), encoded_event(payload))
+
+
+async def send_sanction(session_id, user_id, action, expires_at=None):
+    """
+    Tell every consumer in a session's room, in every worker, about a
+    moderation action so they can update their sanction caches and
+    disconnect removed users.
+    """
+    await get_channel_layer().group_send(room_group_name(session_id), {
+        'type': 'sanction.update',
+        'session_id': session_id,
+        'user_id': user_id,
+        'action': action,
+        # Channel layers serialize with msgpack, which has no datetimes
+        'expires_at': expires_at.isoformat() if expires_at else None,
+    })
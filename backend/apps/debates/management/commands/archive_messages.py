@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...archive import archive_session, sessions_to_archive
+from ...conf import realtime_setting
+from ...models import Message
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the messages of sessions that ended a while ago out of the Message table, '
+        'into one compressed archive per session'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=realtime_setting('ARCHIVE_AFTER_DAYS'),
+            help='Archive sessions that ended more than this many days ago'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the sessions that would be archived'
+        )
+
+    def handle(self, *args, **options):
+        ended_before = timezone.now() - timezone.timedelta(days=options['days'])
+        session_ids = list(sessions_to_archive(ended_before))
+
+        archived = 0
+        for session_id in session_ids:
+            if options['dry_run']:
+                count = Message.objects.filter(session_id=session_id).count()
+            else:
+                # One transaction per session, so an interrupted run keeps what it did
+                count = archive_session(session_id)
+            self.stdout.write(f"Session {session_id}: {count} messages")
+            archived += count
+
+        verb = 'would be archived' if options['dry_run'] else 'archived'
+        self.stdout.write(self.style.SUCCESS(
+            f"{archived} message(s) from {len(session_ids)} session(s) {verb}"
+        ))
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from ...consumers import DebateConsumer
+from ...protocol import encode_json, encode_msgpack
+from ...streams import SessionStream
+
+
+class _BenchUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class Command(BaseCommand):
+    help = 'Measure CPU time per chat broadcast against room size, per-recipient encoding vs encode-once'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 50, 100, 200, 500],
+            help='Room sizes (connected consumers) to measure'
+        )
+        parser.add_argument('--broadcasts', type=int, default=200, help='Broadcasts per room size')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'room size':>10} {'per-recipient':>15} {'encode-once':>13} {'speedup':>8}")
+        for size in options['sizes']:
+            legacy = asyncio.run(self.measure(size, options['broadcasts'], encode_once=False))
+            once = asyncio.run(self.measure(size, options['broadcasts'], encode_once=True))
+            self.stdout.write(
+                f"{size:>10} {legacy * 1e6:>12.0f} us {once * 1e6:>10.0f} us {legacy / once:>7.1f}x"
+            )
+
+    async def measure(self, size, broadcasts, encode_once):
+        """CPU seconds per broadcast through an in-memory layer to `size` consumers"""
+        layer = InMemoryChannelLayer(capacity=broadcasts + 1)
+        consumers = []
+        for user_id in range(size):
+            consumer = DebateConsumer()
+            consumer.user = _BenchUser(user_id)
+            consumer.channel_name = await layer.new_channel()
+            consumer.base_send = self.discard
+            consumer.stream = SessionStream(consumer, 'bench')
+            await layer.group_add('bench', consumer.channel_name)
+            consumers.append(consumer)
+
+        started = time.process_time()
+        for i in range(broadcasts):
+            payload = self.sample_message(i)
+            if encode_once:
+                event = {
+                    'type': 'broadcast.frame',
+                    'event': 'chat_message',
+                    'text': encode_json(payload),
+                    'bytes': encode_msgpack(payload)
+                }
+                handler = DebateConsumer.broadcast_frame
+            else:
+                event = payload
+                handler = DebateConsumer.chat_message
+            await layer.group_send('bench', event)
+            for consumer in consumers:
+                await handler(consumer, await layer.receive(consumer.channel_name))
+        return (time.process_time() - started) / broadcasts
+
+    @staticmethod
+    async def discard(message):
+        pass
+
+    @staticmethod
+    def sample_message(i):
+        return {
+            'type': 'chat_message',
+            'message': {
+                'id': i,
+                'content': 'I think the motion fails because the evidence cited is anecdotal. ' * 3,
+                'user': {'id': 1, 'username': 'student1', 'role': 'STUDENT'},
+                'timestamp': '2025-06-01T12:00:00.000000+00:00'
+            }
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ...membership import membership_cache
+from ...middleware import get_user_by_id
+from ...models import DebateTopic, DebateSession, Message, Participant
+from ...presence import presence
+from ...replay import stored_messages_after
+from ...sequences import message_sequences
+from ...streams import SessionStream
+
+User = get_user_model()
+
+MODES = (('thread pool', False), ('async ORM', True))
+
+
+class _Connection:
+    """Just enough of a consumer for a SessionStream that only touches the database"""
+
+    def __init__(self, user):
+        self.user = user
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare consumer database calls through database_sync_to_async with the async ORM '
+        '(ASYNC_ORM): call latency under concurrency and concurrent WebSocket connects'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 10, 50, 100],
+            help='Database calls in flight at once'
+        )
+        parser.add_argument('--calls', type=int, default=400, help='Database calls per concurrency level')
+        parser.add_argument(
+            '--connections', type=int, nargs='+', default=[25, 50, 100, 200],
+            help='Simultaneous WebSocket connects to try'
+        )
+        parser.add_argument(
+            '--connect-budget', type=float, default=1000.0,
+            help='p95 connect time (ms) a connection count must stay under to count as sustained'
+        )
+        parser.add_argument('--sessions', type=int, default=10, help='Debate sessions to spread users across')
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        users_needed = max(options['connections'])
+        self.stdout.write(f"Creating {users_needed} users in {options['sessions']} sessions (run {run_id})...")
+        self.members = self.create_fixtures(run_id, options['sessions'], users_needed)
+        try:
+            self.stdout.write('\nDatabase call latency (ms)')
+            self.stdout.write(
+                f"{'mode':>12} {'in flight':>9} {'p50':>7} {'p95':>7} {'p99':>7} {'calls/s':>8}"
+            )
+            for concurrency in options['concurrency']:
+                for label, native in MODES:
+                    with self.mode(native):
+                        latencies, elapsed = asyncio.run(self.measure_calls(concurrency, options['calls']))
+                    self.stdout.write(
+                        f"{label:>12} {concurrency:>9} {percentile(latencies, 0.5) * 1000:>7.2f} "
+                        f"{percentile(latencies, 0.95) * 1000:>7.2f} {percentile(latencies, 0.99) * 1000:>7.2f} "
+                        f"{len(latencies) / elapsed:>8.0f}"
+                    )
+
+            self.stdout.write(f"\nSimultaneous WebSocket connects (p95 budget {options['connect_budget']:.0f} ms)")
+            self.stdout.write(f"{'mode':>12} {'clients':>8} {'p50':>8} {'p95':>8} {'failed':>7}")
+            for label, native in MODES:
+                sustained = 0
+                for count in sorted(options['connections']):
+                    with self.mode(native):
+                        connects, failed = asyncio.run(self.measure_connects(count))
+                    p95 = percentile(connects, 0.95) * 1000
+                    self.stdout.write(
+                        f"{label:>12} {count:>8} {percentile(connects, 0.5) * 1000:>8.1f} {p95:>8.1f} {failed:>7}"
+                    )
+                    if failed or p95 > options['connect_budget']:
+                        break
+                    sustained = count
+                self.stdout.write(f"{label:>12} sustained {sustained} simultaneous connects")
+        finally:
+            # Cascades to the topic, sessions, participants and messages
+            User.objects.filter(username__startswith=f'dbbench_{run_id}_').delete()
+
+    @staticmethod
+    def mode(native):
+        return override_settings(DEBATE_REALTIME={**getattr(settings, 'DEBATE_REALTIME', {}), 'ASYNC_ORM': native})
+
+    def create_fixtures(self, run_id, session_count, user_count):
+        users = User.objects.bulk_create([
+            User(
+                username=f'dbbench_{run_id}_{i}',
+                email=f'dbbench_{run_id}_{i}@dbbench.invalid',
+                role='MODERATOR' if i == 0 else 'STUDENT',
+                password='!'
+            )
+            for i in range(user_count + 1)
+        ])
+        if users[0].pk is None:
+            users = list(User.objects.filter(username__startswith=f'dbbench_{run_id}_').order_by('id'))
+        moderator, students = users[0], users[1:]
+
+        topic = DebateTopic.objects.create(
+            title=f'DB benchmark {run_id}',
+            description='Synthetic debate topic created by benchmark_db_access',
+            created_by=moderator
+        )
+        now = timezone.now()
+        sessions = [
+            DebateSession.objects.create(
+                topic=topic,
+                start_time=now - timedelta(minutes=1),
+                end_time=now + timedelta(hours=1),
+                created_by=moderator,
+                max_participants=user_count
+            )
+            for _ in range(session_count)
+        ]
+        members = [(student, sessions[i % session_count]) for i, student in enumerate(students)]
+        Participant.objects.bulk_create([Participant(user=user, session=session) for user, session in members])
+        Message.objects.bulk_create([
+            Message(session=session, sender=user, content=f'Seed message {i}', sequence=i // session_count + 1)
+            for i, (user, session) in enumerate(members[:session_count * 50])
+        ])
+        return members
+
+    async def measure_calls(self, concurrency, calls):
+        """Latency of each consumer database call with `concurrency` in flight"""
+        in_flight = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def call(i):
+            user, session = self.members[i % len(self.members)]
+            stream = SessionStream(_Connection(user), session.id)
+            operations = (
+                lambda: get_user_by_id(user.id),
+                lambda: membership_cache._aload(session.id),
+                lambda: stored_messages_after(session.id, 0, 50),
+                lambda: message_sequences.stored_max(session.id),
+                lambda: stream.save_message_now('Benchmark message', None),
+            )
+            async with in_flight:
+                started = time.perf_counter()
+                await random.choice(operations)()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(call(i) for i in range(calls)))
+        elapsed = time.perf_counter() - started
+        return sorted(latencies), elapsed
+
+    async def measure_connects(self, count):
+        """Connect `count` clients at once; returns (sorted connect seconds, failures)"""
+        from config.asgi import application
+
+        # Every connect authenticates and loads its session from the database
+        members = self.members[:count]
+        for _, session in members:
+            membership_cache.session_deleted(session.id)
+        connects = []
+        failed = 0
+
+        async def connect(user, session):
+            nonlocal failed
+            token = str(AccessToken.for_user(user))
+            communicator = WebsocketCommunicator(application, f'/ws/debate/{session.id}/?token={token}')
+            started = time.perf_counter()
+            try:
+                connected, _ = await communicator.connect(timeout=30)
+            except asyncio.TimeoutError:
+                connected = False
+            if connected:
+                connects.append(time.perf_counter() - started)
+            else:
+                failed += 1
+            return communicator if connected else None
+
+        communicators = await asyncio.gather(*(connect(user, session) for user, session in members))
+        for communicator in communicators:
+            if communicator is not None:
+                await communicator.disconnect()
+        await presence.flush()
+        return sorted(connects), failed
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ...message_writer import message_writer
+from ...models import DebateTopic, DebateSession, Participant
+from ...presence import presence
+
+User = get_user_model()
+
+
+class QueryCounter:
+    """execute_wrapper counting statements on every database connection"""
+
+    def __init__(self):
+        self.by_statement = Counter()
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.enabled:
+            with self._lock:
+                self.by_statement[sql.split(None, 1)[0].upper()] += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @property
+    def total(self):
+        return sum(self.by_statement.values())
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive synthetic WebSocket clients through DebateConsumer in-process and report '
+        'throughput, broadcast latency and database queries'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=5, help='Debate sessions (rooms)')
+        parser.add_argument('--clients', type=int, default=50, help='Clients, spread evenly across sessions')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to drive traffic for')
+        parser.add_argument('--message-rate', type=float, default=0.1, help='Chat messages per client per second')
+        parser.add_argument('--typing-rate', type=float, default=0.3, help='Typing events per client per second')
+        parser.add_argument('--ping-rate', type=float, default=0.05, help='Pings per client per second')
+        parser.add_argument('--message-size', type=int, default=120, help='Characters per chat message')
+        parser.add_argument('--keep-data', action='store_true', help="Don't delete the synthetic users and sessions")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        self.stdout.write(f"Creating {options['clients']} clients in {options['sessions']} sessions (run {run_id})...")
+        clients = self.create_fixtures(run_id, options['sessions'], options['clients'])
+
+        self.queries = QueryCounter()
+        for connection in connections.all():
+            self.queries.install(connection=connection)
+        connection_created.connect(self.queries.install)
+        try:
+            stats = asyncio.run(self.run(clients, options))
+        finally:
+            connection_created.disconnect(self.queries.install)
+            if not options['keep_data']:
+                # Cascades to the topic, sessions, participants and messages
+                User.objects.filter(username__startswith=f'loadtest_{run_id}_').delete()
+
+        self.report(stats, options)
+
+    def create_fixtures(self, run_id, session_count, client_count):
+        """Synthetic users and live sessions; returns [(user, session_id)] for the clients"""
+        users = User.objects.bulk_create([
+            User(
+                username=f'loadtest_{run_id}_{i}',
+                email=f'loadtest_{run_id}_{i}@loadtest.invalid',
+                role='MODERATOR' if i == 0 else 'STUDENT',
+                password='!'
+            )
+            for i in range(client_count + 1)
+        ])
+        if users[0].pk is None:
+            users = list(User.objects.filter(username__startswith=f'loadtest_{run_id}_').order_by('id'))
+        moderator, students = users[0], users[1:]
+
+        topic = DebateTopic.objects.create(
+            title=f'Load test {run_id}',
+            description='Synthetic debate topic created by loadtest_websockets',
+            created_by=moderator
+        )
+        now = timezone.now()
+        sessions = [
+            DebateSession.objects.create(
+                topic=topic,
+                start_time=now - timedelta(minutes=1),
+                end_time=now + timedelta(hours=1),
+                created_by=moderator,
+                max_participants=client_count
+            )
+            for _ in range(session_count)
+        ]
+
+        clients = [(student, sessions[i % session_count].id) for i, student in enumerate(students)]
+        Participant.objects.bulk_create([Participant(user=user, session_id=session_id) for user, session_id in clients])
+        for session in sessions:
+            session.participants_count = sum(1 for _, session_id in clients if session_id == session.id)
+            session.save(update_fields=['participants_count'])
+        return clients
+
+    async def run(self, clients, options):
+        from config.asgi import application
+
+        stats = {
+            'connect_seconds': [],
+            'connect_failures': 0,
+            'latencies': [],
+            'sent': Counter(),
+            'received': Counter(),
+            'rate_limited': 0,
+        }
+        padding = 'x' * max(0, options['message_size'] - 40)
+
+        async def connect(user, session_id):
+            token = str(AccessToken.for_user(user))
+            communicator = WebsocketCommunicator(application, f'/ws/debate/{session_id}/?token={token}')
+            started = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=10)
+            if not connected:
+                stats['connect_failures'] += 1
+                return None
+            stats['connect_seconds'].append(time.perf_counter() - started)
+            return communicator
+
+        async def read(communicator):
+            while True:
+                frame = json.loads(await communicator.receive_from(timeout=3600))
+                stats['received'][frame['type']] += 1
+                if frame['type'] == 'chat_message':
+                    marker = frame['message']['content'].split(' ', 1)[0]
+                    if marker.startswith('lt:'):
+                        stats['latencies'].append(time.perf_counter() - float(marker[3:]))
+                elif frame.get('code') == 'rate_limited':
+                    stats['rate_limited'] += 1
+
+        async def drive(communicator, rate, make_frame):
+            if rate <= 0:
+                return
+            while True:
+                await asyncio.sleep(random.expovariate(rate))
+                frame = make_frame()
+                await communicator.send_json_to(frame)
+                stats['sent'][frame['type']] += 1
+
+        def chat():
+            return {'type': 'chat_message', 'content': f'lt:{time.perf_counter()!r} {padding}'}
+
+        communicators = []
+        for user, session_id in clients:
+            communicator = await connect(user, session_id)
+            if communicator is not None:
+                communicators.append(communicator)
+        self.stdout.write(f"Connected {len(communicators)} clients, driving traffic for {options['duration']}s...")
+
+        self.queries.enabled = True
+        started = time.perf_counter()
+        tasks = []
+        for communicator in communicators:
+            tasks.append(asyncio.create_task(read(communicator)))
+            tasks.append(asyncio.create_task(drive(communicator, options['message_rate'], chat)))
+            tasks.append(asyncio.create_task(drive(
+                communicator, options['typing_rate'], lambda: {'type': 'typing', 'is_typing': random.random() < 0.7}
+            )))
+            tasks.append(asyncio.create_task(drive(communicator, options['ping_rate'], lambda: {'type': 'ping'})))
+
+        await asyncio.sleep(options['duration'])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Count the writes still buffered as part of the run
+        await message_writer.flush()
+        await presence.flush()
+        stats['elapsed'] = time.perf_counter() - started
+        self.queries.enabled = False
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        await presence.flush()
+        return stats
+
+    def report(self, stats, options):
+        elapsed = stats['elapsed']
+        connects = sorted(stats['connect_seconds'])
+        latencies = sorted(stats['latencies'])
+        delivered = sum(stats['received'].values())
+
+        self.stdout.write('')
+        self.stdout.write(f"Clients: {len(connects)} connected, {stats['connect_failures']} failed, "
+                          f"{options['sessions']} sessions, {elapsed:.1f}s")
+        self.stdout.write(f"Connect: p50 {percentile(connects, 0.5) * 1000:.1f} ms, "
+                          f"p95 {percentile(connects, 0.95) * 1000:.1f} ms, "
+                          f"p99 {percentile(connects, 0.99) * 1000:.1f} ms")
+        for frame_type, count in sorted(stats['sent'].items()):
+            self.stdout.write(f"Sent {frame_type}: {count} ({count / elapsed:.1f}/s)")
+        self.stdout.write(f"Rate limited: {stats['rate_limited']}")
+        self.stdout.write(f"Delivered frames: {delivered} ({delivered / elapsed:.1f}/s) "
+                          + ', '.join(f'{t} {c}' for t, c in sorted(stats['received'].items())))
+        self.stdout.write(f"Broadcast latency (send to each recipient, {len(latencies)} deliveries): "
+                          f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+                          f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+                          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+                          f"max {(latencies[-1] if latencies else 0) * 1000:.1f} ms")
+        self.stdout.write(f"DB queries: {self.queries.total} ({self.queries.total / elapsed:.1f}/s) "
+                          + ', '.join(f'{s} {c}' for s, c in self.queries.by_statement.most_common()))
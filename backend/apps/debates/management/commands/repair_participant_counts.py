@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from ...models import DebateSession
+
+
+class Command(BaseCommand):
+    help = 'Recompute DebateSession.participants_count from the Participant table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report sessions whose counter is wrong'
+        )
+
+    def handle(self, *args, **options):
+        sessions = DebateSession.objects.annotate(
+            actual=Count('participants', filter=Q(participants__is_active=True))
+        ).values_list('id', 'participants_count', 'actual')
+
+        repaired = 0
+        for session_id, stored, actual in sessions.iterator():
+            if stored == actual:
+                continue
+            self.stdout.write(f"Session {session_id}: participants_count {stored} -> {actual}")
+            if not options['dry_run']:
+                DebateSession.objects.filter(id=session_id).update(participants_count=actual)
+            repaired += 1
+
+        verb = 'would be repaired' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f"{repaired} session(s) {verb}"))
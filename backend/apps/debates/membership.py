@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+
+from .conf import realtime_setting
+from .database import database_operation
+from .models import DebateSession, Participant
+
+
+class SessionMembership:
+    """Snapshot of who may take part in a debate session"""
+    __slots__ = ('session_id', 'created_by_id', 'is_active', 'start_time', 'end_time', 'members', 'expires_at')
+
+    def __init__(self, session_id, created_by_id, is_active, start_time, end_time, members, expires_at):
+        self.session_id = session_id
+        self.created_by_id = created_by_id
+        self.is_active = is_active
+        self.start_time = start_time
+        self.end_time = end_time
+        # user id -> (participant id, joined_at) for active participants
+        self.members = members
+        self.expires_at = expires_at
+
+    def is_creator(self, user_id):
+        return user_id == self.created_by_id
+
+    def is_participant(self, user_id):
+        return user_id in self.members
+
+    def can_access(self, user_id):
+        """Session creator (moderator) or an active participant"""
+        return self.is_creator(user_id) or self.is_participant(user_id)
+
+    @property
+    def participants_count(self):
+        return len(self.members)
+
+    def participant_id(self, user_id):
+        member = self.members.get(user_id)
+        return member[0] if member else None
+
+    def joined_at(self, user_id):
+        member = self.members.get(user_id)
+        return member[1] if member else None
+
+    @property
+    def is_ongoing(self):
+        return self.start_time <= timezone.now() <= self.end_time
+
+    @property
+    def has_ended(self):
+        return timezone.now() > self.end_time
+
+
+class MembershipCache:
+    """
+    Per-process cache of session memberships used for authorization.
+
+    A session is loaded with one query the first time it is checked and
+    then kept up to date by the Participant and DebateSession signals in
+    signals.py. Entries also expire after MEMBERSHIP_CACHE_TTL seconds so
+    changes made by other worker processes are picked up.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        # session id -> SessionMembership, or None for sessions that don't exist
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(session_id):
+        try:
+            return int(session_id)
+        except (TypeError, ValueError):
+            return None
+
+    def peek(self, session_id):
+        """Return (found, membership) without touching the database"""
+        key = self._key(session_id)
+        with self._lock:
+            if key in self._entries:
+                membership = self._entries[key]
+                if membership is None or membership.expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return True, membership
+                del self._entries[key]
+        # Ids that can't belong to a session are answered without a lookup
+        return key is None, None
+
+    def get(self, session_id):
+        """Return the session's membership, loading it on a miss; None if the session doesn't exist"""
+        found, membership = self.peek(session_id)
+        if found:
+            return membership
+        return self._load(self._key(session_id))
+
+    async def aget(self, session_id):
+        found, membership = self.peek(session_id)
+        if found:
+            return membership
+        return await self._aload(self._key(session_id))
+
+    @staticmethod
+    def _rows(session_id):
+        """The session's fields joined to each active participant, in a single query"""
+        return DebateSession.objects.filter(id=session_id).annotate(
+            active=FilteredRelation('participants', condition=Q(participants__is_active=True))
+        ).values_list(
+            'created_by_id', 'is_active', 'start_time', 'end_time',
+            'active__id', 'active__user_id', 'active__joined_at'
+        ).order_by()
+
+    def _load(self, session_id):
+        return self._build(session_id, list(self._rows(session_id)))
+
+    @database_operation
+    def _aload(self, session_id):
+        return self._load(session_id)
+
+    @_aload.native
+    async def _aload(self, session_id):
+        return self._build(session_id, [row async for row in self._rows(session_id)])
+
+    def _build(self, session_id, rows):
+        """Cache the membership read by _rows()"""
+        if not rows:
+            membership = None
+        else:
+            created_by_id, is_active, start_time, end_time = rows[0][:4]
+            membership = SessionMembership(
+                session_id=session_id,
+                created_by_id=created_by_id,
+                is_active=is_active,
+                start_time=start_time,
+                end_time=end_time,
+                # A session without active participants comes back as one row of NULLs
+                members={
+                    user_id: (participant_id, joined_at)
+                    for participant_id, user_id, joined_at in (row[4:] for row in rows)
+                    if participant_id is not None
+                },
+                expires_at=time.monotonic() + self.ttl
+            )
+        self._store(session_id, membership)
+        return membership
+
+    def _store(self, session_id, membership):
+        with self._lock:
+            self._entries[session_id] = membership
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def participant_saved(self, participant):
+        with self._lock:
+            membership = self._entries.get(participant.session_id)
+            if membership is None:
+                return
+            if participant.is_active:
+                membership.members[participant.user_id] = (participant.id, participant.joined_at)
+            else:
+                membership.members.pop(participant.user_id, None)
+
+    def participant_deleted(self, participant):
+        with self._lock:
+            membership = self._entries.get(participant.session_id)
+            if membership is not None:
+                membership.members.pop(participant.user_id, None)
+
+    def member_removed(self, session_id, user_id):
+        """Drop a member removed in another worker, ahead of the TTL"""
+        with self._lock:
+            membership = self._entries.get(self._key(session_id))
+            if membership is not None:
+                membership.members.pop(user_id, None)
+
+    def session_saved(self, session):
+        # A session loaded with only() or defer() would fetch the fields it
+        # lacks one query each; reload the entry on its next use instead
+        partial = bool(session.get_deferred_fields() & {'created_by_id', 'is_active', 'start_time', 'end_time'})
+        with self._lock:
+            membership = self._entries.get(session.id)
+            if membership is not None and partial:
+                del self._entries[session.id]
+            elif membership is not None:
+                membership.created_by_id = session.created_by_id
+                membership.is_active = session.is_active
+                membership.start_time = session.start_time
+                membership.end_time = session.end_time
+            elif session.id in self._entries:
+                # Previously cached as missing
+                del self._entries[session.id]
+
+    def session_deleted(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+membership_cache = MembershipCache(
+    max_size=realtime_setting('MEMBERSHIP_CACHE_SIZE'),
+    ttl=realtime_setting('MEMBERSHIP_CACHE_TTL')
+)
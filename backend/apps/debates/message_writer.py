@@ -0,0 +1,221 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from apps.metrics.registry import registry, timed_database_sync_to_async
+from .conf import realtime_setting
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+WRITE_FAILURES = registry.counter(
+    'chat_message_write_failures_total', 'Buffered chat messages that failed to insert, by what was done with them',
+    labels=('outcome',)
+)
+
+
+class MessageIdAllocator:
+    """
+    Hands out message ids before the row is inserted, so a message can be
+    broadcast while it is still waiting in the write buffer.
+
+    Ids are milliseconds since EPOCH_MS (41 bits), then the worker id
+    (5 bits), then a per-millisecond counter (6 bits). That keeps them
+    increasing, unique across up to 32 workers with distinct
+    MESSAGE_WRITER_WORKER_IDs and below 2**53 so
+    JavaScript clients can still represent them exactly.
+    """
+    EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+    WORKER_BITS = 5
+    SEQUENCE_BITS = 6
+
+    def __init__(self, worker_id):
+        # Two workers sharing an id would hand out the same ids
+        if worker_id is None or not 0 <= worker_id < (1 << self.WORKER_BITS):
+            raise ImproperlyConfigured(
+                f"MESSAGE_WRITER_WORKER_ID must be set to a number from 0 to {(1 << self.WORKER_BITS) - 1} "
+                f"unique to each worker process when MESSAGE_WRITE_MODE is 'batched', got {worker_id!r}"
+            )
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            now_ms = int(time.time() * 1000) - self.EPOCH_MS
+            if now_ms < self._last_ms:
+                # Clock went backwards; keep ids increasing
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) % (1 << self.SEQUENCE_BITS)
+                if self._sequence == 0:
+                    # Counter exhausted for this millisecond, borrow the next one
+                    now_ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (
+                (now_ms << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+class MessageWriter:
+    """
+    Write-behind buffer for chat messages.
+
+    Messages get their id and timestamp up front and are inserted with
+    bulk_create once MESSAGE_FLUSH_SIZE messages are waiting or
+    MESSAGE_FLUSH_INTERVAL seconds have passed. Anything still buffered
+    when the process exits is flushed synchronously.
+
+    They have been broadcast already, so a message that fails to insert is
+    put back in the buffer for the next flush, up to MESSAGE_WRITE_ATTEMPTS
+    attempts in all. After that it is dead-lettered: logged in full at
+    ERROR, so it can be re-inserted by hand, and kept in dead_letters.
+    """
+
+    def __init__(self, dead_letter_size=1000):
+        self._ids = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._timer = None
+        # Message id -> failed inserts so far
+        self._attempts = {}
+        self.dead_letters = deque(maxlen=dead_letter_size)
+        atexit.register(self.flush_sync)
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = MessageIdAllocator(realtime_setting('MESSAGE_WRITER_WORKER_ID'))
+        return self._ids
+
+    def check_configuration(self):
+        """Raise ImproperlyConfigured at startup rather than on the first chat message"""
+        if realtime_setting('MESSAGE_WRITE_MODE') == 'batched':
+            self.ids
+
+    def enqueue(self, session_id, sender, content, sequence=None):
+        """Buffer a new message and return it with its id and timestamp assigned"""
+        message = Message(
+            id=self.ids.next_id(),
+            session_id=session_id,
+            sender=sender,
+            content=content,
+            sequence=sequence,
+            timestamp=timezone.now()
+        )
+        with self._lock:
+            self._buffer.append(message)
+            buffered = len(self._buffer)
+
+        if buffered >= realtime_setting('MESSAGE_FLUSH_SIZE'):
+            asyncio.get_running_loop().create_task(self.flush())
+        else:
+            self._flush_soon()
+        return message
+
+    def _flush_soon(self):
+        """Flush after MESSAGE_FLUSH_INTERVAL unless a flush is already due"""
+        loop = asyncio.get_running_loop()
+        timer = self._timer
+        if timer is None or timer.done() or timer is asyncio.current_task() or timer.get_loop() is not loop:
+            self._timer = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(realtime_setting('MESSAGE_FLUSH_INTERVAL'))
+        await self.flush()
+
+    @property
+    def buffered(self):
+        return len(self._buffer)
+
+    def _take_batch(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        return batch
+
+    async def flush(self):
+        """Write everything buffered so far"""
+        batch = self._take_batch()
+        if batch:
+            failed = await timed_database_sync_to_async(self.write_batch)(batch)
+            if self._handle_failures(batch, failed, retry=True):
+                self._flush_soon()
+
+    def flush_sync(self):
+        """Write everything buffered so far, for use outside the event loop"""
+        batch = self._take_batch()
+        if batch:
+            # Nothing runs after this at exit, so failures are dead-lettered
+            self._handle_failures(batch, self.write_batch(batch), retry=False)
+
+    @staticmethod
+    def write_batch(batch):
+        """
+        Insert a batch, falling back to row by row so one bad row can't sink
+        the rest. Returns the (message, error) pairs that failed.
+        """
+        try:
+            Message.objects.bulk_create(batch)
+            return []
+        except Exception as e:
+            logger.warning("Error writing message batch of %d, retrying individually: %s", len(batch), e)
+
+        failed = []
+        for message in batch:
+            try:
+                message.save(force_insert=True)
+            except Exception as e:
+                failed.append((message, e))
+        return failed
+
+    def _handle_failures(self, batch, failed, retry):
+        """Requeue or dead-letter failed messages; returns whether any were requeued"""
+        failed_ids = {message.id for message, _ in failed}
+        for message in batch:
+            if message.id not in failed_ids:
+                self._attempts.pop(message.id, None)
+
+        requeue = []
+        for message, error in failed:
+            attempts = self._attempts.pop(message.id, 0) + 1
+            if retry and attempts < realtime_setting('MESSAGE_WRITE_ATTEMPTS'):
+                self._attempts[message.id] = attempts
+                requeue.append(message)
+                WRITE_FAILURES.inc(outcome='requeued')
+                logger.warning("Error saving message %s (attempt %d), requeued: %s", message.id, attempts, error)
+            else:
+                self.dead_letter(message, error, attempts)
+        if requeue:
+            with self._lock:
+                self._buffer[:0] = requeue
+        return bool(requeue)
+
+    def dead_letter(self, message, error, attempts):
+        """Give up on a message, keeping enough of it to insert it again"""
+        WRITE_FAILURES.inc(outcome='dead_lettered')
+        self.dead_letters.append(message)
+        logger.error(
+            "Dropped chat message after %d failed inserts: %s. id=%s session_id=%s sender_id=%s "
+            "sequence=%s timestamp=%s content=%r",
+            attempts, error, message.id, message.session_id, message.sender_id,
+            message.sequence, message.timestamp.isoformat(), message.content
+        )
+
+
+message_writer = MessageWriter()
+registry.register_collector(lambda: [
+    ('chat_messages_buffered', 'gauge', 'Chat messages waiting to be written', message_writer.buffered),
+    ('chat_messages_dead_lettered', 'gauge', 'Chat messages given up on and kept in dead_letters',
+     len(message_writer.dead_letters)),
+])
@@ -1,56 +1,161 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
 from channels.middleware import BaseMiddleware
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import UntypedToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from jwt import decode as jwt_decode
-from django.conf import settings
+from rest_framework_simplejwt.settings import api_settings
 from urllib.parse import parse_qs
 
+from apps.metrics.registry import registry
+from .conf import realtime_setting
+from .database import database_operation
+from .versions import aget_version
+
 User = get_user_model()
 
 
-@database_sync_to_async
-def get_user_from_token(token_string):
+class TokenUserCache:
+    """
+    LRU cache of users resolved from JWT access tokens.
+    Entries are keyed by the token's jti and never outlive the token itself
+    or JWT_USER_CACHE_TTL seconds, whichever comes first.
+
+    Each entry also remembers the user's shared ('user', id) version from
+    versions.py, which is bumped whenever the user is saved or deleted in
+    any worker; an entry read with a newer version is a miss, so
+    deactivations take effect everywhere on the next connect.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (user, expires_at, version)
+        self._keys_by_user = defaultdict(set)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time() and entry[2] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._discard(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, user, token_expires_at, version):
+        with self._lock:
+            expires_at = min(time.time() + self.ttl, token_expires_at)
+            self._entries[key] = (user, expires_at, version)
+            self._entries.move_to_end(key)
+            self._keys_by_user[user.pk].add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drop every cached token of a user, e.g. after deactivation"""
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._discard(key)
+
+    def _discard(self, key):
+        user = self._entries.pop(key)[0]
+        keys = self._keys_by_user.get(user.pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user.pk]
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+token_user_cache = TokenUserCache(
+    max_size=realtime_setting('JWT_USER_CACHE_SIZE'),
+    ttl=realtime_setting('JWT_USER_CACHE_TTL')
+)
+registry.register_collector(lambda: [
+    ('ws_token_cache_size', 'gauge', 'Users held in the WebSocket token cache', token_user_cache.stats()['size']),
+    ('ws_token_cache_hits_total', 'counter', 'WebSocket token cache hits', token_user_cache.hits),
+    ('ws_token_cache_misses_total', 'counter', 'WebSocket token cache misses', token_user_cache.misses),
+    ('ws_token_cache_evictions_total', 'counter', 'WebSocket token cache evictions', token_user_cache.evictions),
+])
+
+
+@database_operation
+def get_user_by_id(user_id):
+    return User.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+
+
+@get_user_by_id.native
+async def get_user_by_id(user_id):
+    return await User.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+
+
+async def get_user_from_token(token_string):
     """Get user from JWT token"""
     try:
-        # Validate token
-        UntypedToken(token_string)
-        
-        # Decode token to get user_id
-        decoded_data = jwt_decode(
-            token_string, 
-            settings.SECRET_KEY, 
-            algorithms=["HS256"]
-        )
-        user_id = decoded_data.get('user_id')
-        
-        if user_id:
-            user = User.objects.get(id=user_id)
-            return user
+        # Verifies signature and expiry in a single decode
+        token = UntypedToken(token_string)
+    except (InvalidToken, TokenError) as e:
+        print(f"Token authentication error: {e}")
         return AnonymousUser()
-        
-    except (InvalidToken, TokenError, User.DoesNotExist, Exception) as e:
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    if not user_id:
+        return AnonymousUser()
+
+    cache_key = token.get(api_settings.JTI_CLAIM) or f'user:{user_id}'
+    # Read before the user, so a change made meanwhile isn't cached as current
+    version = await aget_version('user', user_id)
+    user = token_user_cache.get(cache_key, version)
+    if user is not None:
+        return user
+
+    try:
+        user = await get_user_by_id(user_id)
+    except Exception as e:
         print(f"Token authentication error: {e}")
         return AnonymousUser()
 
+    if not user.is_active:
+        return AnonymousUser()
+
+    token_user_cache.set(cache_key, user, token['exp'], version)
+    return user
+
 
 class JWTAuthMiddleware(BaseMiddleware):
     """Custom middleware to authenticate WebSocket connections using JWT tokens"""
-    
+
     async def __call__(self, scope, receive, send):
         # Parse query string for token
         query_string = scope.get('query_string', b'').decode()
         query_params = parse_qs(query_string)
         token = query_params.get('token', [None])[0]
-        
+
         # Authenticate user
         if token:
             scope['user'] = await get_user_from_token(token)
         else:
             scope['user'] = AnonymousUser()
-            
+
         return await super().__call__(scope, receive, send)
 
 
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:15
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_participants_count(apps, schema_editor):
+    DebateSession = apps.get_model('debates', 'DebateSession')
+    Participant = apps.get_model('debates', 'Participant')
+    active = Participant.objects.filter(
+        session=models.OuterRef('pk'), is_active=True
+    ).values('session').annotate(count=models.Count('pk')).values('count')
+    DebateSession.objects.update(
+        participants_count=Coalesce(models.Subquery(active), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debates', '0003_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='debatesession',
+            name='participants_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_participants_count, migrations.RunPython.noop),
+    ]
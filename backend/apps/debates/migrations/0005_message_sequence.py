@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_sequences(apps, schema_editor):
+    Message = apps.get_model('debates', 'Message')
+    session_ids = Message.objects.values_list('session_id', flat=True).distinct()
+    for session_id in session_ids:
+        messages = list(Message.objects.filter(session_id=session_id).order_by('timestamp', 'id'))
+        for sequence, message in enumerate(messages, start=1):
+            message.sequence = sequence
+        Message.objects.bulk_update(messages, ['sequence'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debates', '0004_debatesession_participants_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='sequence',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'sequence'], name='debates_mes_session_883ea8_idx'),
+        ),
+        migrations.RunPython(backfill_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debates', '0005_message_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='debates_mes_session_4c5a38_idx',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'timestamp', 'id'], name='debates_mes_session_4d1f22_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debates', '0006_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('sender_counts', models.JSONField(default=dict)),
+                ('last_sequence', models.PositiveBigIntegerField(null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='message_archive', to='debates.debatesession')),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_sender_counts(apps, schema_editor):
+    MessageArchive = apps.get_model('debates', 'MessageArchive')
+    ArchivedMessageCount = apps.get_model('debates', 'ArchivedMessageCount')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    counts = [
+        (archive_id, int(user_id), count)
+        for archive_id, sender_counts in MessageArchive.objects.values_list('id', 'sender_json')
+        for user_id, count in sender_counts.items()
+    ]
+    # Archived messages can outlive their senders
+    users = set(User.objects.filter(id__in={user_id for _, user_id, _ in counts}).values_list('id', flat=True))
+    ArchivedMessageCount.objects.bulk_create([
+        ArchivedMessageCount(archive_id=archive_id, user_id=user_id, count=count)
+        for archive_id, user_id, count in counts
+        if user_id in users
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debates', '0007_message_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Out of the way of the new reverse relation's name
+        migrations.RenameField(
+            model_name='messagearchive',
+            old_name='sender_counts',
+            new_name='sender_json',
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessageCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField()),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sender_counts', to='debates.messagearchive')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_message_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('archive', 'user')},
+            },
+        ),
+        migrations.RunPython(copy_sender_counts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='messagearchive',
+            name='sender_json',
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from django.core.validators import MinLengthValidator
+from django.utils import timezone
 
 
 class DebateTopic(models.Model):
@@ -52,6 +53,8 @@ class DebateSession(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
     max_participants = models.PositiveIntegerField(default=20)
+    # Active participants, maintained by signals; see repair_participant_counts
+    participants_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['start_time']
@@ -63,6 +66,19 @@ class DebateSession(models.Model):
     def __str__(self):
         return f"{self.topic.title} - {self.start_time}"
 
+    def save(self, *args, **kwargs):
+        # participants_count only moves through the F() updates in signals.py;
+        # a full save would write back the value loaded with this instance,
+        # losing joins and leaves made since. Deferred fields are left out as
+        # Django's own save does, rather than loaded one query each and written back
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'participants_count' and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
     @property
     def is_ongoing(self):
         from django.utils import timezone
@@ -189,15 +205,62 @@ class Message(models.Model):
         validators=[MinLengthValidator(1)],
         help_text="Message content"
     )
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: batched writes assign the timestamp before the insert
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # Position in the session's stream, used to resume after a reconnect
+    sequence = models.PositiveBigIntegerField(null=True, editable=False)
     is_deleted = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['timestamp']
         indexes = [
             models.Index(fields=['timestamp']),
-            models.Index(fields=['session', 'timestamp']),
+            # Keyset pagination on (timestamp, id), see pagination.py
+            models.Index(fields=['session', 'timestamp', 'id']),
+            models.Index(fields=['session', 'sequence']),
         ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}..."
+
+
+class MessageArchive(models.Model):
+    """
+    The messages of an ended session, compacted out of the Message table
+    by the archive_messages command; see archive.py
+    """
+    session = models.OneToOneField(
+        DebateSession,
+        on_delete=models.CASCADE,
+        related_name='message_archive'
+    )
+    # Gzipped JSON lines, one message each, in (timestamp, id) order
+    data = models.BinaryField()
+    # Messages that aren't deleted; ArchivedMessageCount has them per sender
+    message_count = models.PositiveIntegerField(default=0)
+    last_sequence = models.PositiveBigIntegerField(null=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Archive of session {self.session_id}: {self.message_count} messages"
+
+
+class ArchivedMessageCount(models.Model):
+    """Messages (not deleted) a user sent that are in an archive, so stats needn't read archives"""
+    archive = models.ForeignKey(
+        MessageArchive,
+        on_delete=models.CASCADE,
+        related_name='sender_counts'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_message_counts'
+    )
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ['archive', 'user']
+
+    def __str__(self):
+        return f"{self.user_id} sent {self.count} messages in archive {self.archive_id}"
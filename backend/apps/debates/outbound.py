@@ -0,0 +1,147 @@
+import asyncio
+from collections import deque
+
+from apps.metrics.registry import registry
+
+OUTBOUND_DROPPED = registry.counter(
+    'ws_outbound_dropped_total', 'Low priority frames dropped from full outbound queues', labels=('type',)
+)
+OUTBOUND_COALESCED = registry.counter(
+    'ws_outbound_coalesced_total', 'Queued frames replaced by a newer frame with the same key', labels=('type',)
+)
+OUTBOUND_OVER_BUDGET = registry.counter(
+    'ws_outbound_over_budget_total', 'Connections closed for staying over their outbound queue budget'
+)
+
+# Chatter that is only worth delivering in its latest form
+LOW_PRIORITY_EVENTS = {'typing_indicator', 'online_count_update'}
+
+
+class _Frame:
+    __slots__ = ('event', 'text_data', 'bytes_data', 'key', 'low_priority')
+
+    def __init__(self, event, text_data, bytes_data, key, low_priority):
+        self.event = event
+        self.text_data = text_data
+        self.bytes_data = bytes_data
+        self.key = key
+        self.low_priority = low_priority
+
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded frames waiting to be written to one client.
+
+    A writer task drains the queue so a client that reads slowly no longer
+    holds up the consumer's channel layer inbox. Low priority frames with a
+    coalesce key replace the queued frame with the same key, and once
+    max_size frames are queued new low priority frames are dropped and old
+    ones are evicted to make room for chat. Chat frames are never dropped:
+    a client whose queue stays full for longer than over_budget_seconds
+    is handed to on_over_budget instead, which disconnects it.
+
+    The queue only backs up while send() is waiting on the client, so this
+    relies on the ASGI server applying write backpressure, as uvicorn does.
+    """
+
+    def __init__(self, send, max_size, over_budget_seconds, on_over_budget):
+        self.send = send
+        self.max_size = max_size
+        self.over_budget_seconds = over_budget_seconds
+        self.on_over_budget = on_over_budget
+        self._frames = deque()
+        # coalesce key -> queued frame
+        self._keyed = {}
+        self._ready = asyncio.Event()
+        self._over_budget_since = None
+        self._closed = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, event, text_data=None, bytes_data=None, coalesce_key=None):
+        """Queue a frame; returns False if it was dropped"""
+        if self._closed:
+            return False
+        low_priority = event in LOW_PRIORITY_EVENTS
+
+        if coalesce_key is not None:
+            queued = self._keyed.get(coalesce_key)
+            if queued is not None:
+                queued.text_data = text_data
+                queued.bytes_data = bytes_data
+                OUTBOUND_COALESCED.inc(type=event)
+                return True
+
+        if len(self._frames) >= self.max_size:
+            if low_priority:
+                OUTBOUND_DROPPED.inc(type=event)
+                return False
+            if not self._evict_low_priority():
+                # Full of chat: keep this one too, but only for so long
+                self._check_budget()
+                if self._closed:
+                    return False
+
+        frame = _Frame(event, text_data, bytes_data, coalesce_key, low_priority)
+        self._frames.append(frame)
+        if coalesce_key is not None:
+            self._keyed[coalesce_key] = frame
+        self._ready.set()
+        return True
+
+    def _evict_low_priority(self):
+        """Drop the oldest queued low priority frame to make room"""
+        for frame in self._frames:
+            if frame.low_priority:
+                self._frames.remove(frame)
+                self._forget(frame)
+                OUTBOUND_DROPPED.inc(type=frame.event)
+                return True
+        return False
+
+    def _forget(self, frame):
+        if frame.key is not None and self._keyed.get(frame.key) is frame:
+            del self._keyed[frame.key]
+
+    def _check_budget(self):
+        """Called with the queue full of chat frames"""
+        now = asyncio.get_running_loop().time()
+        if self._over_budget_since is None:
+            self._over_budget_since = now
+        elif now - self._over_budget_since >= self.over_budget_seconds:
+            OUTBOUND_OVER_BUDGET.inc()
+            self.close()
+            asyncio.get_running_loop().create_task(self.on_over_budget())
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self._frames:
+                frame = self._frames.popleft()
+                self._forget(frame)
+                if len(self._frames) < self.max_size:
+                    self._over_budget_since = None
+                try:
+                    await self.send(text_data=frame.text_data, bytes_data=frame.bytes_data)
+                except Exception as e:
+                    print(f"Error sending frame to client: {e}")
+            self._ready.clear()
+
+    async def flush(self):
+        """Write everything still queued now, ahead of closing the socket"""
+        while self._frames:
+            frame = self._frames.popleft()
+            self._forget(frame)
+            try:
+                await self.send(text_data=frame.text_data, bytes_data=frame.bytes_data)
+            except Exception as e:
+                print(f"Error sending frame to client: {e}")
+
+    def close(self):
+        """Discard anything still queued and stop the writer"""
+        self._closed = True
+        self._frames.clear()
+        self._keyed.clear()
+        self._task.cancel()
@@ -0,0 +1,183 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(timestamp, message_id):
+    return base64.urlsafe_b64encode(f'{timestamp.isoformat()}|{message_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor, or None if it isn't one"""
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp = parse_datetime(timestamp)
+        message_id = int(message_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if timestamp is None or timestamp.tzinfo is None:
+        return None
+    return timestamp, message_id
+
+
+def message_key(message):
+    return message.timestamp, message.id
+
+
+def record_key(record):
+    """The (timestamp, id) key of a serialized message"""
+    return parse_datetime(record['timestamp']), record['id']
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination of messages on (timestamp, id).
+
+    Without a cursor the latest page is returned. ?before=<cursor> pages
+    back through older messages (infinite scroll) and ?after=<cursor>
+    fetches what arrived since (incremental sync). Results are oldest
+    first either way; `previous` links to older messages and `next` to
+    newer ones. Every page is one indexed range query however deep it is,
+    where OFFSET pagination read and skipped all the rows before it.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    before_query_param = 'before'
+    after_query_param = 'after'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def parse_request(self, request):
+        """Read the cursor and page size; returns (before, after, page_size)"""
+        self.request = request
+        self.before = self._cursor_param(request, self.before_query_param)
+        self.after = self._cursor_param(request, self.after_query_param)
+        if self.before is not None and self.after is not None:
+            raise NotFound('Use either a before or an after cursor, not both')
+        try:
+            self.size = min(max(int(request.query_params[self.page_size_query_param]), 1), self.max_page_size)
+        except (KeyError, ValueError):
+            self.size = self.page_size
+        return self.before, self.after, self.size
+
+    def _cursor_param(self, request, name):
+        value = request.query_params.get(name)
+        if not value:
+            return None
+        key = decode_cursor(value)
+        if key is None:
+            raise NotFound(self.invalid_cursor_message)
+        return key
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.parse_request(request)
+        return self._page(self.window(queryset), message_key)
+
+    def window(self, queryset):
+        """
+        The messages of a queryset that paginate_messages() needs for the
+        page parsed by parse_request(): the size + 1 before `before` (or
+        the latest ones), or after `after`, oldest first
+        """
+        if self.after is not None:
+            timestamp, message_id = self.after
+            return list(queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+            ).order_by('timestamp', 'id')[:self.size + 1])
+        if self.before is not None:
+            timestamp, message_id = self.before
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+        rows = list(queryset.order_by('-timestamp', '-id')[:self.size + 1])
+        rows.reverse()
+        return rows
+
+    def paginate_messages(self, messages):
+        """Paginate messages gathered from more than one window(), in any order"""
+        messages = sorted(messages, key=message_key)
+        if self.after is not None:
+            messages = messages[:self.size + 1]
+        else:
+            messages = messages[-(self.size + 1):]
+        return self._page(messages, message_key)
+
+    def paginate_records(self, records):
+        """
+        Paginate serialized messages already narrowed to the page, plus one
+        row past it: the size + 1 records before `before` (or the latest
+        ones), or after `after`, oldest first
+        """
+        return self._page(list(records), record_key)
+
+    def _page(self, rows, key):
+        if self.after is not None:
+            self.has_older = True
+            rows = rows[:self.size]
+        else:
+            self.has_older = len(rows) > self.size
+            rows = rows[-self.size:]
+        self.first_key = key(rows[0]) if rows else None
+        self.last_key = key(rows[-1]) if rows else None
+        return rows
+
+    @property
+    def is_latest_page(self):
+        return self.before is None and self.after is None
+
+    def get_next_link(self):
+        """Messages after this page; also where to poll for new ones"""
+        key = self.last_key or self.after
+        if key is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.before_query_param)
+        return replace_query_param(url, self.after_query_param, encode_cursor(*key))
+
+    def get_previous_link(self):
+        key = self.first_key or self.after
+        if not self.has_older or key is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.after_query_param)
+        return replace_query_param(url, self.before_query_param, encode_cursor(*key))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        cursor = {'type': 'string'}
+        return [
+            {
+                'name': self.before_query_param, 'required': False, 'in': 'query',
+                'description': 'Cursor of the oldest message held; returns the page before it', 'schema': cursor,
+            },
+            {
+                'name': self.after_query_param, 'required': False, 'in': 'query',
+                'description': 'Cursor of the newest message held; returns the page after it', 'schema': cursor,
+            },
+            {
+                'name': self.page_size_query_param, 'required': False, 'in': 'query',
+                'description': f'Messages per page, at most {self.max_page_size}', 'schema': {'type': 'integer'},
+            },
+        ]
@@ -35,21 +35,16 @@ class IsParticipantOfSession(BasePermission):
     Custom permission to check if user is a participant of the debate session.
     """
     def has_object_permission(self, request, view, obj):
-        from .models import Participant
+        from .membership import membership_cache
         
         # For Message objects, check if user is participant of the session
-        if hasattr(obj, 'session'):
-            return Participant.objects.filter(
-                user=request.user,
-                session=obj.session,
-                is_active=True
-            ).exists()
-        
+        if hasattr(obj, 'session_id'):
+            session_id = obj.session_id
         # For Session objects, check if user is participant
-        if hasattr(obj, 'participants'):
-            return obj.participants.filter(
-                user=request.user,
-                is_active=True
-            ).exists()
+        elif hasattr(obj, 'participants'):
+            session_id = obj.id
+        else:
+            return False
         
-        return False
+        membership = membership_cache.get(session_id)
+        return membership is not None and membership.is_participant(request.user.id)
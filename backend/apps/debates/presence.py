@@ -0,0 +1,303 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import redis.asyncio as aioredis
+
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from apps.metrics.registry import registry, timed_database_sync_to_async
+from .conf import realtime_setting
+from .models import OnlineParticipant
+
+PRESENCE_EXPIRED = registry.counter(
+    'presence_expired_total', 'Stale presence entries removed by the sweeper', labels=('store',)
+)
+
+
+class InMemoryPresenceBackend:
+    """
+    Presence store kept in process memory.
+    Maps session id -> user id -> open channel names, so a user with
+    several tabs open only counts once.
+    """
+
+    def __init__(self):
+        self._sessions = defaultdict(dict)
+
+    async def add(self, session_id, user_id, channel_name):
+        """Register a connection, returning (online_count, is_first_connection)"""
+        users = self._sessions[session_id]
+        channels = users.setdefault(user_id, set())
+        is_first = not channels
+        channels.add(channel_name)
+        return len(users), is_first
+
+    async def remove(self, session_id, user_id, channel_name):
+        """Unregister a connection, returning (online_count, was_last_connection)"""
+        users = self._sessions.get(session_id)
+        if not users or user_id not in users:
+            return len(users or ()), False
+
+        channels = users[user_id]
+        channels.discard(channel_name)
+        was_last = not channels
+        if was_last:
+            del users[user_id]
+        online_count = len(users)
+        if not users:
+            del self._sessions[session_id]
+        return online_count, was_last
+
+    async def count(self, session_id):
+        """Number of distinct users online in a session"""
+        return len(self._sessions.get(session_id, ()))
+
+    async def members(self, session_id):
+        """Ids of the users online in a session"""
+        return set(self._sessions.get(session_id, ()))
+
+    async def touch(self, keys):
+        """Record (session_id, user_id) pairs as recently seen"""
+        # A single process can't be outlived by its own connections
+
+    async def expire(self, cutoff):
+        """Drop users not seen since cutoff (a Unix timestamp), returning their keys"""
+        return []
+
+
+class RedisPresenceBackend:
+    """
+    Presence store shared by every worker through Redis.
+    Each session is a hash of user id -> number of open connections, and a
+    sorted set of "session_id:user_id" scored by last-seen time lets the
+    sweeper remove users whose worker died without disconnecting them.
+    """
+
+    ADD_SCRIPT = """
+    local connections = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+    return {redis.call('HLEN', KEYS[1]), connections}
+    """
+
+    REMOVE_SCRIPT = """
+    local connections = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+    if connections <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        redis.call('ZREM', KEYS[2], ARGV[2])
+    end
+    return {redis.call('HLEN', KEYS[1]), connections}
+    """
+
+    EXPIRE_SCRIPT = """
+    local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    for _, member in ipairs(stale) do
+        local separator = string.find(member, ':')
+        redis.call('HDEL', ARGV[3] .. ':' .. string.sub(member, 1, separator - 1), string.sub(member, separator + 1))
+        redis.call('ZREM', KEYS[1], member)
+    end
+    return stale
+    """
+
+    def __init__(self, url=None, key_prefix='debate:presence'):
+        self.redis = aioredis.from_url(url or realtime_setting('REDIS_URL'))
+        self.key_prefix = key_prefix
+        self.last_seen_key = f'{key_prefix}:last_seen'
+        self._add = self.redis.register_script(self.ADD_SCRIPT)
+        self._remove = self.redis.register_script(self.REMOVE_SCRIPT)
+        self._expire = self.redis.register_script(self.EXPIRE_SCRIPT)
+
+    def _key(self, session_id):
+        return f'{self.key_prefix}:{session_id}'
+
+    async def add(self, session_id, user_id, channel_name):
+        online_count, connections = await self._add(
+            keys=[self._key(session_id), self.last_seen_key],
+            args=[user_id, f'{session_id}:{user_id}', time.time()]
+        )
+        return online_count, connections == 1
+
+    async def remove(self, session_id, user_id, channel_name):
+        online_count, connections = await self._remove(
+            keys=[self._key(session_id), self.last_seen_key],
+            args=[user_id, f'{session_id}:{user_id}']
+        )
+        return online_count, connections == 0
+
+    async def count(self, session_id):
+        return await self.redis.hlen(self._key(session_id))
+
+    async def members(self, session_id):
+        return {int(user_id) for user_id in await self.redis.hkeys(self._key(session_id))}
+
+    async def touch(self, keys):
+        # XX: don't resurrect users that disconnected since
+        now = time.time()
+        await self.redis.zadd(
+            self.last_seen_key, {f'{session_id}:{user_id}': now for session_id, user_id in keys}, xx=True
+        )
+
+    async def expire(self, cutoff, batch_size=1000):
+        stale = await self._expire(keys=[self.last_seen_key], args=[cutoff, batch_size, self.key_prefix])
+        return [tuple(int(part) for part in member.split(b':')) for member in stale]
+
+
+class PresenceTracker:
+    """
+    Tracks who is online in each debate session.
+    Connect/disconnect only touch the presence backend; the
+    OnlineParticipant table is brought up to date by a periodic snapshot.
+
+    Heartbeats (client pings, plus every connection this process holds
+    each PRESENCE_TOUCH_INTERVAL) are collected in memory and written with
+    the snapshot as one last_seen UPDATE per session. A sweeper removes
+    entries not seen for PRESENCE_STALE_AFTER seconds, which is how users
+    left behind by a crashed worker stop counting as online.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        # (session_id, user_id) -> channel name to upsert, or None to delete
+        self._pending = {}
+        # (session_id, user_id) pairs seen since the last snapshot
+        self._heartbeats = set()
+        # (session_id, user_id) -> channel names connected to this process
+        self._local = defaultdict(set)
+        self._last_touch = time.monotonic()
+        self._flush_task = None
+        self._sweep_task = None
+
+    @classmethod
+    def from_settings(cls):
+        backend_class = import_string(realtime_setting('PRESENCE_BACKEND'))
+        return cls(backend_class())
+
+    async def connect(self, session_id, user_id, channel_name):
+        """Mark a connection online and return the session's online count"""
+        online_count, is_first = await self.backend.add(session_id, user_id, channel_name)
+        if is_first:
+            self._pending[(session_id, user_id)] = channel_name
+        self._local[(session_id, user_id)].add(channel_name)
+        self._ensure_flusher()
+        return online_count
+
+    async def disconnect(self, session_id, user_id, channel_name):
+        """Mark a connection offline and return the session's online count"""
+        online_count, was_last = await self.backend.remove(session_id, user_id, channel_name)
+        if was_last:
+            self._pending[(session_id, user_id)] = None
+        channels = self._local.get((session_id, user_id))
+        if channels is not None:
+            channels.discard(channel_name)
+            if not channels:
+                del self._local[(session_id, user_id)]
+        return online_count
+
+    def heartbeat(self, session_id, user_id):
+        """Record that a user is still around; written with the next snapshot"""
+        self._heartbeats.add((session_id, user_id))
+
+    async def online_count(self, session_id):
+        return await self.backend.count(session_id)
+
+    async def online_user_ids(self, session_id):
+        return await self.backend.members(session_id)
+
+    def _ensure_flusher(self):
+        """Start the snapshot loop on the running event loop if it isn't already"""
+        loop = asyncio.get_running_loop()
+        task = self._flush_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._flush_task = loop.create_task(self._flush_periodically())
+        task = self._sweep_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._sweep_task = loop.create_task(self._sweep_periodically())
+
+    async def _flush_periodically(self):
+        interval = realtime_setting('PRESENCE_FLUSH_INTERVAL')
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def flush(self):
+        """Persist presence changes and heartbeats since the last snapshot"""
+        if time.monotonic() - self._last_touch >= realtime_setting('PRESENCE_TOUCH_INTERVAL'):
+            self._last_touch = time.monotonic()
+            self._heartbeats.update(self._local)
+        if not self._pending and not self._heartbeats:
+            return
+        pending, self._pending = self._pending, {}
+        heartbeats, self._heartbeats = self._heartbeats, set()
+        try:
+            if heartbeats:
+                await self.backend.touch(heartbeats)
+            await timed_database_sync_to_async(self.write_snapshot)(pending, heartbeats)
+        except Exception as e:
+            print(f"Error writing presence snapshot: {e}")
+
+    async def _sweep_periodically(self):
+        interval = realtime_setting('PRESENCE_SWEEP_INTERVAL')
+        while True:
+            await asyncio.sleep(interval)
+            await self.sweep()
+
+    async def sweep(self):
+        """Remove presence not refreshed within PRESENCE_STALE_AFTER seconds"""
+        stale_after = realtime_setting('PRESENCE_STALE_AFTER')
+        try:
+            expired = await self.backend.expire(time.time() - stale_after)
+            PRESENCE_EXPIRED.inc(len(expired), store='backend')
+            deleted = await timed_database_sync_to_async(self.delete_stale)(
+                timezone.now() - timedelta(seconds=stale_after)
+            )
+            PRESENCE_EXPIRED.inc(deleted, store='database')
+        except Exception as e:
+            print(f"Error sweeping stale presence: {e}")
+
+    @staticmethod
+    def delete_stale(cutoff):
+        deleted, _ = OnlineParticipant.objects.filter(last_seen__lt=cutoff).delete()
+        return deleted
+
+    @staticmethod
+    def write_snapshot(pending, heartbeats=()):
+        """
+        Apply pending presence changes with one delete per session and one
+        upsert, then heartbeats with one last_seen update per session
+        """
+        now = timezone.now()
+        departed = defaultdict(list)
+        present = []
+        for (session_id, user_id), channel_name in pending.items():
+            if channel_name is None:
+                departed[session_id].append(user_id)
+            else:
+                present.append(OnlineParticipant(
+                    session_id=session_id,
+                    user_id=user_id,
+                    channel_name=channel_name,
+                    last_seen=now
+                ))
+
+        for session_id, user_ids in departed.items():
+            OnlineParticipant.objects.filter(session_id=session_id, user_id__in=user_ids).delete()
+
+        if present:
+            OnlineParticipant.objects.bulk_create(
+                present,
+                update_conflicts=True,
+                unique_fields=['user', 'session'],
+                update_fields=['channel_name', 'last_seen']
+            )
+
+        seen = defaultdict(list)
+        for session_id, user_id in heartbeats:
+            if (session_id, user_id) not in pending:
+                seen[session_id].append(user_id)
+        for session_id, user_ids in seen.items():
+            OnlineParticipant.objects.filter(session_id=session_id, user_id__in=user_ids).update(last_seen=now)
+
+
+presence = PresenceTracker.from_settings()
@@ -0,0 +1,79 @@
+"""
+Wire encodings for the debate room WebSocket.
+
+Clients that don't ask for a subprotocol keep getting JSON text frames
+with the original long keys and ISO 8601 timestamps. Clients that offer
+MSGPACK_SUBPROTOCOL get binary MessagePack frames instead, with the keys
+in SHORT_KEYS shortened and datetimes sent as integer milliseconds since
+the Unix epoch; they send their own frames the same way.
+"""
+import datetime
+import json
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = 'debate.msgpack.v1'
+
+SHORT_KEYS = {
+    'type': 't',
+    'message': 'm',
+    'id': 'i',
+    'content': 'c',
+    'user': 'u',
+    'username': 'n',
+    'role': 'r',
+    'timestamp': 'ts',
+    'session_id': 's',
+    'online_count': 'o',
+    'total_participants': 'p',
+    'user_joined': 'j',
+    'user_left': 'l',
+    'is_typing': 'y',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def encode_json(payload):
+    """Encode a frame for JSON clients"""
+    return json.dumps(payload, default=_json_default)
+
+
+def decode_json(text):
+    return json.loads(text)
+
+
+def _compact(value):
+    if isinstance(value, dict):
+        return {SHORT_KEYS.get(key, key): _compact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_compact(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp() * 1000)
+    return value
+
+
+def _expand(value):
+    if isinstance(value, dict):
+        return {LONG_KEYS.get(key, key): _expand(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+def encode_msgpack(payload):
+    """Encode a frame for MessagePack clients"""
+    return msgpack.packb(_compact(payload))
+
+
+def decode_msgpack(data):
+    """Decode a client frame back to the long-key form the consumer handles"""
+    content = msgpack.unpackb(data)
+    if not isinstance(content, dict):
+        raise ValueError('Frame is not a map')
+    return _expand(content)
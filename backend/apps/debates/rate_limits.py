@@ -0,0 +1,93 @@
+import threading
+import time
+
+from apps.metrics.registry import registry
+from .conf import realtime_setting
+
+RATE_LIMITED = registry.counter(
+    'ws_rate_limited_total', 'Client frames rejected by rate limits', labels=('type', 'scope')
+)
+
+
+class TokenBucket:
+    """Holds up to `burst` tokens, refilled at `rate` tokens per second"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self):
+        """Seconds until a token is available"""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Token buckets per event type, for each connection and each user.
+
+    Connection buckets live on the consumer; user buckets are shared by all
+    of a user's connections in this process. Limits come from the
+    RATE_LIMITS setting, keyed by event type with 'default' for the rest.
+    Types without their own entry share the 'default' buckets, so clients
+    can't grow the bucket tables or metric labels by inventing types.
+    """
+
+    def __init__(self, limits, max_user_buckets=10000):
+        self.limits = limits
+        self.max_user_buckets = max_user_buckets
+        # (user id, event type) -> TokenBucket
+        self._user_buckets = {}
+        self._lock = threading.Lock()
+
+    def limit_type(self, event_type):
+        """The RATE_LIMITS entry an event type is limited by: its own, or 'default'"""
+        if isinstance(event_type, str) and event_type in self.limits:
+            return event_type
+        return 'default'
+
+    def check(self, connection_buckets, user_id, event_type):
+        """Take a token for an event; returns None if allowed, else (scope, retry_after)"""
+        event_type = self.limit_type(event_type)
+        limits = self.limits.get(event_type) or {}
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            if 'connection' in limits:
+                bucket = connection_buckets.get(event_type)
+                if bucket is None:
+                    bucket = connection_buckets[event_type] = TokenBucket(*limits['connection'], now)
+                buckets.append(('connection', bucket))
+            if 'user' in limits:
+                key = (user_id, event_type)
+                bucket = self._user_buckets.get(key)
+                if bucket is None:
+                    if len(self._user_buckets) >= self.max_user_buckets:
+                        self._prune(now)
+                    bucket = self._user_buckets[key] = TokenBucket(*limits['user'], now)
+                buckets.append(('user', bucket))
+
+            for scope, bucket in buckets:
+                bucket.refill(now)
+                if bucket.tokens < 1:
+                    RATE_LIMITED.inc(type=event_type, scope=scope)
+                    return scope, bucket.retry_after()
+            for _, bucket in buckets:
+                bucket.tokens -= 1
+        return None
+
+    def _prune(self, now):
+        """Forget user buckets that have refilled completely"""
+        for key, bucket in list(self._user_buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._user_buckets[key]
+
+
+rate_limiter = RateLimiter(realtime_setting('RATE_LIMITS'))
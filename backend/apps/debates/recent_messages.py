@@ -0,0 +1,174 @@
+import threading
+from collections import OrderedDict, deque
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.metrics.registry import registry
+from .conf import realtime_setting
+from .versions import aget_version
+
+RECENT_MESSAGE_LOOKUPS = registry.counter(
+    'recent_message_cache_lookups_total', 'Message history requests by recent message cache outcome',
+    labels=('outcome',)
+)
+
+
+class _SessionMessages:
+    __slots__ = ('records', 'last_sequence', 'covers_since', 'end_time', 'version')
+
+    def __init__(self, last_sequence, covers_since, end_time, version):
+        # (sequence, timestamp, serialized message), oldest first
+        self.records = deque()
+        self.last_sequence = last_sequence
+        # Every message with a timestamp at or after this is cached; None
+        # means the whole session history is
+        self.covers_since = covers_since
+        self.end_time = end_time
+        # The session's shared ('messages', id) version when the entry was started
+        self.version = version
+
+
+class RecentMessageCache:
+    """
+    The last few serialized messages of each live session, so entering a
+    room and paging through recent history doesn't hit the database.
+
+    groups.broadcast adds the messages sent from this process and REST
+    history requests prime it on a miss. An entry is only served while it
+    holds every message up to the session's latest sequence; a skipped
+    sequence (say, a message sent from another worker) drops it. Entries
+    are evicted once the session has ended.
+
+    Edits and deletes can happen in any worker, so each entry remembers
+    the session's shared ('messages', id) version from versions.py and is
+    dropped once the version it is read with has moved on.
+    """
+
+    def __init__(self, size, max_sessions):
+        self.size = size
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def page(self, session_id, since, last_sequence, version, before=None, after=None, limit=50):
+        """
+        Up to `limit` cached messages from `since` on, oldest first: those
+        after the (timestamp, id) key `after`, else the latest ones before
+        `before` (or overall). None if the cache can't answer.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and (timezone.now() > entry.end_time or entry.version != version):
+                # Over, or messages were edited or deleted since it was cached
+                del self._sessions[session_id]
+                entry = None
+            if entry is None or entry.last_sequence != last_sequence:
+                RECENT_MESSAGE_LOOKUPS.inc(outcome='miss')
+                return None
+            complete = self._covers(entry, since)
+            rows = sorted(
+                ((timestamp, record['id']), record)
+                for _, timestamp, record in entry.records
+                if since is None or timestamp >= since
+            )
+            if after is not None:
+                # Only answerable if everything newer than the cursor is cached
+                if not complete and after[0] < entry.covers_since:
+                    rows = None
+                else:
+                    rows = [row for row in rows if row[0] > after][:limit]
+            else:
+                if before is not None:
+                    rows = [row for row in rows if row[0] < before]
+                # Short of a full page, older messages may just not be cached
+                rows = rows[-limit:] if complete or len(rows) >= limit else None
+            if rows is None:
+                RECENT_MESSAGE_LOOKUPS.inc(outcome='miss')
+                return None
+            self._sessions.move_to_end(session_id)
+            RECENT_MESSAGE_LOOKUPS.inc(outcome='hit')
+            return [record for _, record in rows]
+
+    @staticmethod
+    def _covers(entry, since):
+        if entry.covers_since is None:
+            return True
+        return since is not None and since >= entry.covers_since
+
+    async def add(self, session_id, record, end_time):
+        """Append a newly broadcast message"""
+        sequence = record.get('sequence')
+        if sequence is None or timezone.now() > end_time:
+            return
+        timestamp = parse_datetime(record['timestamp'])
+        if self._append(session_id, sequence, timestamp, record):
+            return
+        # Nothing cached, or messages were missed: start over from here
+        version = await aget_version('messages', session_id)
+        self._append(session_id, sequence, timestamp, record, end_time, version)
+
+    def _append(self, session_id, sequence, timestamp, record, end_time=None, version=None):
+        """
+        Append to a session's entry if the message follows on from it, or,
+        given end_time and version, to a fresh one. Returns whether done.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and sequence <= entry.last_sequence:
+                # Already have it, from a history read
+                return True
+            if entry is None or sequence != entry.last_sequence + 1:
+                if version is None:
+                    return False
+                entry = _SessionMessages(sequence - 1, None if sequence == 1 else timestamp, end_time, version)
+                self._store(session_id, entry)
+            entry.records.append((sequence, timestamp, record))
+            entry.last_sequence = sequence
+            self._trim(entry)
+            return True
+
+    def prime(self, session_id, records, since, last_sequence, version, end_time):
+        """
+        Fill a session from a database read of every message since `since`.
+        last_sequence and version must be read before the query, so that
+        messages still on their way to the database aren't mistaken for
+        missing and edits made during it aren't missed.
+        """
+        if timezone.now() > end_time:
+            return
+        rows = []
+        for record in records:
+            if record.get('sequence') is None:
+                return
+            rows.append((record['sequence'], parse_datetime(record['timestamp']), record))
+        rows.sort(key=lambda row: row[0])
+        if (rows[-1][0] if rows else 0) != last_sequence:
+            return
+
+        entry = _SessionMessages(last_sequence, since, end_time, version)
+        entry.records.extend(rows)
+        self._trim(entry)
+        with self._lock:
+            self._store(session_id, entry)
+
+    def _store(self, session_id, entry):
+        self._sessions[session_id] = entry
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _trim(self, entry):
+        while len(entry.records) > self.size:
+            entry.records.popleft()
+            entry.covers_since = entry.records[0][1]
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+recent_messages = RecentMessageCache(
+    size=realtime_setting('RECENT_MESSAGES_SIZE'),
+    max_sessions=realtime_setting('RECENT_MESSAGES_SESSIONS')
+)
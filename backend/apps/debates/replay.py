@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+from apps.metrics.registry import registry
+from .conf import realtime_setting
+from .database import database_operation
+from .models import Message
+
+REPLAYED = registry.counter(
+    'ws_replayed_messages_total', 'Chat messages replayed to resuming clients by source', labels=('source',)
+)
+
+
+def chat_message_payload(message, user):
+    """The chat_message frame broadcast for a message"""
+    return {
+        'type': 'chat_message',
+        'message': {
+            'id': message.id,
+            'sequence': message.sequence,
+            'content': message.content,
+            'user': {
+                'id': user.id,
+                'username': user.username,
+                'role': user.role
+            },
+            'timestamp': message.timestamp
+        }
+    }
+
+
+class ReplayBuffer:
+    """
+    Recent chat broadcasts per session, kept as the pre-encoded group
+    events so they can be replayed without touching the database.
+
+    The buffer is filled by groups.broadcast in the worker sending each
+    message, so it only holds the messages sent from this process;
+    between() checks a range is complete before it is used.
+    """
+
+    def __init__(self, size, max_sessions):
+        self.size = size
+        self.max_sessions = max_sessions
+        # session id -> OrderedDict of sequence -> group event
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session_id, sequence, event):
+        with self._lock:
+            frames = self._sessions.get(session_id)
+            if frames is None:
+                frames = self._sessions[session_id] = OrderedDict()
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            if sequence in frames:
+                return
+            frames[sequence] = event
+            while len(frames) > self.size:
+                frames.popitem(last=False)
+
+    def between(self, session_id, after, up_to):
+        """Events with after < sequence <= up_to, or None if any are missing"""
+        if up_to - after > self.size:
+            return None
+        with self._lock:
+            frames = self._sessions.get(session_id)
+            if frames is None:
+                return None if up_to > after else []
+            events = []
+            for sequence in range(after + 1, up_to + 1):
+                event = frames.get(sequence)
+                if event is None:
+                    return None
+                events.append(event)
+            return events
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+replay_buffer = ReplayBuffer(
+    size=realtime_setting('REPLAY_BUFFER_SIZE'),
+    max_sessions=realtime_setting('REPLAY_BUFFER_SESSIONS')
+)
+
+
+def _stored_messages(session_id, after, since):
+    messages = Message.objects.filter(
+        session_id=session_id,
+        sequence__gt=after,
+        is_deleted=False
+    ).select_related('sender').order_by('sequence')
+    if since is not None:
+        messages = messages.filter(timestamp__gte=since)
+    return messages
+
+
+@database_operation
+def stored_messages_after(session_id, after, limit, since=None):
+    """Payloads of stored messages after a sequence, oldest first"""
+    messages = _stored_messages(session_id, after, since)
+    return [chat_message_payload(message, message.sender) for message in messages[:limit]]
+
+
+@stored_messages_after.native
+async def stored_messages_after(session_id, after, limit, since=None):
+    messages = _stored_messages(session_id, after, since)
+    return [chat_message_payload(message, message.sender) async for message in messages[:limit]]
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.moderation.models import ModerationAction
+from .conf import realtime_setting
+from .database import database_operation
+
+
+class SessionSanctions:
+    """Mutes in force in one debate session"""
+    __slots__ = ('muted', 'expires_at')
+
+    def __init__(self, muted, expires_at):
+        # user id -> when the mute lifts, or None for the rest of the session
+        self.muted = muted
+        self.expires_at = expires_at
+
+    def mute(self, user_id, until):
+        if user_id in self.muted:
+            current = self.muted[user_id]
+            # Keep the longer of overlapping mutes
+            if current is None or (until is not None and until <= current):
+                return
+        self.muted[user_id] = until
+
+    def muted_until(self, user_id):
+        """(True, until) while a user is muted, else (False, None); until is None for open-ended mutes"""
+        if user_id not in self.muted:
+            return False, None
+        until = self.muted[user_id]
+        if until is not None and until <= timezone.now():
+            self.muted.pop(user_id, None)
+            return False, None
+        return True, until
+
+
+class SanctionCache:
+    """
+    Per-process cache of the mutes in force in each session, so chat
+    messages can be checked without a query.
+
+    A session's mutes are loaded with one query the first time they are
+    needed. Moderation actions are applied as they are recorded: locally
+    by the ModerationAction signal in signals.py, and in every other
+    worker through the sanction.update event it sends to the room. The
+    SANCTION_CACHE_TTL bounds how stale a worker with nobody in the room
+    can get.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, session_id):
+        with self._lock:
+            sanctions = self._entries.get(session_id)
+            if sanctions is not None:
+                if sanctions.expires_at > time.monotonic():
+                    self._entries.move_to_end(session_id)
+                    return sanctions
+                del self._entries[session_id]
+        return None
+
+    def get(self, session_id):
+        sanctions = self.peek(session_id)
+        if sanctions is None:
+            sanctions = self._load(session_id)
+        return sanctions
+
+    async def aget(self, session_id):
+        sanctions = self.peek(session_id)
+        if sanctions is None:
+            sanctions = await self._aload(session_id)
+        return sanctions
+
+    @staticmethod
+    def _mutes(session_id):
+        return ModerationAction.objects.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+            session_id=session_id,
+            action='MUTE'
+        ).values_list('participant_id', 'expires_at')
+
+    def _load(self, session_id):
+        return self._build(session_id, list(self._mutes(session_id)))
+
+    @database_operation
+    def _aload(self, session_id):
+        return self._load(session_id)
+
+    @_aload.native
+    async def _aload(self, session_id):
+        return self._build(session_id, [row async for row in self._mutes(session_id)])
+
+    def _build(self, session_id, mutes):
+        sanctions = SessionSanctions({}, time.monotonic() + self.ttl)
+        for user_id, until in mutes:
+            sanctions.mute(user_id, until)
+        with self._lock:
+            self._entries[session_id] = sanctions
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return sanctions
+
+    def apply(self, session_id, user_id, action, until):
+        """Record a moderation action in a cached session; uncached sessions load it later"""
+        sanctions = self.peek(session_id)
+        if sanctions is not None and action == 'MUTE':
+            with self._lock:
+                sanctions.mute(user_id, until)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+sanction_cache = SanctionCache(
+    max_size=realtime_setting('SANCTION_CACHE_SIZE'),
+    ttl=realtime_setting('SANCTION_CACHE_TTL')
+)
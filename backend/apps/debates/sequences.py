@@ -0,0 +1,120 @@
+import threading
+
+import redis.asyncio as aioredis
+
+from django.db.models import Max, Subquery
+from django.utils.module_loading import import_string
+
+from .conf import realtime_setting
+from .database import database_operation
+from .models import Message, MessageArchive
+
+
+class InMemorySequenceBackend:
+    """
+    Per-session counters kept in process memory.
+    Only correct with a single worker process.
+    """
+
+    def __init__(self):
+        self._last = {}
+        self._lock = threading.Lock()
+
+    async def next(self, session_id):
+        """Return the next sequence, or None if the session hasn't been seeded"""
+        with self._lock:
+            if session_id not in self._last:
+                return None
+            self._last[session_id] += 1
+            return self._last[session_id]
+
+    async def current(self, session_id):
+        return self._last.get(session_id)
+
+    async def seed(self, session_id, value):
+        """Start a session's counter at value unless it is already running"""
+        with self._lock:
+            self._last.setdefault(session_id, value)
+
+
+class RedisSequenceBackend:
+    """Per-session counters shared by every worker through Redis"""
+
+    NEXT_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    return redis.call('INCR', KEYS[1])
+    """
+
+    def __init__(self, url=None, key_prefix='debate:sequence'):
+        self.redis = aioredis.from_url(url or realtime_setting('REDIS_URL'))
+        self.key_prefix = key_prefix
+        self._next = self.redis.register_script(self.NEXT_SCRIPT)
+
+    def _key(self, session_id):
+        return f'{self.key_prefix}:{session_id}'
+
+    async def next(self, session_id):
+        return await self._next(keys=[self._key(session_id)])
+
+    async def current(self, session_id):
+        value = await self.redis.get(self._key(session_id))
+        return None if value is None else int(value)
+
+    async def seed(self, session_id, value):
+        await self.redis.set(self._key(session_id), value, nx=True)
+
+
+class SequenceAllocator:
+    """
+    Hands out the per-session message sequence numbers clients resume from.
+    A session's counter is seeded from the highest stored sequence the
+    first time the backend hasn't seen it.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @classmethod
+    def from_settings(cls):
+        backend_class = import_string(realtime_setting('SEQUENCE_BACKEND'))
+        return cls(backend_class())
+
+    async def allocate(self, session_id):
+        sequence = await self.backend.next(session_id)
+        if sequence is None:
+            await self._seed(session_id)
+            sequence = await self.backend.next(session_id)
+        return sequence
+
+    async def last(self, session_id):
+        """Highest sequence handed out so far in a session"""
+        sequence = await self.backend.current(session_id)
+        if sequence is None:
+            await self._seed(session_id)
+            sequence = await self.backend.current(session_id)
+        return sequence
+
+    async def _seed(self, session_id):
+        await self.backend.seed(session_id, await self.stored_max(session_id))
+
+    @staticmethod
+    def _last_sequence(session_id):
+        """Max stored sequence, or the archive's last once the messages are archived"""
+        archived = MessageArchive.objects.filter(session_id=session_id).values('last_sequence')
+        return Max('sequence', default=Subquery(archived[:1]))
+
+    @database_operation
+    def stored_max(self, session_id):
+        return Message.objects.filter(session_id=session_id).aggregate(
+            last=self._last_sequence(session_id)
+        )['last'] or 0
+
+    @stored_max.native
+    async def stored_max(self, session_id):
+        return (await Message.objects.filter(session_id=session_id).aaggregate(
+            last=self._last_sequence(session_id)
+        ))['last'] or 0
+
+message_sequences = SequenceAllocator.from_settings()
@@ -30,7 +30,7 @@ class DebateSessionSerializer(serializers.ModelSerializer):
     topic = DebateTopicSerializer(read_only=True)
     created_by = UserBasicSerializer(read_only=True)
     topic_id = serializers.IntegerField(write_only=True)
-    participants_count = serializers.SerializerMethodField()
+    participants_count = serializers.IntegerField(read_only=True)
     title = serializers.CharField(source='topic.title', read_only=True)
     description = serializers.CharField(source='topic.description', read_only=True)
     duration_minutes = serializers.SerializerMethodField()
@@ -52,9 +52,6 @@ class DebateSessionSerializer(serializers.ModelSerializer):
             'duration_minutes', 'is_ongoing', 'has_started', 'has_ended', 'status', 'user_has_joined'
         ]
 
-    def get_participants_count(self, obj):
-        return obj.participants.filter(is_active=True).count()
-    
     def get_duration_minutes(self, obj):
         if obj.start_time and obj.end_time:
             duration = obj.end_time - obj.start_time
@@ -94,16 +91,29 @@ class ParticipantSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'session', 'joined_at']
 
 
+class MessageSenderSerializer(UserBasicSerializer):
+    """
+    A message's sender, serialized once per user per response: `sender`,
+    its `user` alias and every other message by the same user share it
+    """
+    def to_representation(self, instance):
+        senders = self.root.__dict__.setdefault('_serialized_senders', {})
+        if instance.pk not in senders:
+            senders[instance.pk] = super().to_representation(instance)
+        return senders[instance.pk]
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    sender = UserBasicSerializer(read_only=True)
+    """Load messages with select_related('sender') when serializing many"""
+    sender = MessageSenderSerializer(read_only=True)
     session_id = serializers.IntegerField(write_only=True)
-    user = UserBasicSerializer(source='sender', read_only=True)  # Alias for frontend compatibility
+    user = MessageSenderSerializer(source='sender', read_only=True)  # Alias for frontend compatibility
     created_at = serializers.DateTimeField(source='timestamp', read_only=True)  # Alias for frontend compatibility
     
     class Meta:
         model = Message
-        fields = ['id', 'session_id', 'sender', 'user', 'content', 'timestamp', 'created_at']
-        read_only_fields = ['id', 'sender', 'user', 'timestamp', 'created_at']
+        fields = ['id', 'session_id', 'sender', 'user', 'content', 'timestamp', 'created_at', 'sequence']
+        read_only_fields = ['id', 'sender', 'user', 'timestamp', 'created_at', 'sequence']
 
     def create(self, validated_data):
         validated_data['sender'] = self.context['request'].user
@@ -0,0 +1,117 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from apps.moderation.models import ModerationAction
+from .groups import send_sanction
+from .membership import membership_cache
+from .middleware import token_user_cache
+from .models import DebateSession, DebateTopic, Message, Participant
+from .recent_messages import recent_messages
+from .sanctions import sanction_cache
+from .versions import TOPICS, bump_version, sessions_changed
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_token_user_cache(sender, instance, **kwargs):
+    """Make WebSocket auth see deactivated or changed users immediately, in every worker"""
+    token_user_cache.invalidate_user(instance.pk)
+    transaction.on_commit(lambda: bump_version('user', instance.pk))
+
+
+@receiver(post_save, sender=User)
+def bump_versions_on_user_save(sender, instance, update_fields=None, **kwargs):
+    """Topics and sessions embed their creator; logins only touch last_login"""
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        transaction.on_commit(lambda: bump_version(TOPICS))
+
+
+@receiver(post_save, sender=DebateTopic)
+@receiver(post_delete, sender=DebateTopic)
+def bump_versions_on_topic_change(sender, instance, **kwargs):
+    # Sessions embed their topic, and their ETags include TOPICS too
+    transaction.on_commit(lambda: bump_version(TOPICS))
+
+
+def adjust_participants_count(session_id, delta):
+    """Atomically move a session's participants_count by delta"""
+    DebateSession.objects.filter(id=session_id).update(
+        participants_count=Greatest(F('participants_count') + delta, Value(0))
+    )
+
+
+@receiver(post_init, sender=Participant)
+def remember_participant_state(sender, instance, **kwargs):
+    """Keep the stored is_active so saves can tell whether it changed"""
+    instance._counted_active = instance.is_active if instance.pk else False
+
+
+@receiver(post_save, sender=Participant)
+def update_membership_on_participant_save(sender, instance, **kwargs):
+    """Joining, leaving and removal all save the Participant row"""
+    membership_cache.participant_saved(instance)
+    transaction.on_commit(lambda: sessions_changed(instance.session_id))
+
+    if instance.is_active != instance._counted_active:
+        adjust_participants_count(instance.session_id, 1 if instance.is_active else -1)
+        instance._counted_active = instance.is_active
+
+
+@receiver(post_delete, sender=Participant)
+def update_membership_on_participant_delete(sender, instance, **kwargs):
+    membership_cache.participant_deleted(instance)
+    transaction.on_commit(lambda: sessions_changed(instance.session_id))
+
+    if instance._counted_active:
+        adjust_participants_count(instance.session_id, -1)
+
+
+@receiver(post_save, sender=DebateSession)
+def update_membership_on_session_save(sender, instance, **kwargs):
+    membership_cache.session_saved(instance)
+    transaction.on_commit(lambda: sessions_changed(instance.id))
+    # Ending, rescheduling or deactivating a session drops its recent messages
+    recent_messages.discard(instance.id)
+
+
+@receiver(post_delete, sender=DebateSession)
+def update_membership_on_session_delete(sender, instance, **kwargs):
+    membership_cache.session_deleted(instance.id)
+    recent_messages.discard(instance.id)
+    transaction.on_commit(lambda: sessions_changed(instance.id))
+
+
+@receiver(post_save, sender=Message)
+def invalidate_recent_messages_on_edit(sender, instance, created, **kwargs):
+    """New messages reach the cache through the broadcast; edits don't"""
+    if not created:
+        recent_messages.discard(instance.session_id)
+        transaction.on_commit(lambda: bump_version('messages', instance.session_id))
+
+
+@receiver(post_delete, sender=Message)
+def invalidate_recent_messages_on_delete(sender, instance, **kwargs):
+    recent_messages.discard(instance.session_id)
+    transaction.on_commit(lambda: bump_version('messages', instance.session_id))
+
+
+@receiver(post_save, sender=ModerationAction)
+def enforce_moderation_action(sender, instance, created, **kwargs):
+    """Apply mutes and removals here and, through the room, in every other worker"""
+    if not created:
+        return
+
+    def publish():
+        sanction_cache.apply(instance.session_id, instance.participant_id, instance.action, instance.expires_at)
+        async_to_sync(send_sanction)(
+            instance.session_id, instance.participant_id, instance.action, instance.expires_at
+        )
+
+    transaction.on_commit(publish)
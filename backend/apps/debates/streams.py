@@ -0,0 +1,392 @@
+import logging
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .conf import realtime_setting
+from .database import database_operation
+from .groups import broadcast, room_group_name
+from .membership import membership_cache
+from .message_writer import message_writer
+from .models import DebateSession, Message, TypingIndicator
+from .presence import presence
+from .replay import REPLAYED, chat_message_payload, replay_buffer, stored_messages_after
+from .sanctions import sanction_cache
+from .sequences import message_sequences
+from .serializers import MessageSerializer
+from .typing_indicators import typing_tracker
+
+logger = logging.getLogger(__name__)
+
+# Client frames handled by a session stream
+SESSION_FRAME_TYPES = ('chat_message', 'typing', 'ping')
+
+
+class SessionStream:
+    """
+    One user's subscription to a debate session over a WebSocket.
+
+    DebateConsumer carries a single stream per socket and UserConsumer
+    multiplexes any number of them over a user's one connection. The
+    connection provides user, channel_name and channel_layer, and writes
+    frames with send_json() and send_broadcast(). Frames sent from here
+    carry the session_id so multiplexed clients can route them.
+    """
+
+    def __init__(self, connection, session_id):
+        self.connection = connection
+        self.session_id = session_id
+        self.room_group_name = room_group_name(session_id)
+        self.user = connection.user
+        self.is_online = False
+
+    async def send_json(self, content):
+        content.setdefault('session_id', self.session_id)
+        await self.connection.send_json(content)
+
+    async def open(self, resume_from=None, frame_type='connection_established'):
+        """Join the room, announce the user and replay what a resuming client missed"""
+        await self.connection.channel_layer.group_add(self.room_group_name, self.connection.channel_name)
+
+        online_count = await self.add_online_participant()
+        total_participants = await self.get_total_participants()
+        last_sequence = await message_sequences.last(self.session_id)
+
+        # Everything a client needs to render the room, in one frame
+        await self.send_json({
+            'type': frame_type,
+            'message': f'Connected to debate session {self.session_id}',
+            'session_id': self.session_id,
+            'online_count': online_count,
+            'total_participants': total_participants,
+            'typing_users': typing_tracker.typing_usernames(self.session_id),
+            'last_sequence': last_sequence
+        })
+
+        # Reconnecting clients pass the last sequence they saw
+        if resume_from is not None:
+            await self.replay_missed(resume_from, last_sequence)
+
+        # Broadcast updated online count to the other participants; this
+        # connection already has it from the snapshot
+        await broadcast(self.session_id, {
+            'type': 'online_count_update',
+            'online_count': online_count,
+            'total_participants': total_participants,
+            'user_joined': {
+                'id': self.user.id,
+                'username': self.user.username
+            },
+            'user_left': None
+        }, coalesce_key='online_count', exclude_channel=self.connection.channel_name)
+
+    async def replay_missed(self, resume_from, last_sequence):
+        """Send the chat messages a resuming client missed, then replay_complete"""
+        limit = realtime_setting('REPLAY_MAX_MESSAGES')
+        complete = True
+        events = replay_buffer.between(self.session_id, resume_from, last_sequence)
+        if events is not None:
+            for event in events:
+                await self.deliver(event)
+            replayed = len(events)
+            REPLAYED.inc(replayed, source='buffer')
+        else:
+            # Messages this worker has yet to write would be missed
+            await message_writer.flush()
+            membership = await membership_cache.aget(self.session_id)
+            payloads = await stored_messages_after(
+                self.session_id, resume_from, limit + 1, since=membership.joined_at(self.user.id)
+            )
+            if len(payloads) > limit:
+                # Too far behind; the client should reload the history instead
+                complete = False
+                payloads = payloads[:limit]
+            else:
+                replayed_up_to = payloads[-1]['message']['sequence'] if payloads else resume_from
+                # Messages past those replayed were deleted, or are still
+                # buffered by another worker's writer and not stored yet
+                if replayed_up_to < last_sequence and await message_sequences.stored_max(self.session_id) < last_sequence:
+                    complete = False
+            for payload in payloads:
+                await self.send_json(payload)
+            replayed = len(payloads)
+            REPLAYED.inc(replayed, source='database')
+
+        await self.send_json({
+            'type': 'replay_complete',
+            'replayed': replayed,
+            'complete': complete,
+            'last_sequence': last_sequence
+        })
+
+    async def close(self):
+        """Mark the user offline, tell the room and leave it"""
+        if not self.is_online:
+            return
+
+        # Remove user from online participants
+        online_count = await self.remove_online_participant()
+
+        # Clear typing indicator
+        await self.stop_typing()
+
+        # Broadcast updated online count before leaving
+        total_participants = await self.get_total_participants()
+        await broadcast(self.session_id, {
+            'type': 'online_count_update',
+            'online_count': online_count,
+            'total_participants': total_participants,
+            'user_joined': None,
+            'user_left': {
+                'id': self.user.id,
+                'username': self.user.username
+            }
+        }, coalesce_key='online_count')
+
+        await self.connection.channel_layer.group_discard(self.room_group_name, self.connection.channel_name)
+
+    async def receive(self, message_type, content):
+        """Handle a client frame of one of SESSION_FRAME_TYPES"""
+        if message_type == 'chat_message':
+            await self.handle_chat_message(content)
+        elif message_type == 'typing':
+            await self.handle_typing_indicator(content)
+        elif message_type == 'ping':
+            await self.handle_ping()
+
+    async def deliver(self, event):
+        """Forward a frame that was encoded once by groups.broadcast"""
+        if event.get('exclude_user_id') == self.user.id or event.get('exclude_channel') == self.connection.channel_name:
+            return
+        await self.connection.send_broadcast(event)
+
+    async def apply_sanction(self, event):
+        """
+        Handle a sanction.update event from groups.send_sanction: update this
+        worker's caches and tell the sanctioned user. Returns True if this
+        connection's user was removed from the session.
+        """
+        until = parse_datetime(event['expires_at']) if event['expires_at'] else None
+        sanction_cache.apply(self.session_id, event['user_id'], event['action'], until)
+        if event['action'] == 'REMOVE':
+            membership_cache.member_removed(self.session_id, event['user_id'])
+
+        if event['user_id'] != self.user.id:
+            return False
+        await self.send_json({
+            'type': 'moderation_action',
+            'action': event['action'].lower(),
+            'expires_at': event['expires_at']
+        })
+        return event['action'] == 'REMOVE'
+
+    async def muted_until(self):
+        """(True, until) while the user is muted in this session, else (False, None)"""
+        sanctions = await sanction_cache.aget(self.session_id)
+        return sanctions.muted_until(self.user.id)
+
+    async def handle_ping(self):
+        """Handle ping to keep connection alive and update last seen"""
+        presence.heartbeat(self.session_id, self.user.id)
+        await self.send_json({
+            'type': 'pong',
+            'timestamp': timezone.now()
+        })
+
+    async def handle_chat_message(self, content):
+        """Handle chat messages"""
+        message_content = content.get('content', '').strip()
+
+        if not message_content:
+            await self.send_json({
+                'type': 'error',
+                'message': 'Message cannot be empty'
+            })
+            return
+
+        # Mutes are enforced from the sanction cache, without a query
+        muted, until = await self.muted_until()
+        if muted:
+            await self.send_json({
+                'type': 'error',
+                'code': 'muted',
+                'message': 'You have been muted by the moderator',
+                'until': until
+            })
+            return
+
+        # As over REST, chat is only open while the session is live
+        membership = await membership_cache.aget(self.session_id)
+        if membership is None or not membership.is_ongoing:
+            await self.send_json({
+                'type': 'error',
+                'code': 'session_not_ongoing',
+                'message': 'Cannot send messages to a session that is not currently ongoing'
+            })
+            return
+
+        # Clear typing indicator when message is sent
+        await self.stop_typing()
+
+        # Save message to database
+        message = await self.save_message(message_content)
+
+        if message:
+            logger.debug("Broadcasting message %s to group %s", message.id, self.room_group_name)
+            # Send message to room group
+            await broadcast(
+                self.session_id,
+                chat_message_payload(message, self.user),
+                sequence=message.sequence,
+                record=dict(MessageSerializer(message).data)
+            )
+        else:
+            await self.send_json({
+                'type': 'error',
+                'message': 'Failed to save message'
+            })
+
+    async def handle_typing_indicator(self, content):
+        """Handle typing indicators"""
+        is_typing = bool(content.get('is_typing', False))
+        if is_typing and (await self.muted_until())[0]:
+            return
+
+        # Broadcasts are coalesced and expired by the typing tracker
+        await typing_tracker.update(self.session_id, self.user.id, self.user.username, is_typing)
+
+        if realtime_setting('TYPING_PERSIST'):
+            await self.update_typing_status(is_typing)
+
+    async def stop_typing(self):
+        """Clear the user's typing indicator"""
+        await typing_tracker.clear(self.session_id, self.user.id)
+
+        if realtime_setting('TYPING_PERSIST'):
+            await self.clear_typing_indicator()
+
+    # Database operations
+    async def is_valid_participant(self):
+        """Check if user is a valid participant in the session"""
+        membership = await membership_cache.aget(self.session_id)
+        if membership is None or not membership.is_active:
+            print(f"DebateSession with id {self.session_id} does not exist or is not active")
+            return False
+        return membership.is_participant(self.user.id)
+
+    async def add_online_participant(self):
+        """Add user to online participants and return the online count"""
+        self.is_online = True
+        return await presence.connect(self.session_id, self.user.id, self.connection.channel_name)
+
+    async def remove_online_participant(self):
+        """Remove user from online participants and return the online count"""
+        self.is_online = False
+        return await presence.disconnect(self.session_id, self.user.id, self.connection.channel_name)
+
+    async def get_total_participants(self):
+        """Get the number of active participants in the session"""
+        membership = await membership_cache.aget(self.session_id)
+        return membership.participants_count if membership else 0
+
+    @database_operation
+    def update_typing_status(self, is_typing):
+        """Update typing status in database"""
+        try:
+            session = DebateSession.objects.get(id=self.session_id)
+            if is_typing:
+                TypingIndicator.objects.update_or_create(
+                    user=self.user,
+                    session=session,
+                    defaults={'is_typing': True, 'updated_at': timezone.now()}
+                )
+            else:
+                TypingIndicator.objects.filter(
+                    user=self.user,
+                    session=session
+                ).delete()
+        except Exception as e:
+            print(f"Error updating typing status: {e}")
+
+    @update_typing_status.native
+    async def update_typing_status(self, is_typing):
+        try:
+            session = await DebateSession.objects.aget(id=self.session_id)
+            if is_typing:
+                await TypingIndicator.objects.aupdate_or_create(
+                    user=self.user,
+                    session=session,
+                    defaults={'is_typing': True, 'updated_at': timezone.now()}
+                )
+            else:
+                await TypingIndicator.objects.filter(
+                    user=self.user,
+                    session=session
+                ).adelete()
+        except Exception as e:
+            print(f"Error updating typing status: {e}")
+
+    @database_operation
+    def clear_typing_indicator(self):
+        """Clear typing indicator"""
+        try:
+            TypingIndicator.objects.filter(
+                user=self.user,
+                session_id=self.session_id
+            ).delete()
+        except Exception as e:
+            print(f"Error clearing typing indicator: {e}")
+
+    @clear_typing_indicator.native
+    async def clear_typing_indicator(self):
+        try:
+            await TypingIndicator.objects.filter(
+                user=self.user,
+                session_id=self.session_id
+            ).adelete()
+        except Exception as e:
+            print(f"Error clearing typing indicator: {e}")
+
+    async def save_message(self, content):
+        """Save message to database, or hand it to the batched writer"""
+        # Check if user is still an active participant
+        if not await self.is_valid_participant():
+            print(f"Session {self.session_id} not found or user not a participant")
+            return None
+
+        # handle_chat_message has checked the session is ongoing
+        sequence = await message_sequences.allocate(self.session_id)
+        if realtime_setting('MESSAGE_WRITE_MODE') == 'sync':
+            return await self.save_message_now(content, sequence)
+        return message_writer.enqueue(self.session_id, self.user, content, sequence)
+
+    @database_operation
+    def save_message_now(self, content, sequence):
+        """Save message to database"""
+        try:
+            message = Message.objects.create(
+                session_id=self.session_id,
+                sender=self.user,
+                content=content,
+                sequence=sequence
+            )
+            logger.debug("Message saved: %s", message.id)
+            return message
+        except Exception as e:
+            print(f"Error saving message: {e}")
+            return None
+
+    @save_message_now.native
+    async def save_message_now(self, content, sequence):
+        try:
+            message = await Message.objects.acreate(
+                session_id=self.session_id,
+                sender=self.user,
+                content=content,
+                sequence=sequence
+            )
+            logger.debug("Message saved: %s", message.id)
+            return message
+        except Exception as e:
+            print(f"Error saving message: {e}")
+            return None
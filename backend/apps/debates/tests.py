@@ -1,3 +1,1349 @@
-from django.test import TestCase
+import asyncio
+import time
+import uuid
+import weakref
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+import redis
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.moderation.models import ModerationAction
+from apps.users.models import User
+from config.asgi import application
+from .admin import MessageAdmin
+from .archive import archive_session, archived_message_count
+from .conf import realtime_setting
+from .consumers import WS_RECEIVED
+from .drain import drain
+from .groups import broadcast, send_sanction
+from .membership import membership_cache
+from .message_writer import MessageWriter, message_writer
+from .middleware import get_user_from_token
+from .models import (
+    ArchivedMessageCount, DebateTopic, DebateSession, Message, MessageArchive, OnlineParticipant, Participant
+)
+from .outbound import OUTBOUND_DROPPED, OUTBOUND_OVER_BUDGET, OutboundQueue
+from .presence import PRESENCE_EXPIRED, InMemoryPresenceBackend, RedisPresenceBackend, presence
+from .protocol import MSGPACK_SUBPROTOCOL, decode_msgpack, encode_msgpack
+from .rate_limits import RateLimiter
+from .recent_messages import recent_messages
+from .replay import REPLAYED, replay_buffer
+from .sanctions import sanction_cache
+from .sequences import InMemorySequenceBackend, message_sequences
+from .serializers import MessageSerializer
+from .typing_indicators import TypingTracker
+from .versions import bump_version
+
+
+class RecordingTypingTracker(TypingTracker):
+    """Records broadcasts as (user_id, is_typing, loop time) instead of sending them"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.broadcasts = []
+
+    async def _broadcast(self, key, state, now):
+        state.broadcast_state = state.is_typing
+        state.last_broadcast_at = now
+        self.broadcasts.append((key[1], state.is_typing, asyncio.get_running_loop().time()))
+
+
+@override_settings(DEBATE_REALTIME={'TYPING_TIMEOUT': 0.5, 'TYPING_BROADCAST_INTERVAL': 0.05})
+class TypingExpiryTests(SimpleTestCase):
+    """Typing indicators clear TYPING_TIMEOUT after the last refresh, whatever the wheel's phase"""
+
+    def test_expires_at_timeout_from_any_phase(self):
+        tick = 0.05
+        tracker = RecordingTypingTracker(tick=tick, slots=64)
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            started = {}
+            # Start each user at a different point within a tick
+            for user_id, phase in enumerate((0.0, 0.2, 0.4, 0.6, 0.8)):
+                await asyncio.sleep(tick * phase + tick)
+                started[user_id] = loop.time()
+                await tracker.update(1, user_id, f'user{user_id}', True)
+            await asyncio.sleep(0.5 + 4 * tick)
+            return started
+
+        started = async_to_sync(scenario)()
+        cleared = {user_id: at for user_id, is_typing, at in tracker.broadcasts if not is_typing}
+        self.assertEqual(set(cleared), set(started))
+        for user_id, at in cleared.items():
+            # Within the tick the deadline falls in, plus the one it is noticed on
+            self.assertGreaterEqual(at - started[user_id], 0.5)
+            self.assertLess(at - started[user_id], 0.5 + 2.5 * tick, user_id)
+
+
+class RateLimiterTests(SimpleTestCase):
+    """Frame types without their own limits share the 'default' buckets"""
+
+    def test_unknown_types_share_default_buckets(self):
+        limiter = RateLimiter({
+            'chat_message': {'connection': (1.0, 1)},
+            'default': {'connection': (1.0, 2), 'user': (1.0, 2)},
+        })
+        connection_buckets = {}
+        results = [limiter.check(connection_buckets, 1, f'made_up_{i}') for i in range(3)]
+        self.assertEqual([result is None for result in results], [True, True, False])
+        self.assertIsNone(limiter.check(connection_buckets, 1, 'chat_message'))
+        self.assertEqual(set(connection_buckets), {'default', 'chat_message'})
+        self.assertEqual(set(limiter._user_buckets), {(1, 'default')})
+
+    def test_non_string_types_are_default(self):
+        limiter = RateLimiter({'default': {'connection': (1.0, 1)}})
+        self.assertEqual(limiter.limit_type(['chat_message']), 'default')
+        self.assertEqual(limiter.limit_type({'type': 1}), 'default')
+        self.assertEqual(limiter.limit_type(None), 'default')
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """A client that stops reading fills its queue, sheds chatter and is closed once over budget"""
+
+    def test_blocked_writer(self):
+        async def scenario():
+            release = asyncio.Event()
+            sent = []
+            closed = []
+
+            async def send(text_data=None, bytes_data=None):
+                # A server with backpressure, writing to a client that has stopped reading
+                await release.wait()
+                sent.append(text_data)
+
+            async def on_over_budget():
+                closed.append(True)
+
+            queue = OutboundQueue(send, max_size=3, over_budget_seconds=0.05, on_over_budget=on_over_budget)
+            queue.put('chat_message', text_data='chat 0')
+            # The writer takes it and blocks in send()
+            await asyncio.sleep(0)
+            queue.put('typing_indicator', text_data='typing a', coalesce_key='typing:1')
+            queue.put('typing_indicator', text_data='typing b', coalesce_key='typing:1')
+            queue.put('chat_message', text_data='chat 1')
+            queue.put('chat_message', text_data='chat 2')
+            dropped = not queue.put('online_count_update', text_data='count')
+            # Room for chat is made by evicting the typing update
+            queue.put('chat_message', text_data='chat 3')
+            queued = [frame.text_data for frame in queue._frames]
+
+            # Full of chat: tolerated for over_budget_seconds, then closed
+            queue.put('chat_message', text_data='chat 4')
+            await asyncio.sleep(0.06)
+            accepted = queue.put('chat_message', text_data='chat 5')
+            await asyncio.sleep(0)
+            release.set()
+            await asyncio.sleep(0)
+            return dropped, queued, accepted, closed, sent
+
+        dropped, queued, accepted, closed, sent = async_to_sync(scenario)()
+        self.assertTrue(dropped)
+        self.assertEqual(queued, ['chat 1', 'chat 2', 'chat 3'])
+        self.assertFalse(accepted)
+        self.assertEqual(closed, [True])
+        # The writer was stopped while still blocked on the first frame
+        self.assertEqual(sent, [])
+
+    def test_coalesced_while_blocked(self):
+        async def scenario():
+            release = asyncio.Event()
+            sent = []
+
+            async def send(text_data=None, bytes_data=None):
+                await release.wait()
+                sent.append(text_data)
+
+            async def on_over_budget():
+                pass
+
+            queue = OutboundQueue(send, max_size=10, over_budget_seconds=1, on_over_budget=on_over_budget)
+            queue.put('chat_message', text_data='chat 0')
+            await asyncio.sleep(0)
+            for count in range(5):
+                queue.put('online_count_update', text_data=f'count {count}', coalesce_key='online_count')
+            release.set()
+            for _ in range(5):
+                await asyncio.sleep(0)
+            queue.close()
+            return sent
+
+        self.assertEqual(async_to_sync(scenario)(), ['chat 0', 'count 4'])
+
+
+class LiveSessionTestCase(TransactionTestCase):
+    """A moderator and two students in an ongoing session, with fresh presence and sequences"""
+    # Set by the AsyncORM variants at the end of this module
+    async_orm = False
+
+    def setUp(self):
+        if self.async_orm:
+            # On top of any DEBATE_REALTIME the test class overrides
+            async_orm = override_settings(DEBATE_REALTIME={**settings.DEBATE_REALTIME, 'ASYNC_ORM': True})
+            async_orm.enable()
+            self.addCleanup(async_orm.disable)
+        self.moderator = User.objects.create_user('moderator', 'moderator@example.com', 'password', role='MODERATOR')
+        self.students = [
+            User.objects.create_user(f'student{i}', f'student{i}@example.com', 'password')
+            for i in range(2)
+        ]
+        topic = DebateTopic.objects.create(
+            title='Live session', description='Topic for WebSocket consumer tests', created_by=self.moderator
+        )
+        now = timezone.now()
+        self.session = DebateSession.objects.create(
+            topic=topic,
+            start_time=now - timedelta(minutes=5),
+            end_time=now + timedelta(hours=1),
+            created_by=self.moderator
+        )
+        for student in self.students:
+            Participant.objects.create(user=student, session=self.session)
+        membership_cache.session_deleted(self.session.id)
+        sanction_cache.discard(self.session.id)
+        self.addCleanup(recent_messages.discard, self.session.id)
+        self.addCleanup(replay_buffer.discard, self.session.id)
+        self.addCleanup(setattr, message_sequences, 'backend', message_sequences.backend)
+        message_sequences.backend = InMemorySequenceBackend()
+        self.addCleanup(setattr, presence, 'backend', presence.backend)
+        presence.backend = InMemoryPresenceBackend()
+        # Snapshot changes left over from other tests' sessions
+        presence._pending.clear()
+        presence._heartbeats.clear()
+        presence._local.clear()
+
+    async def connect(self, user, path=None, app=application, query=''):
+        """Connect a user to the session's socket; returns the communicator and its first frame"""
+        token = str(AccessToken.for_user(user))
+        path = path or f'/ws/debate/{self.session.id}/'
+        communicator = WebsocketCommunicator(app, f'{path}?token={token}{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, await communicator.receive_json_from()
+
+
+class StalledClient:
+    """
+    ASGI wrapper whose WebSocket sends stop completing while reading is
+    cleared, like sends under uvicorn to a client that stopped reading
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.reading = asyncio.Event()
+        self.reading.set()
+
+    async def __call__(self, scope, receive, send):
+        async def send_when_read(message):
+            if message['type'] == 'websocket.send':
+                await self.reading.wait()
+            await send(message)
+
+        return await self.app(scope, receive, send_when_read)
+
+
+@override_settings(DEBATE_REALTIME={'OUTBOUND_QUEUE_SIZE': 2, 'OUTBOUND_OVER_BUDGET_SECONDS': 0.05})
+class SlowClientTests(LiveSessionTestCase):
+    """A DebateConsumer whose client stops reading drops chatter and is closed once over budget"""
+
+    def test_over_budget_client_disconnected(self):
+        client = StalledClient(application)
+        closed_before = OUTBOUND_OVER_BUDGET.value()
+        dropped_before = OUTBOUND_DROPPED.value(type='online_count_update')
+
+        async def scenario():
+            communicator, _ = await self.connect(self.students[0], app=client)
+            client.reading.clear()
+            # The first update blocks the writer and the rest fill the queue
+            for count in range(3):
+                await broadcast(self.session.id, {'type': 'online_count_update', 'online_count': count})
+            # Chat evicts them, then keeps the queue full for over 0.05 seconds
+            for number in range(6):
+                await broadcast(self.session.id, {'type': 'chat_message', 'message': {'content': f'chat {number}'}})
+                await asyncio.sleep(0.03)
+            closed = await communicator.receive_output()
+            await communicator.disconnect(code=4008)
+            return closed
+
+        self.assertEqual(async_to_sync(scenario)(), {'type': 'websocket.close', 'code': 4008})
+        self.assertEqual(OUTBOUND_OVER_BUDGET.value() - closed_before, 1)
+        self.assertEqual(OUTBOUND_DROPPED.value(type='online_count_update') - dropped_before, 2)
+
+
+@override_settings(DEBATE_REALTIME={
+    'MESSAGE_WRITER_WORKER_ID': 0, 'MESSAGE_FLUSH_INTERVAL': 60, 'REPLAY_MAX_MESSAGES': 3
+})
+class ResumeReplayTests(LiveSessionTestCase):
+    """Clients connecting with resume_from get the chat messages they missed, and whether that was all"""
+
+    def store_messages(self, count):
+        for number in range(count):
+            sequence = async_to_sync(message_sequences.allocate)(self.session.id)
+            Message.objects.create(
+                session=self.session, sender=self.students[0], content=f'Stored {number}', sequence=sequence
+            )
+
+    async def chat(self, communicator, count):
+        for number in range(count):
+            await communicator.send_json_to({'type': 'chat_message', 'content': f'Sent {number}'})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'chat_message')
+
+    async def resume(self, user, resume_from):
+        """Connect with resume_from; returns the replayed frames and replay_complete"""
+        communicator, _ = await self.connect(user, query=f'&resume_from={resume_from}')
+        frames = []
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == 'replay_complete':
+                await communicator.disconnect()
+                return frames, frame
+            frames.append(frame)
+
+    def test_buffer_hit(self):
+        before = REPLAYED.value(source='buffer')
+
+        async def scenario():
+            sender, _ = await self.connect(self.students[0])
+            await self.chat(sender, 2)
+            replayed = await self.resume(self.students[1], 0)
+            await sender.disconnect()
+            await message_writer.flush()
+            return replayed
+
+        frames, complete = async_to_sync(scenario)()
+        self.assertEqual([frame['message']['content'] for frame in frames], ['Sent 0', 'Sent 1'])
+        self.assertEqual(complete, {
+            'type': 'replay_complete', 'replayed': 2, 'complete': True, 'last_sequence': 2,
+            'session_id': self.session.id
+        })
+        self.assertEqual(REPLAYED.value(source='buffer') - before, 2)
+
+    def test_database_fallback_writes_buffered_messages(self):
+        before = REPLAYED.value(source='database')
+
+        async def scenario():
+            sender, _ = await self.connect(self.students[0])
+            await self.chat(sender, 2)
+            await sender.disconnect()
+            # Say this worker restarted in between, losing its replay buffer
+            replay_buffer.discard(self.session.id)
+            return await self.resume(self.students[1], 1)
+
+        frames, complete = async_to_sync(scenario)()
+        self.assertEqual([frame['message']['content'] for frame in frames], ['Sent 1'])
+        self.assertTrue(complete['complete'])
+        self.assertEqual(REPLAYED.value(source='database') - before, 1)
+
+    def test_unstored_messages_leave_replay_incomplete(self):
+        self.store_messages(1)
+        # Allocated by another worker, whose writer hasn't stored it yet
+        async_to_sync(message_sequences.allocate)(self.session.id)
+
+        frames, complete = async_to_sync(self.resume)(self.students[1], 0)
+        self.assertEqual([frame['message']['content'] for frame in frames], ['Stored 0'])
+        self.assertFalse(complete['complete'])
+        self.assertEqual(complete['last_sequence'], 2)
+
+    def test_deleted_messages_leave_replay_complete(self):
+        self.store_messages(2)
+        Message.objects.filter(sequence=2).update(is_deleted=True)
+
+        frames, complete = async_to_sync(self.resume)(self.students[1], 0)
+        self.assertEqual(len(frames), 1)
+        self.assertTrue(complete['complete'])
+
+    def test_over_limit(self):
+        self.store_messages(5)
+
+        frames, complete = async_to_sync(self.resume)(self.students[1], 0)
+        self.assertEqual([frame['message']['sequence'] for frame in frames], [1, 2, 3])
+        self.assertEqual((complete['replayed'], complete['complete'], complete['last_sequence']), (3, False, 5))
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(realtime_setting('REDIS_URL'), socket_connect_timeout=0.2).ping()
+    except redis.RedisError:
+        return False
+
+
+class PresenceBackendTests:
+    """Users count once per session however many connections they have open"""
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def test_connections_counted_per_user(self):
+        async def scenario():
+            backend = self.make_backend()
+            return [
+                await backend.add(1, 10, 'tab a'),
+                await backend.add(1, 10, 'tab b'),
+                await backend.add(1, 11, 'tab c'),
+                await backend.add(2, 10, 'tab d'),
+                await backend.remove(1, 10, 'tab a'),
+                await backend.remove(1, 10, 'tab b'),
+                await backend.remove(1, 12, 'never connected'),
+                await backend.members(1),
+                await backend.count(2),
+                await backend.remove(1, 11, 'tab c'),
+                await backend.count(1),
+            ]
+
+        self.assertEqual(async_to_sync(scenario)(), [
+            (1, True), (1, False), (2, True), (1, True),
+            (2, False), (1, True), (1, False),
+            {11}, 1, (0, True), 0,
+        ])
+
+
+class InMemoryPresenceBackendTests(PresenceBackendTests, SimpleTestCase):
+    def make_backend(self):
+        return InMemoryPresenceBackend()
+
+
+@skipUnless(redis_available(), 'needs the Redis server at REDIS_URL')
+class RedisPresenceBackendTests(PresenceBackendTests, SimpleTestCase):
+    def make_backend(self):
+        prefix = f'test:presence:{uuid.uuid4().hex}'
+        self.addCleanup(self.delete_keys, f'{prefix}*')
+        return RedisPresenceBackend(key_prefix=prefix)
+
+    @staticmethod
+    def delete_keys(pattern):
+        client = redis.Redis.from_url(realtime_setting('REDIS_URL'))
+        for key in client.scan_iter(pattern):
+            client.delete(key)
+
+    def test_stale_users_expired(self):
+        async def scenario():
+            backend = self.make_backend()
+            await backend.add(1, 10, 'tab a')
+            await backend.add(1, 11, 'tab b')
+            fresh = await backend.expire(time.time() - 60)
+            stale = await backend.expire(time.time() + 1)
+            return fresh, stale, await backend.count(1)
+
+        fresh, stale, count = async_to_sync(scenario)()
+        self.assertEqual(fresh, [])
+        self.assertEqual(sorted(stale), [(1, 10), (1, 11)])
+        self.assertEqual(count, 0)
+
+
+class PresenceConsumerTests(LiveSessionTestCase):
+    """Joining and leaving a session updates its online count for everyone in the room"""
+
+    async def next_count_update(self, communicator):
+        update = await communicator.receive_json_from()
+        self.assertEqual(update['type'], 'online_count_update')
+        return (
+            update['online_count'],
+            update['total_participants'],
+            (update['user_joined'] or {}).get('username'),
+            (update['user_left'] or {}).get('username'),
+        )
+
+    def test_join_leave_and_disconnect(self):
+        first, second = self.students
+
+        async def scenario():
+            watcher, snapshot = await self.connect(first)
+            counts = [snapshot['online_count']]
+            tab, snapshot = await self.connect(second)
+            counts.append(snapshot['online_count'])
+            updates = [await self.next_count_update(watcher)]
+
+            # A second tab doesn't count the user twice
+            other_tab, snapshot = await self.connect(second)
+            counts.append(snapshot['online_count'])
+            updates.append(await self.next_count_update(watcher))
+            await other_tab.disconnect()
+            updates.append(await self.next_count_update(watcher))
+            members = await presence.online_user_ids(self.session.id)
+
+            await tab.disconnect()
+            updates.append(await self.next_count_update(watcher))
+            await presence.flush()
+            await watcher.disconnect()
+            return counts, updates, members
+
+        counts, updates, members = async_to_sync(scenario)()
+        self.assertEqual(counts, [1, 2, 2])
+        self.assertEqual(updates, [
+            (2, 2, 'student1', None),
+            (2, 2, 'student1', None),
+            (2, 2, None, 'student1'),
+            (1, 2, None, 'student1'),
+        ])
+        self.assertEqual(members, {first.id, second.id})
+        # The snapshot written after the second user left
+        self.assertEqual(list(OnlineParticipant.objects.values_list('user_id', flat=True)), [first.id])
+        self.assertEqual(async_to_sync(presence.online_count)(self.session.id), 0)
+
+
+@override_settings(DEBATE_REALTIME={'PRESENCE_STALE_AFTER': 60})
+class PresenceSnapshotTests(LiveSessionTestCase):
+    """Heartbeats refresh OnlineParticipant rows in bulk and the sweeper removes stale ones"""
+
+    def seen(self, user, seconds_ago):
+        participant = OnlineParticipant.objects.create(
+            user=user, session=self.session, channel_name=f'channel.{user.username}'
+        )
+        OnlineParticipant.objects.filter(pk=participant.pk).update(
+            last_seen=timezone.now() - timedelta(seconds=seconds_ago)
+        )
+
+    def last_seen(self):
+        return dict(OnlineParticipant.objects.values_list('user__username', 'last_seen'))
+
+    def test_sweep_deletes_stale_rows(self):
+        stale, fresh = self.students
+        self.seen(stale, 120)
+        self.seen(fresh, 30)
+        before = PRESENCE_EXPIRED.value(store='database')
+
+        async_to_sync(presence.sweep)()
+        self.assertEqual(list(self.last_seen()), ['student1'])
+        self.assertEqual(PRESENCE_EXPIRED.value(store='database') - before, 1)
+
+    def test_heartbeats_written_in_one_update(self):
+        for student in self.students:
+            self.seen(student, 30)
+        before = self.last_seen()
+        for _ in range(3):
+            for student in self.students:
+                presence.heartbeat(self.session.id, student.id)
+
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            async_to_sync(presence.flush)()
+        self.assertEqual(len(queries), 1, queries)
+        self.assertTrue(queries[0].startswith('UPDATE'))
+        after = self.last_seen()
+        for username, last_seen in before.items():
+            self.assertGreater(after[username], last_seen + timedelta(seconds=29))
+
+
+class MessagePackProtocolTests(LiveSessionTestCase):
+    """Clients negotiating debate.msgpack.v1 talk binary MessagePack frames; others still get JSON"""
+
+    def test_binary_chat_round_trip(self):
+        token = str(AccessToken.for_user(self.students[0]))
+
+        async def scenario():
+            packed = WebsocketCommunicator(
+                application, f'/ws/debate/{self.session.id}/?token={token}', subprotocols=[MSGPACK_SUBPROTOCOL]
+            )
+            connected, subprotocol = await packed.connect()
+            self.assertTrue(connected)
+            frames = [decode_msgpack(await packed.receive_from())]
+            plain, _ = await self.connect(self.students[1])
+            frames.append(decode_msgpack(await packed.receive_from()))
+
+            await packed.send_to(bytes_data=encode_msgpack({'type': 'chat_message', 'content': 'Packed'}))
+            frames.append(decode_msgpack(await packed.receive_from()))
+            relayed = await plain.receive_json_from()
+            await packed.disconnect()
+            await plain.disconnect()
+            await message_writer.flush()
+            return subprotocol, frames, relayed
+
+        subprotocol, frames, relayed = async_to_sync(scenario)()
+        self.assertEqual(subprotocol, MSGPACK_SUBPROTOCOL)
+        self.assertEqual(
+            [frame['type'] for frame in frames], ['connection_established', 'online_count_update', 'chat_message']
+        )
+        self.assertEqual(frames[1]['user_joined']['username'], 'student1')
+        message = frames[2]['message']
+        self.assertEqual((message['content'], message['user']['username']), ('Packed', 'student0'))
+        # Milliseconds since the epoch, where JSON clients get ISO 8601
+        self.assertIsInstance(message['timestamp'], int)
+        self.assertEqual(relayed['message']['id'], message['id'])
+        self.assertEqual(relayed['message']['content'], 'Packed')
+        self.assertIsInstance(relayed['message']['timestamp'], str)
+
+
+class SanctionTests(LiveSessionTestCase):
+    """Mutes stop chat over the WebSocket and removals close the removed user's socket"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, sanction_cache, 'ttl', sanction_cache.ttl)
+        sanction_cache.ttl = 0.2
+
+    async def chat(self, communicator, content):
+        """Send a chat message; returns the error code, or None if it was broadcast"""
+        await communicator.send_json_to({'type': 'chat_message', 'content': content})
+        reply = await communicator.receive_json_from()
+        return reply.get('code', reply['type']) if reply['type'] == 'error' else None
+
+    def test_muted_chat_rejected(self):
+        student = self.students[0]
+
+        async def scenario():
+            communicator, _ = await self.connect(student)
+            await database_sync_to_async(ModerationAction.objects.create)(
+                action='MUTE', participant=student, session=self.session
+            )
+            notice = await communicator.receive_json_from()
+            rejected = await self.chat(communicator, 'Muted')
+            await communicator.disconnect()
+            return notice, rejected
+
+        notice, rejected = async_to_sync(scenario)()
+        self.assertEqual((notice['type'], notice['action'], notice['expires_at']), ('moderation_action', 'mute', None))
+        self.assertEqual(rejected, 'muted')
+        self.assertFalse(Message.objects.exists())
+
+    def test_removed_participant_disconnected(self):
+        removed, other = self.students
+
+        async def scenario():
+            communicator, _ = await self.connect(removed)
+            watcher, _ = await self.connect(other)
+            await communicator.receive_json_from()
+            await send_sanction(self.session.id, removed.id, 'REMOVE')
+            notice = await communicator.receive_json_from()
+            closed = await communicator.receive_output()
+            await communicator.disconnect(code=4004)
+            left = await watcher.receive_json_from()
+            await watcher.disconnect()
+            return notice, closed, left
+
+        notice, closed, left = async_to_sync(scenario)()
+        self.assertEqual(notice['action'], 'remove')
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': 4004})
+        self.assertEqual((left['online_count'], left['user_left']['username']), (1, 'student0'))
+
+    def test_missed_timed_mute_applied_after_ttl(self):
+        student = self.students[0]
+
+        async def scenario():
+            communicator, _ = await self.connect(student)
+            replies = [await self.chat(communicator, 'Before')]
+            # Recorded without the sanction.update event, as if this worker missed it
+            await database_sync_to_async(ModerationAction.objects.bulk_create)([ModerationAction(
+                action='MUTE', participant=student, session=self.session,
+                expires_at=timezone.now() + timedelta(seconds=0.5)
+            )])
+            replies.append(await self.chat(communicator, 'Stale cache'))
+            await asyncio.sleep(0.25)
+            replies.append(await self.chat(communicator, 'Reloaded'))
+            await asyncio.sleep(0.3)
+            replies.append(await self.chat(communicator, 'Mute over'))
+            await communicator.disconnect()
+            await message_writer.flush()
+            return replies
+
+        self.assertEqual(async_to_sync(scenario)(), [None, None, 'muted', None])
+        self.assertEqual(
+            list(Message.objects.order_by('sequence').values_list('content', flat=True)),
+            ['Before', 'Stale cache', 'Mute over']
+        )
+
+
+@override_settings(DEBATE_REALTIME={
+    'MESSAGE_WRITER_WORKER_ID': 0, 'MESSAGE_FLUSH_INTERVAL': 60,
+    'DRAIN_BATCH_SIZE': 2, 'DRAIN_CLOSE_SPREAD': 0.3, 'DRAIN_RECONNECT_JITTER': 5.0, 'DRAIN_TIMEOUT': 2.0
+})
+class WorkerDrainTests(LiveSessionTestCase):
+    """Draining asks clients to reconnect in batches, then flushes buffered messages and presence"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, drain, '_consumers', drain._consumers)
+        drain._consumers = weakref.WeakSet()
+        self.addCleanup(setattr, drain, 'finished', False)
+
+    def test_drain(self):
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            clients = [(await self.connect(user))[0] for user in (*self.students, self.students[0])]
+            for client in clients[:-1]:
+                # Online count updates for the later connections
+                while not await client.receive_nothing():
+                    await client.receive_json_from()
+            await clients[0].send_json_to({'type': 'chat_message', 'content': 'Buffered'})
+            for client in clients:
+                await client.receive_json_from()
+            await presence.flush()
+            online = await database_sync_to_async(OnlineParticipant.objects.count)()
+
+            async def reconnect(client):
+                frame = await client.receive_json_from()
+                while frame['type'] == 'online_count_update':
+                    # Clients closed in the first batch leaving
+                    frame = await client.receive_json_from()
+                asked_at = loop.time()
+                closed = await client.receive_output()
+                await client.disconnect(code=1012)
+                return asked_at, frame, closed
+
+            drain.started_at = time.monotonic()
+            started = loop.time()
+            results = await asyncio.gather(drain.drain(), *(reconnect(client) for client in clients))
+            remaining = await database_sync_to_async(OnlineParticipant.objects.count)()
+            return online, remaining, [(asked_at - started, frame, closed) for asked_at, frame, closed in results[1:]]
+
+        online, remaining, reconnects = async_to_sync(scenario)()
+        self.assertEqual(online, 2)
+        for _, frame, closed in reconnects:
+            self.assertEqual((frame['type'], frame['reason']), ('reconnect', 'server_restart'))
+            self.assertTrue(0 <= frame['retry_after'] <= 5.0, frame)
+            self.assertEqual(closed, {'type': 'websocket.close', 'code': 1012})
+        # Two batches, DRAIN_CLOSE_SPREAD / 2 seconds apart
+        asked = sorted(asked_at for asked_at, _, _ in reconnects)
+        self.assertLess(asked[1], 0.1)
+        self.assertGreaterEqual(asked[2], 0.15)
+        # Flushed once the sockets had gone
+        self.assertTrue(drain.finished)
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['Buffered'])
+        self.assertEqual(remaining, 0)
+
+
+class UserConsumerSubscriptionTests(LiveSessionTestCase):
+    """One ws/ socket multiplexes the sessions its user subscribes to"""
+
+    def add_session(self, *participants):
+        now = timezone.now()
+        session = DebateSession.objects.create(
+            topic=self.session.topic,
+            start_time=now - timedelta(minutes=5),
+            end_time=now + timedelta(hours=1),
+            created_by=self.moderator
+        )
+        for participant in participants:
+            Participant.objects.create(user=participant, session=session)
+        membership_cache.session_deleted(session.id)
+        return session
+
+    def test_subscribe_receive_unsubscribe(self):
+        first = self.session.id
+        second = self.add_session(self.students[0]).id
+        elsewhere = self.add_session(self.students[1]).id
+
+        async def scenario():
+            communicator, _ = await self.connect(self.students[0], path='/ws/')
+
+            async def send(frame):
+                await communicator.send_json_to(frame)
+                return await communicator.receive_json_from()
+
+            async def received(session_id):
+                await broadcast(session_id, {'type': 'chat_message', 'message': {'content': f'In {session_id}'}})
+                if await communicator.receive_nothing():
+                    return None
+                return (await communicator.receive_json_from())['session_id']
+
+            replies = [
+                await send({'type': 'subscribe', 'stream': 'session', 'session_id': first}),
+                await send({'type': 'subscribe', 'stream': 'session', 'session_id': second}),
+                await send({'type': 'subscribe', 'stream': 'session', 'session_id': elsewhere}),
+                await send({'type': 'subscribe', 'stream': 'session', 'session_id': first}),
+            ]
+            before = [await received(first), await received(second)]
+            replies.append(await send({'type': 'unsubscribe', 'stream': 'session', 'session_id': first}))
+            after = [await received(first), await received(second)]
+            replies.append(await send({'type': 'chat_message', 'session_id': first, 'content': 'Gone'}))
+            online = [await presence.online_user_ids(first), await presence.online_user_ids(second)]
+            await communicator.disconnect()
+            return replies, before, after, online
+
+        replies, before, after, online = async_to_sync(scenario)()
+        self.assertEqual([(reply['type'], reply.get('code'), reply['session_id']) for reply in replies], [
+            ('subscribed', None, first),
+            ('subscribed', None, second),
+            ('error', 'forbidden', elsewhere),
+            ('error', 'already_subscribed', first),
+            ('unsubscribed', None, first),
+            ('error', 'not_subscribed', first),
+        ])
+        self.assertEqual(before, [first, second])
+        self.assertEqual(after, [None, second])
+        # Leaving one session doesn't leave the other
+        self.assertEqual(online, [set(), {self.students[0].id}])
+
+
+class ConnectHandshakeTests(TransactionTestCase):
+    """Queries run by DebateConsumer.connect before the connection_established snapshot"""
+
+    def setUp(self):
+        moderator = User.objects.create_user('moderator', 'moderator@example.com', 'password', role='MODERATOR')
+        self.students = [
+            User.objects.create_user(f'student{i}', f'student{i}@example.com', 'password')
+            for i in range(2)
+        ]
+        topic = DebateTopic.objects.create(
+            title='Connect handshake', description='Topic for connect query count tests', created_by=moderator
+        )
+        now = timezone.now()
+        self.session = DebateSession.objects.create(
+            topic=topic,
+            start_time=now - timedelta(minutes=5),
+            end_time=now + timedelta(hours=1),
+            created_by=moderator
+        )
+        for student in self.students:
+            Participant.objects.create(user=student, session=self.session)
+        membership_cache.session_deleted(self.session.id)
+
+    async def connect(self, token):
+        communicator = WebsocketCommunicator(application, f'/ws/debate/{self.session.id}/?token={token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'connection_established')
+        return communicator, snapshot
+
+    def run_counting_queries(self, scenario):
+        """
+        Run an async scenario, recording the SQL it runs. The consumers'
+        database calls are thread sensitive, so they run on this thread's
+        connection.
+        """
+        self.queries = []
+
+        def record(execute, sql, params, many, context):
+            self.queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            async_to_sync(scenario)()
+
+    async def connect_counting(self, token, max_queries):
+        start = len(self.queries)
+        communicator, snapshot = await self.connect(token)
+        queries = self.queries[start:]
+        self.assertLessEqual(len(queries), max_queries, queries)
+        return communicator, snapshot
+
+    def test_cold_connect(self):
+        async def scenario():
+            # Token user, session membership and the session's message sequence
+            token = str(AccessToken.for_user(self.students[0]))
+            communicator, snapshot = await self.connect_counting(token, 3)
+
+            self.assertEqual(snapshot['online_count'], 1)
+            self.assertEqual(snapshot['total_participants'], 2)
+            self.assertEqual(snapshot['typing_users'], [])
+            self.assertEqual(snapshot['last_sequence'], 0)
+            # The snapshot is the only frame; the join broadcast skips its own connection
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        self.run_counting_queries(scenario)
+
+    def test_warm_connect(self):
+        async def scenario():
+            first, _ = await self.connect(str(AccessToken.for_user(self.students[0])))
+
+            # A new token still resolves its user; everything else is cached
+            token = str(AccessToken.for_user(self.students[1]))
+            second, snapshot = await self.connect_counting(token, 1)
+            self.assertEqual(snapshot['online_count'], 2)
+
+            update = await first.receive_json_from()
+            self.assertEqual(update['type'], 'online_count_update')
+            self.assertEqual(update['user_joined']['username'], 'student1')
+            await second.disconnect()
+
+            # Reconnecting with the same token needs no queries at all
+            second, _ = await self.connect_counting(token, 0)
+            await second.disconnect()
+            await first.disconnect()
+
+        self.run_counting_queries(scenario)
+
+
+@override_settings(DEBATE_REALTIME={'MESSAGE_WRITER_WORKER_ID': 0, 'MESSAGE_FLUSH_INTERVAL': 60})
+class MessageWriterFailureTests(TransactionTestCase):
+    """Buffered messages that fail to insert are retried, then dead-lettered, never dropped silently"""
+
+    def setUp(self):
+        self.student = User.objects.create_user('student', 'student@example.com', 'password')
+        topic = DebateTopic.objects.create(
+            title='Write failures', description='Topic for message writer failure tests', created_by=self.student
+        )
+        now = timezone.now()
+        self.session = DebateSession.objects.create(
+            topic=topic, start_time=now, end_time=now + timedelta(hours=1), created_by=self.student
+        )
+
+    def test_failed_rows_requeued_then_dead_lettered(self):
+        writer = MessageWriter()
+
+        async def scenario():
+            writer.enqueue(self.session.id, self.student, 'Saved', sequence=1)
+            # content is NOT NULL, so this row fails on every attempt
+            writer.enqueue(self.session.id, self.student, None, sequence=2)
+            buffered = []
+            for _ in range(3):
+                await writer.flush()
+                buffered.append(writer.buffered)
+            writer._timer.cancel()
+            return buffered
+
+        with self.assertLogs('apps.debates.message_writer', 'WARNING') as logs:
+            buffered = async_to_sync(scenario)()
+        self.assertEqual(buffered, [1, 1, 0])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['Saved'])
+        self.assertEqual([message.sequence for message in writer.dead_letters], [2])
+        self.assertIn('ERROR:apps.debates.message_writer:Dropped chat message after 3 failed inserts', logs.output[-1])
+
+
+class ReceivedFrameMetricTests(TransactionTestCase):
+    """Client-chosen frame types can't add label values to ws_messages_received_total"""
+
+    def test_invented_types_counted_as_unknown(self):
+        user = User.objects.create_user('student', 'student@example.com', 'password')
+        token = str(AccessToken.for_user(user))
+        before = WS_RECEIVED.value(type='unknown')
+
+        async def scenario():
+            communicator = WebsocketCommunicator(application, f'/ws/?token={token}')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()
+            for frame in ({'type': 'made_up_1'}, {'type': 'made_up_2'}, {'type': ['ping']}, [1, 2]):
+                await communicator.send_json_to(frame)
+                self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+            await communicator.send_json_to({'type': 'ping'})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'pong')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(WS_RECEIVED.value(type='unknown') - before, 4)
+        self.assertFalse([key for key in WS_RECEIVED._values if 'made_up' in repr(key)])
+
+
+class EndedSessionChatTests(TransactionTestCase):
+    """Chat over the WebSocket closes with the session, as it does over REST"""
+
+    def test_chat_rejected_after_end(self):
+        student = User.objects.create_user('student', 'student@example.com', 'password')
+        topic = DebateTopic.objects.create(
+            title='Ended session', description='Topic for ended session chat tests', created_by=student
+        )
+        now = timezone.now()
+        session = DebateSession.objects.create(
+            topic=topic, start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1), created_by=student
+        )
+        Participant.objects.create(user=student, session=session)
+        membership_cache.session_deleted(session.id)
+        token = str(AccessToken.for_user(student))
+
+        async def scenario():
+            communicator = WebsocketCommunicator(application, f'/ws/debate/{session.id}/?token={token}')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()
+            await communicator.send_json_to({'type': 'chat_message', 'content': 'Too late'})
+            reply = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return reply
+
+        self.assertEqual(async_to_sync(scenario)()['code'], 'session_not_ongoing')
+        self.assertFalse(Message.objects.filter(session=session).exists())
+
+
+class ParticipantsCountTests(TestCase):
+    """Saving a session doesn't overwrite participants_count with the value it was loaded with"""
+
+    def test_full_save_keeps_concurrent_joins(self):
+        moderator = User.objects.create_user('moderator', 'moderator@example.com', 'password', role='MODERATOR')
+        topic = DebateTopic.objects.create(
+            title='Participant counts', description='Topic for participants_count tests', created_by=moderator
+        )
+        now = timezone.now()
+        session = DebateSession.objects.create(
+            topic=topic, start_time=now, end_time=now + timedelta(hours=1), created_by=moderator
+        )
+        stale = DebateSession.objects.get(id=session.id)
+        student = User.objects.create_user('student', 'student@example.com', 'password')
+        Participant.objects.create(user=student, session=session)
+
+        stale.max_participants = 10
+        stale.save()
+        session.refresh_from_db()
+        self.assertEqual((session.participants_count, session.max_participants), (1, 10))
+
+    def test_save_leaves_deferred_fields(self):
+        moderator = User.objects.create_user('moderator', 'moderator@example.com', 'password', role='MODERATOR')
+        topic = DebateTopic.objects.create(
+            title='Participant counts', description='Topic for participants_count tests', created_by=moderator
+        )
+        now = timezone.now()
+        session = DebateSession.objects.create(
+            topic=topic, start_time=now, end_time=now + timedelta(hours=1), created_by=moderator
+        )
+        membership_cache.get(session.id)
+        partial = DebateSession.objects.only('id', 'max_participants').get(id=session.id)
+        DebateSession.objects.filter(id=session.id).update(end_time=now + timedelta(hours=2))
+
+        partial.max_participants = 10
+        with self.assertNumQueries(1):
+            partial.save()
+        session.refresh_from_db()
+        self.assertEqual((session.max_participants, session.end_time), (10, now + timedelta(hours=2)))
+        self.assertEqual(membership_cache.get(session.id).end_time, now + timedelta(hours=2))
+
+
+class TokenUserCacheTests(TransactionTestCase):
+    """Users cached for WebSocket auth are dropped when another worker changes them"""
+
+    def test_deactivation_in_another_worker(self):
+        student = User.objects.create_user('student', 'student@example.com', 'password')
+        token = str(AccessToken.for_user(student))
+        self.assertEqual(async_to_sync(get_user_from_token)(token), student)
+
+        # What another worker's deactivation leaves behind: the row and the shared version
+        User.objects.filter(id=student.id).update(is_active=False)
+        bump_version('user', student.id)
+        self.assertFalse(async_to_sync(get_user_from_token)(token).is_authenticated)
+
+
+class MessageHistoryQueryTests(TestCase):
+    """Message history pages cost the same number of queries whatever their size"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.moderator = User.objects.create_user('moderator', 'moderator@example.com', 'password', role='MODERATOR')
+        students = [
+            User.objects.create_user(f'student{i}', f'student{i}@example.com', 'password')
+            for i in range(5)
+        ]
+        topic = DebateTopic.objects.create(
+            title='Message history', description='Topic for message history query tests', created_by=cls.moderator
+        )
+        now = timezone.now()
+        cls.session = DebateSession.objects.create(
+            topic=topic,
+            start_time=now - timedelta(hours=1),
+            end_time=now + timedelta(hours=1),
+            created_by=cls.moderator
+        )
+        for student in students:
+            Participant.objects.create(user=student, session=cls.session)
+        Message.objects.bulk_create([
+            Message(
+                session=cls.session,
+                sender=students[i % len(students)],
+                content=f'Message {i}',
+                sequence=i + 1,
+                timestamp=now - timedelta(minutes=30) + timedelta(seconds=i)
+            )
+            for i in range(120)
+        ])
+
+    def setUp(self):
+        membership_cache.session_deleted(self.session.id)
+        # Keep the sequence seeded from these messages out of later tests' sessions
+        self.addCleanup(setattr, message_sequences, 'backend', message_sequences.backend)
+        message_sequences.backend = InMemorySequenceBackend()
+        self.addCleanup(recent_messages.discard, self.session.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.moderator)
+
+    def get_page(self, url, page_size):
+        # Served from the database, not the recent message cache
+        recent_messages.discard(self.session.id)
+        separator = '&' if '?' in url else '?'
+        response = self.client.get(f'{url}{separator}page_size={page_size}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assert_constant_queries(self, url, queries):
+        # Warm the membership cache and message sequence first
+        self.get_page(url, 1)
+        for page_size in (10, 50, 120):
+            with self.assertNumQueries(queries):
+                body = self.get_page(url, page_size)
+            self.assertEqual(len(body['results']), page_size)
+            message = body['results'][-1]
+            self.assertEqual(message['content'], 'Message 119')
+            self.assertEqual(message['sender'], message['user'])
+            self.assertEqual(message['sender']['username'], 'student4')
+
+    # Session histories also look up the highest stored sequence for their ETag
+    def test_session_messages(self):
+        self.assert_constant_queries(f'/api/debates/sessions/{self.session.id}/messages/', 2)
+        # count is the number of messages on the page, as before pagination
+        body = self.get_page(f'/api/debates/sessions/{self.session.id}/messages/', 10)
+        self.assertEqual((body['count'], body['user_role']), (10, 'moderator'))
+
+    def test_message_list_for_session(self):
+        self.assert_constant_queries(f'/api/debates/messages/?session_id={self.session.id}', 2)
+
+    def test_message_list(self):
+        self.assert_constant_queries('/api/debates/messages/', 1)
+
+    def test_older_pages(self):
+        url = f'/api/debates/sessions/{self.session.id}/messages/'
+        body = self.get_page(url, 50)
+        contents = [message['content'] for message in body['results']]
+        while body['previous']:
+            with self.assertNumQueries(2):
+                body = self.client.get(body['previous']).json()
+            contents = [message['content'] for message in body['results']] + contents
+        self.assertEqual(contents, [f'Message {i}' for i in range(120)])
+
+    def prime_cache(self):
+        url = f'/api/debates/sessions/{self.session.id}/messages/?page_size=200'
+        self.client.get(url)
+        # Served from the recent message cache; only the ETag's sequence lookup queries
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        return url
+
+    def test_edit_in_another_worker_invalidates_cache(self):
+        url = self.prime_cache()
+        # What another worker's edit leaves behind: the row and the shared version
+        Message.objects.filter(session=self.session, content='Message 119').update(content='Edited')
+        bump_version('messages', self.session.id)
+        self.assertEqual(self.client.get(url).json()['results'][-1]['content'], 'Edited')
+
+    def test_admin_bulk_delete_invalidates_cache(self):
+        url = self.prime_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            MessageAdmin._update_messages(Message.objects.filter(content='Message 119'), is_deleted=True)
+        self.assertEqual(self.client.get(url).json()['results'][-1]['content'], 'Message 118')
+
+    def test_senders_serialized_once(self):
+        messages = Message.objects.filter(session=self.session).select_related('sender')[:10]
+        results = MessageSerializer(messages, many=True).data
+        # Five students take turns, so messages 0 and 5 share a sender
+        self.assertIs(results[0]['sender'], results[0]['user'])
+        self.assertIs(results[0]['sender'], results[5]['sender'])
+        self.assertIsNot(results[0]['sender'], results[1]['sender'])
+
+
+class ConditionalGetTests(TestCase):
+    """Session history answers 304 until something in it changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.moderator = User.objects.create_user('moderator', 'moderator@example.com', 'password', role='MODERATOR')
+        cls.student = User.objects.create_user('student', 'student@example.com', 'password')
+        topic = DebateTopic.objects.create(
+            title='Conditional gets', description='Topic for conditional GET tests', created_by=cls.moderator
+        )
+        now = timezone.now()
+        cls.session = DebateSession.objects.create(
+            topic=topic, start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+            created_by=cls.moderator
+        )
+        Participant.objects.create(user=cls.student, session=cls.session)
+        cls.message = Message.objects.create(
+            session=cls.session, sender=cls.student, content='First', sequence=1,
+            timestamp=now - timedelta(minutes=1)
+        )
+
+    def setUp(self):
+        membership_cache.session_deleted(self.session.id)
+        self.addCleanup(setattr, message_sequences, 'backend', message_sequences.backend)
+        message_sequences.backend = InMemorySequenceBackend()
+        self.addCleanup(recent_messages.discard, self.session.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.moderator)
+        self.url = f'/api/debates/sessions/{self.session.id}/messages/'
+
+    def get(self, etag=None, client=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return (client or self.client).get(self.url, **headers)
+
+    def assert_changed(self, etag):
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_new_message(self):
+        etag = self.get()['ETag']
+        sequence = async_to_sync(message_sequences.allocate)(self.session.id)
+        Message.objects.create(session=self.session, sender=self.student, content='Second', sequence=sequence)
+        response = self.assert_changed(etag)
+        self.assertEqual(response.json()['results'][-1]['content'], 'Second')
+
+    def test_edited_message(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.message.content = 'Edited'
+            self.message.save()
+        response = self.assert_changed(etag)
+        self.assertEqual(response.json()['results'][-1]['content'], 'Edited')
+
+    def test_archived_messages(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            archive_session(self.session.id)
+        self.assert_changed(etag)
+
+    def test_etag_per_user(self):
+        student_client = APIClient()
+        student_client.force_authenticate(self.student)
+        moderator_etag = self.get()['ETag']
+        student_response = self.get(client=student_client)
+        self.assertEqual(student_response.status_code, 200)
+        self.assertNotEqual(student_response['ETag'], moderator_etag)
+        # One user's ETag doesn't validate another's copy
+        self.assertEqual(self.get(moderator_etag, client=student_client).status_code, 200)
+
+
+class MessageArchiveTests(TestCase):
+    """History of an archived session is served from its archive"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.moderator = User.objects.create_user('moderator', 'moderator@example.com', 'password', role='MODERATOR')
+        cls.students = [
+            User.objects.create_user(f'student{i}', f'student{i}@example.com', 'password')
+            for i in range(3)
+        ]
+        topic = DebateTopic.objects.create(
+            title='Message archive', description='Topic for message archive tests', created_by=cls.moderator
+        )
+        cls.ended_at = timezone.now() - timedelta(days=40)
+        cls.session = DebateSession.objects.create(
+            topic=topic,
+            start_time=cls.ended_at - timedelta(hours=1),
+            end_time=cls.ended_at,
+            created_by=cls.moderator
+        )
+        for student in cls.students:
+            Participant.objects.create(user=student, session=cls.session)
+        Message.objects.bulk_create([
+            Message(
+                session=cls.session,
+                sender=cls.students[i % len(cls.students)],
+                content=f'Message {i}',
+                sequence=i + 1,
+                timestamp=cls.ended_at - timedelta(minutes=30) + timedelta(seconds=i),
+                is_deleted=i == 7
+            )
+            for i in range(60)
+        ])
+
+    def setUp(self):
+        membership_cache.session_deleted(self.session.id)
+        self.addCleanup(setattr, message_sequences, 'backend', message_sequences.backend)
+        message_sequences.backend = InMemorySequenceBackend()
+        self.client = APIClient()
+        self.client.force_authenticate(self.moderator)
+        self.url = f'/api/debates/sessions/{self.session.id}/messages/?page_size=25'
+
+    def history(self):
+        """Every page from the latest back, as response bodies"""
+        pages = [self.client.get(self.url).json()]
+        while pages[-1]['previous']:
+            pages.append(self.client.get(pages[-1]['previous']).json())
+        return pages
+
+    def archive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return archive_session(self.session.id)
+
+    def test_history_unchanged_by_archiving(self):
+        before = self.history()
+        self.assertEqual(self.archive(), 60)
+        self.assertFalse(Message.objects.filter(session=self.session).exists())
+        archive = MessageArchive.objects.get(session=self.session)
+        self.assertEqual(archive.message_count, 59)
+        self.assertEqual(archive.last_sequence, 60)
+        self.assertEqual(self.history(), before)
+        self.assertEqual(async_to_sync(message_sequences.stored_max)(self.session.id), 60)
+
+    def test_messages_after_archiving(self):
+        self.archive()
+        Message.objects.create(
+            session=self.session, sender=self.students[0], content='Late message', sequence=61
+        )
+        body = self.client.get(self.url).json()
+        self.assertEqual(
+            [message['content'] for message in body['results'][-2:]], ['Message 59', 'Late message']
+        )
+
+        # Archiving again merges it into the archive
+        self.assertEqual(self.archive(), 1)
+        self.assertEqual(MessageArchive.objects.get(session=self.session).message_count, 60)
+        self.assertEqual(self.client.get(self.url).json(), body)
+
+
+    def test_messages_sent_kept_after_archiving(self):
+        client = APIClient()
+        client.force_authenticate(self.students[1])
+
+        def messages_sent():
+            return client.get('/api/debates/sessions/my_stats/').data['messages_sent']
+
+        # Every third message, less the deleted one
+        self.assertEqual(messages_sent(), 19)
+        self.archive()
+        self.assertEqual(messages_sent(), 19)
+        self.assertEqual(
+            dict(ArchivedMessageCount.objects.values_list('user__username', 'count')),
+            {'student0': 20, 'student1': 19, 'student2': 20}
+        )
+
+        # Archiving again recounts the merged archive rather than adding to it
+        Message.objects.create(session=self.session, sender=self.students[1], content='Late message', sequence=61)
+        self.assertEqual(messages_sent(), 20)
+        self.archive()
+        self.assertEqual(messages_sent(), 20)
+        with self.assertNumQueries(1):
+            self.assertEqual(archived_message_count(self.students[1]), 20)
+
+# The consumer tests again with database_operation running the native
+# async ORM implementations (DEBATE_REALTIME['ASYNC_ORM'])
+class SlowClientAsyncORMTests(SlowClientTests):
+    async_orm = True
+
+
+class ResumeReplayAsyncORMTests(ResumeReplayTests):
+    async_orm = True
+
+
+class PresenceConsumerAsyncORMTests(PresenceConsumerTests):
+    async_orm = True
+
+
+class MessagePackProtocolAsyncORMTests(MessagePackProtocolTests):
+    async_orm = True
+
+
+class SanctionAsyncORMTests(SanctionTests):
+    async_orm = True
+
+
+class WorkerDrainAsyncORMTests(WorkerDrainTests):
+    async_orm = True
+
+
+class UserConsumerSubscriptionAsyncORMTests(UserConsumerSubscriptionTests):
+    async_orm = True
@@ -0,0 +1,142 @@
+import asyncio
+
+from .conf import realtime_setting
+from .groups import broadcast
+
+
+class TypingState:
+    """Typing status of one user in one session"""
+    __slots__ = ('username', 'is_typing', 'broadcast_state', 'last_broadcast_at', 'expires_at', 'flush_at')
+
+    def __init__(self, username):
+        self.username = username
+        self.is_typing = False
+        # What the room was last told about this user
+        self.broadcast_state = False
+        self.last_broadcast_at = float('-inf')
+        self.expires_at = None
+        self.flush_at = None
+
+    def next_deadline(self):
+        deadlines = [d for d in (self.expires_at, self.flush_at) if d is not None]
+        return min(deadlines) if deadlines else None
+
+
+class TypingTracker:
+    """
+    Ephemeral typing indicators kept in process memory.
+
+    Typing expires after TYPING_TIMEOUT seconds without a refresh, and the
+    room hears about each user at most once per TYPING_BROADCAST_INTERVAL;
+    changes inside the interval are coalesced into one update at its end.
+    All deadlines are driven by a single hashed timer wheel per process
+    instead of one task per keystroke.
+    """
+
+    def __init__(self, tick=0.25, slots=64):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        # (session_id, user_id) -> TypingState
+        self._states = {}
+        self._cursor = None
+        self._task = None
+
+    async def update(self, session_id, user_id, username, is_typing):
+        """Record a typing/stopped-typing event from a client"""
+        key = (session_id, user_id)
+        state = self._states.get(key)
+        if state is None:
+            if not is_typing:
+                return
+            state = self._states[key] = TypingState(username)
+
+        now = asyncio.get_running_loop().time()
+        state.is_typing = is_typing
+        state.expires_at = now + realtime_setting('TYPING_TIMEOUT') if is_typing else None
+        await self._request_broadcast(key, state, now)
+        self._schedule(key, state)
+
+    async def clear(self, session_id, user_id):
+        """Stop a user's typing indicator, e.g. after they sent a message or left"""
+        state = self._states.get((session_id, user_id))
+        if state is not None:
+            await self.update(session_id, user_id, state.username, False)
+
+    def typing_usernames(self, session_id):
+        """Usernames currently shown as typing in a session"""
+        return [
+            state.username for (sid, _), state in self._states.items()
+            if sid == session_id and state.broadcast_state
+        ]
+
+    async def _request_broadcast(self, key, state, now):
+        """Broadcast a state change now, or defer it to the end of the interval"""
+        if state.is_typing == state.broadcast_state:
+            state.flush_at = None
+        elif now - state.last_broadcast_at >= realtime_setting('TYPING_BROADCAST_INTERVAL'):
+            state.flush_at = None
+            await self._broadcast(key, state, now)
+        elif state.flush_at is None:
+            state.flush_at = state.last_broadcast_at + realtime_setting('TYPING_BROADCAST_INTERVAL')
+
+        if not state.is_typing and not state.broadcast_state and state.flush_at is None:
+            self._states.pop(key, None)
+
+    async def _broadcast(self, key, state, now):
+        session_id, user_id = key
+        state.broadcast_state = state.is_typing
+        state.last_broadcast_at = now
+        await broadcast(session_id, {
+            'type': 'typing_indicator',
+            'user': state.username,
+            'is_typing': state.is_typing
+        }, exclude_user_id=user_id, coalesce_key=f'typing:{user_id}')
+
+    def _schedule(self, key, state):
+        """Put a key in the wheel slot of its next deadline"""
+        if key not in self._states:
+            return
+        deadline = state.next_deadline()
+        if deadline is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._cursor = int(loop.time() / self.tick)
+            self._task = loop.create_task(self._run())
+        # Never behind the cursor: a slot already passed only comes round
+        # again a whole turn of the wheel later
+        tick = max(int(deadline / self.tick), self._cursor)
+        self.slots[tick % len(self.slots)].add(key)
+
+    async def _run(self):
+        """Advance the wheel every tick until nothing is left to expire"""
+        loop = asyncio.get_running_loop()
+        while self._states:
+            await asyncio.sleep(self.tick)
+            current = int(loop.time() / self.tick)
+            # Only ticks that are over, so every deadline in the slot has passed
+            while self._cursor < current:
+                await self._process_slot(self._cursor % len(self.slots), loop.time())
+                self._cursor += 1
+
+    async def _process_slot(self, index, now):
+        keys, self.slots[index] = self.slots[index], set()
+        for key in keys:
+            state = self._states.get(key)
+            if state is None:
+                continue
+            try:
+                if state.expires_at is not None and state.expires_at <= now:
+                    state.is_typing = False
+                    state.expires_at = None
+                    await self._request_broadcast(key, state, now)
+                if state.flush_at is not None and state.flush_at <= now:
+                    state.flush_at = None
+                    await self._request_broadcast(key, state, now)
+            except Exception as e:
+                print(f"Error expiring typing indicator: {e}")
+            self._schedule(key, state)
+
+
+typing_tracker = TypingTracker()
@@ -0,0 +1,162 @@
+import functools
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from apps.metrics.registry import registry
+from .models import DebateSession, Message
+
+CONDITIONAL_GETS = registry.counter(
+    'http_conditional_gets_total', 'Versioned debate API reads by outcome', labels=('outcome',)
+)
+
+# Change counters behind the ETags of topic and session lists
+TOPICS = 'topics'
+SESSIONS = 'sessions'
+SCHEDULE = 'schedule'
+
+NO_BOUNDARY = 'none'
+
+
+def _version_key(*scope):
+    return 'debates:version:' + ':'.join(str(part) for part in scope)
+
+
+def get_version(*scope):
+    """
+    The change counter for a resource. Counters start from the clock, so
+    one lost with the cache can't come back at a value an old ETag used.
+    """
+    key = _version_key(*scope)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_version(*scope):
+    """get_version() for async code"""
+    key = _version_key(*scope)
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def bump_version(*scope):
+    """Invalidate every ETag built from a resource's counter"""
+    try:
+        cache.incr(_version_key(*scope))
+    except ValueError:
+        # Not set yet; the next read starts a fresh one
+        pass
+
+
+def schedule_version():
+    """
+    Changes whenever an active session starts or ends, since session
+    status (is_ongoing, has_ended, ...) is computed from the clock. The
+    next start or end time is cached, and passing it bumps SCHEDULE.
+    """
+    boundary = cache.get(_version_key('next_boundary'))
+    now = timezone.now()
+    if boundary is None or (boundary != NO_BOUNDARY and now >= boundary):
+        upcoming = DebateSession.objects.filter(is_active=True).aggregate(
+            next_start=Min('start_time', filter=Q(start_time__gt=now)),
+            next_end=Min('end_time', filter=Q(end_time__gt=now))
+        )
+        times = [value for value in upcoming.values() if value is not None]
+        if boundary is not None:
+            bump_version(SCHEDULE)
+        cache.set(_version_key('next_boundary'), min(times) if times else NO_BOUNDARY, None)
+    return get_version(SCHEDULE)
+
+
+def sessions_changed(session_id=None):
+    """A session was created, edited, joined or left; call once committed"""
+    bump_version(SESSIONS)
+    if session_id is not None:
+        bump_version('session', session_id)
+    # Its start or end time may be the next one now
+    cache.delete(_version_key('next_boundary'))
+
+
+def topic_versions(view, request, *args, **kwargs):
+    return [get_version(TOPICS)]
+
+
+def session_list_versions(view, request, *args, **kwargs):
+    return [get_version(TOPICS), get_version(SESSIONS), schedule_version()]
+
+
+def session_versions(view, request, pk=None, **kwargs):
+    return [get_version(TOPICS), schedule_version(), get_version('session', pk)]
+
+
+def message_versions(view, request, pk=None, **kwargs):
+    """
+    New messages move the session's highest stored sequence (an index
+    lookup), edits and deletes its counter. Stored rather than allocated
+    sequences, so messages still in the write buffer can't be skipped by a
+    response that gets the newer ETag.
+    """
+    session_id = pk if pk is not None else request.query_params.get('session_id')
+    if session_id is None:
+        return None
+    try:
+        session_id = int(session_id)
+    except (TypeError, ValueError):
+        return None
+    return [
+        Message.objects.filter(session_id=session_id).aggregate(last=Max('sequence'))['last'],
+        get_version('messages', session_id),
+        # Joining again moves where a participant's history starts
+        get_version('session', session_id),
+    ]
+
+
+def response_etag(request, versions):
+    """A weak ETag over the versions, the user and the exact request"""
+    user_id = request.user.id if request.user.is_authenticated else None
+    parts = [*versions, user_id, request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+    return 'W/"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def conditional_get(version_func):
+    """
+    Answer GETs whose If-None-Match still matches with 304 Not Modified,
+    before the queryset or serializer runs. version_func(view, request,
+    *args, **kwargs) returns the versions the response is built from, or
+    None to skip the check.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            versions = version_func(self, request, *args, **kwargs) if request.method == 'GET' else None
+            if versions is None:
+                return view_method(self, request, *args, **kwargs)
+
+            etag = response_etag(request, versions)
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                CONDITIONAL_GETS.inc(outcome='not_modified')
+            else:
+                CONDITIONAL_GETS.inc(outcome='full')
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            # Browsers keep the body and revalidate it on every visit
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+            return response
+        return wrapper
+    return decorator
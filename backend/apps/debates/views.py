@@ -3,15 +3,65 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.exceptions import ValidationError
+from asgiref.sync import async_to_sync
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 
+from .archive import archived_message_count, message_archive
 from .models import DebateTopic, DebateSession, Participant, Message
 from .serializers import (
     DebateTopicSerializer, DebateSessionSerializer, 
     ParticipantSerializer, MessageSerializer
 )
 from .permissions import IsModerator
+from .groups import broadcast
+from .membership import membership_cache
+from .pagination import MessageCursorPagination
+from .recent_messages import recent_messages
+from .replay import chat_message_payload
+from .sanctions import sanction_cache
+from .sequences import message_sequences
+from .versions import (
+    conditional_get, get_version, message_versions, session_list_versions, session_versions, topic_versions
+)
+
+
+def session_message_page(membership, user_id, paginator, request):
+    """
+    One page of the serialized messages visible to a user in a session:
+    all of them for the moderator, those since joining for participants.
+    Served from the recent message cache when it covers the page, and
+    from the session's archive once its messages have been archived.
+    """
+    since = None if membership.is_creator(user_id) else membership.joined_at(user_id)
+    before, after, size = paginator.parse_request(request)
+    # Read before querying, see RecentMessageCache.prime
+    last_sequence = async_to_sync(message_sequences.last)(membership.session_id)
+    version = get_version('messages', membership.session_id)
+    records = recent_messages.page(membership.session_id, since, last_sequence, version, before, after, size + 1)
+    if records is not None:
+        return paginator.paginate_records(records)
+
+    messages = Message.objects.filter(
+        session_id=membership.session_id,
+        is_deleted=False
+    ).select_related('sender')
+    if since is not None:
+        messages = messages.filter(timestamp__gte=since)
+    archive = message_archive.get(membership.session_id) if membership.has_ended else None
+    if archive is not None:
+        # Messages sent after archiving are still in the table
+        page = paginator.paginate_messages(
+            archive.window(since, before, after, size + 1) + paginator.window(messages)
+        )
+    else:
+        page = paginator.paginate_queryset(messages, request)
+    results = MessageSerializer(page, many=True).data
+    if paginator.is_latest_page and not paginator.has_older:
+        # The whole history since `since` fit on one page
+        recent_messages.prime(membership.session_id, results, since, last_sequence, version, membership.end_time)
+    return results
 
 
 class DebateTopicViewSet(viewsets.ModelViewSet):
@@ -30,6 +80,14 @@ class DebateTopicViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
+    @conditional_get(topic_versions)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(topic_versions)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class DebateSessionViewSet(viewsets.ModelViewSet):
     """ViewSet for managing debate sessions"""
@@ -47,6 +105,14 @@ class DebateSessionViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
+    @conditional_get(session_list_versions)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(session_versions)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         """Allow students to join a debate session - only if it's currently live"""
@@ -81,7 +147,7 @@ class DebateSessionViewSet(viewsets.ModelViewSet):
                 return Response(serializer.data, status=status.HTTP_200_OK)
         
         # Check participant limit
-        if session.participants.filter(is_active=True).count() >= session.max_participants:
+        if session.participants_count >= session.max_participants:
             return Response(
                 {'error': 'Session has reached maximum participants'}, 
                 status=status.HTTP_400_BAD_REQUEST
@@ -111,9 +177,10 @@ class DebateSessionViewSet(viewsets.ModelViewSet):
     def enter_chat(self, request, pk=None):
         """Allow participants and moderators to enter the chat room"""
         session = get_object_or_404(DebateSession, pk=pk, is_active=True)
+        membership = membership_cache.get(session.id)
         
         # Check if user is the session moderator (creator)
-        if request.user == session.created_by:
+        if membership.is_creator(request.user.id):
             # Moderator can always enter their created sessions
             serializer = self.get_serializer(session)
             return Response({
@@ -124,65 +191,58 @@ class DebateSessionViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_200_OK)
         
         # Check if user is a participant
-        try:
-            participant = Participant.objects.get(user=request.user, session=session, is_active=True)
-            serializer = self.get_serializer(session)
-            return Response({
-                'session': serializer.data,
-                'participant': ParticipantSerializer(participant).data,
-                'user_role': 'participant',
-                'is_session_creator': False,
-                'message': 'Participant chat access granted'
-            }, status=status.HTTP_200_OK)
-        except Participant.DoesNotExist:
+        if not membership.is_participant(request.user.id):
             return Response(
                 {'error': 'You must be a participant or the session moderator to enter the chat'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        participant = Participant(
+            id=membership.participant_id(request.user.id),
+            user=request.user,
+            session=session,
+            joined_at=membership.joined_at(request.user.id),
+            is_active=True
+        )
+        serializer = self.get_serializer(session)
+        return Response({
+            'session': serializer.data,
+            'participant': ParticipantSerializer(participant).data,
+            'user_role': 'participant',
+            'is_session_creator': False,
+            'message': 'Participant chat access granted'
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['get'])
+    @conditional_get(message_versions)
     def messages(self, request, pk=None):
         """Get message history for a session (for participants and moderators)"""
-        session = get_object_or_404(DebateSession, pk=pk, is_active=True)
+        membership = membership_cache.get(pk)
+        if membership is None or not membership.is_active:
+            raise Http404
         
         # Check if user is the session moderator (creator)
-        if request.user == session.created_by:
-            # Moderator can see all messages
-            messages = Message.objects.filter(
-                session=session,
-                is_deleted=False
-            ).order_by('timestamp')
-            
-            serializer = MessageSerializer(messages, many=True)
-            return Response({
-                'results': serializer.data,
-                'count': len(serializer.data),
-                'user_role': 'moderator'
-            }, status=status.HTTP_200_OK)
-        
-        # Check if user is a participant
-        try:
-            participant = Participant.objects.get(user=request.user, session=session, is_active=True)
-            # Get messages from when user joined
-            messages = Message.objects.filter(
-                session=session,
-                timestamp__gte=participant.joined_at,
-                is_deleted=False
-            ).order_by('timestamp')
-            
-            serializer = MessageSerializer(messages, many=True)
-            return Response({
-                'results': serializer.data,
-                'count': len(serializer.data),
-                'user_role': 'participant'
-            }, status=status.HTTP_200_OK)
-        except Participant.DoesNotExist:
+        if membership.is_creator(request.user.id):
+            user_role = 'moderator'
+        elif membership.is_participant(request.user.id):
+            user_role = 'participant'
+        else:
             return Response(
                 {'error': 'You must be a participant or the session moderator to view messages'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        # Moderators see all messages, participants those since they joined
+        paginator = MessageCursorPagination()
+        results = session_message_page(membership, request.user.id, paginator, request)
+        return Response({
+            **paginator.get_paginated_data(results),
+            'count': len(results),
+            'user_role': user_role
+        }, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'])
+    @conditional_get(session_list_versions)
     def my_sessions(self, request):
         """Get sessions where the current user is a participant"""
         if not request.user.is_authenticated:
@@ -231,7 +291,7 @@ class DebateSessionViewSet(viewsets.ModelViewSet):
         messages_sent = Message.objects.filter(
             sender=user,
             is_deleted=False
-        ).count()
+        ).count() + archived_message_count(user)
         
         stats = {
             'debates_participated': total_participated,
@@ -262,9 +322,10 @@ class ParticipantViewSet(viewsets.ReadOnlyModelViewSet):
 
 class MessageViewSet(viewsets.ModelViewSet):
     """ViewSet for managing debate messages"""
-    queryset = Message.objects.filter(is_deleted=False)
+    queryset = Message.objects.filter(is_deleted=False).select_related('sender')
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
         """Filter messages by session and user participation or moderation"""
@@ -272,57 +333,66 @@ class MessageViewSet(viewsets.ModelViewSet):
         session_id = self.request.query_params.get('session_id', None)
         
         if session_id is not None:
-            try:
-                session = DebateSession.objects.get(id=session_id, is_active=True)
-                
-                # Check if user is the session moderator (creator)
-                if self.request.user == session.created_by:
-                    # Moderator can see all messages
-                    queryset = queryset.filter(session_id=session_id).order_by('timestamp')
-                else:
-                    # Check if user is a participant
-                    try:
-                        participant = Participant.objects.get(
-                            user=self.request.user, 
-                            session_id=session_id, 
-                            is_active=True
-                        )
-                        # Only return messages from after the user joined
-                        queryset = queryset.filter(
-                            session_id=session_id,
-                            timestamp__gte=participant.joined_at
-                        ).order_by('timestamp')
-                    except Participant.DoesNotExist:
-                        # User is not a participant or moderator, return empty queryset
-                        queryset = queryset.none()
-            except DebateSession.DoesNotExist:
+            membership = membership_cache.get(session_id)
+            if membership is None or not membership.is_active:
+                return queryset.none()
+
+            # Check if user is the session moderator (creator)
+            if membership.is_creator(self.request.user.id):
+                # Moderator can see all messages
+                queryset = queryset.filter(session_id=membership.session_id).order_by('timestamp')
+            elif membership.is_participant(self.request.user.id):
+                # Only return messages from after the user joined
+                queryset = queryset.filter(
+                    session_id=membership.session_id,
+                    timestamp__gte=membership.joined_at(self.request.user.id)
+                ).order_by('timestamp')
+            else:
+                # User is not a participant or moderator, return empty queryset
                 queryset = queryset.none()
         
         return queryset
 
+    @conditional_get(message_versions)
+    def list(self, request, *args, **kwargs):
+        """Serve a session's messages from the recent message cache when it can"""
+        session_id = request.query_params.get('session_id', None)
+        membership = membership_cache.get(session_id) if session_id is not None else None
+        if membership is None or not membership.is_active or not membership.can_access(request.user.id):
+            return super().list(request, *args, **kwargs)
+
+        results = session_message_page(membership, request.user.id, self.paginator, request)
+        return self.get_paginated_response(results)
+
     def perform_create(self, serializer):
         """Allow participants and session moderators to send messages"""
         session_id = serializer.validated_data['session_id']
-        session = get_object_or_404(DebateSession, id=session_id, is_active=True)
+        membership = membership_cache.get(session_id)
+        if membership is None or not membership.is_active:
+            raise Http404
         
-        # Check if user is the session moderator (creator)
-        if self.request.user == session.created_by:
-            # Moderator can always send messages in their created sessions
-            message = serializer.save(sender=self.request.user, session=session)
-        else:
-            # Check if user is a participant
-            if not Participant.objects.filter(
-                user=self.request.user, 
-                session=session, 
-                is_active=True
-            ).exists():
-                raise ValidationError("You must be a participant or the session moderator to send messages")
-            
-            message = serializer.save(sender=self.request.user, session=session)
+        # Moderators can always send messages in their created sessions
+        if not membership.can_access(self.request.user.id):
+            raise ValidationError("You must be a participant or the session moderator to send messages")
         
         # Check if session is ongoing
-        if not session.is_ongoing:
+        if not membership.is_ongoing:
             raise ValidationError("Cannot send messages to a session that is not currently ongoing")
+
+        muted, until = sanction_cache.get(membership.session_id).muted_until(self.request.user.id)
+        if muted:
+            raise ValidationError("You have been muted by the moderator")
+        
+        sequence = async_to_sync(message_sequences.allocate)(membership.session_id)
+        message = serializer.save(sender=self.request.user, sequence=sequence)
+
+        # Deliver it to the room like messages sent over the WebSocket
+        async_to_sync(broadcast)(
+            membership.session_id,
+            chat_message_payload(message, self.request.user),
+            sequence=sequence,
+            record=dict(serializer.data)
+        )
         
         # Create notifications for other participants
         try:
@@ -425,45 +495,62 @@ class MessageViewSet(viewsets.ModelViewSet):
                 {'error': 'participant_id and action are required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+        if action not in ('mute', 'warn', 'remove'):
+            return Response(
+                {'error': 'Invalid action. Use: mute, warn, or remove'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Mutes last duration_minutes, or the rest of the session without one
+        expires_at = None
+        if action == 'mute' and request.data.get('duration_minutes') not in (None, ''):
+            try:
+                duration = float(request.data['duration_minutes'])
+            except (TypeError, ValueError):
+                duration = 0
+            if duration <= 0:
+                return Response(
+                    {'error': 'duration_minutes must be a positive number'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            expires_at = timezone.now() + timezone.timedelta(minutes=duration)
         
         try:
-            participant = Participant.objects.get(
+            participant = Participant.objects.select_related('user').get(
                 user_id=participant_id, 
                 session=session, 
                 is_active=True
             )
             
-            # Create moderation action record
-            try:
-                from apps.moderation.models import ModerationAction
-                ModerationAction.objects.create(
-                    action=action.upper(),
-                    participant=participant.user,
-                    session=session
-                )
-            except ImportError:
-                pass
-            
             # Apply the action
             if action == 'remove':
                 participant.is_active = False
                 participant.save()
                 message = f'Participant {participant.user.username} has been removed from the session'
             elif action == 'mute':
-                # This would be handled by the frontend/websocket
                 message = f'Participant {participant.user.username} has been muted'
-            elif action == 'warn':
-                message = f'Participant {participant.user.username} has been warned'
             else:
-                return Response(
-                    {'error': 'Invalid action. Use: mute, warn, or remove'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+                message = f'Participant {participant.user.username} has been warned'
+
+            # Recording the action enforces it: mutes are checked from the
+            # sanction cache and removed users are disconnected (see signals.py)
+            try:
+                from apps.moderation.models import ModerationAction
+                ModerationAction.objects.create(
+                    action=action.upper(),
+                    participant=participant.user,
+                    session=session,
+                    expires_at=expires_at
                 )
+            except ImportError:
+                pass
             
             return Response({
                 'message': message,
                 'action': action,
-                'participant': participant.user.username
+                'participant': participant.user.username,
+                'expires_at': expires_at
             }, status=status.HTTP_200_OK)
             
         except Participant.DoesNotExist:
@@ -0,0 +1,32 @@
+import time
+
+from .registry import registry
+
+REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds',
+    'Time spent handling HTTP requests, by view',
+    labels=('view', 'method', 'status')
+)
+
+# Any other method a client sends is recorded as OTHER, so made-up methods
+# can't grow the histogram without bound
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+
+
+class RequestTimingMiddleware:
+    """Records how long each resolved view takes to respond"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            view=match.view_name if match else 'unresolved',
+            method=request.method if request.method in HTTP_METHODS else 'OTHER',
+            status=f'{response.status_code // 100}xx'
+        )
+        return response
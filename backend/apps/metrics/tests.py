@@ -0,0 +1,20 @@
+from django.test import TestCase
+
+from .middleware import REQUEST_SECONDS
+
+
+class RequestTimingMiddlewareTests(TestCase):
+    """Request durations are labelled by a bounded set of HTTP methods"""
+
+    def recorded_methods(self):
+        return {method for _view, method, _status in REQUEST_SECONDS._values}
+
+    def test_unknown_methods_recorded_as_other(self):
+        self.client.get('/api/debates/topics/')
+        self.client.generic('PROPFIND', '/api/debates/topics/')
+        self.client.generic('X-RANDOM-1234', '/api/debates/topics/')
+
+        methods = self.recorded_methods()
+        self.assertIn('GET', methods)
+        self.assertIn('OTHER', methods)
+        self.assertFalse(methods & {'PROPFIND', 'X-RANDOM-1234'})
@@ -5,7 +5,7 @@ from .models import ModerationAction
 @admin.register(ModerationAction)
 class ModerationActionAdmin(admin.ModelAdmin):
     """Admin interface for ModerationAction"""
-    list_display = ['action', 'participant', 'session', 'timestamp']
+    list_display = ['action', 'participant', 'session', 'timestamp', 'expires_at']
     list_filter = ['action', 'timestamp']
     search_fields = ['participant__username', 'session__topic__title']
     readonly_fields = ['timestamp']
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moderation', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moderationaction',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
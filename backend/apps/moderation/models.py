@@ -14,3 +14,5 @@ class ModerationAction(models.Model):
     participant = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     session = models.ForeignKey('debates.DebateSession', on_delete=models.CASCADE)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # When a mute lifts; null mutes last for the rest of the session
+    expires_at = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,69 @@
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.debates.conf import realtime_setting
+from apps.debates.groups import send_to_user
+from .models import Notification
+from .serializers import NotificationSerializer
+
+
+def _unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def unread_count(user_id):
+    """
+    A user's unread notification count, kept in the cache so the COUNT
+    query only runs when the cached value is missing or has expired.
+    """
+    count = cache.get(_unread_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.set(_unread_key(user_id), count, realtime_setting('UNREAD_COUNT_TTL'))
+    return count
+
+
+def adjust_unread_count(user_id, delta):
+    """
+    Move a cached count by delta. Counts that aren't cached are left
+    alone and recounted on the next read; the TTL bounds any drift from
+    a change racing with that recount.
+    """
+    try:
+        if cache.incr(_unread_key(user_id), delta) < 0:
+            cache.delete(_unread_key(user_id))
+    except ValueError:
+        pass
+
+
+def reset_unread_count(user_id):
+    cache.set(_unread_key(user_id), 0, realtime_setting('UNREAD_COUNT_TTL'))
+
+
+def push_notification(notification):
+    """Send a new notification and the user's unread count to their notification stream"""
+    async_to_sync(send_to_user)(notification.user_id, {
+        'type': 'notification',
+        'notification': dict(NotificationSerializer(notification).data),
+        'unread_count': unread_count(notification.user_id)
+    })
+
+
+def push_unread_count(user_id):
+    """Tell a user's open sockets their unread count changed, e.g. after reading"""
+    async_to_sync(send_to_user)(user_id, {
+        'type': 'unread_count',
+        'unread_count': unread_count(user_id)
+    })
+
+
+def notifications_created(notifications):
+    """Count and push notifications saved with bulk_create, which sends no signals"""
+    def publish():
+        for notification in notifications:
+            if not notification.is_read:
+                adjust_unread_count(notification.user_id, 1)
+            push_notification(notification)
+
+    transaction.on_commit(publish)
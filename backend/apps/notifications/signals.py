@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Notification
+from .push import adjust_unread_count, push_notification, push_unread_count
+
+
+@receiver(post_init, sender=Notification)
+def remember_notification_state(sender, instance, **kwargs):
+    """Keep the stored is_read so saves can tell whether it changed"""
+    instance._counted_unread = bool(instance.pk) and not instance.is_read
+
+
+@receiver(post_save, sender=Notification)
+def push_notification_on_save(sender, instance, created, **kwargs):
+    """New notifications are pushed; reading one updates the count"""
+    unread = not instance.is_read
+    if unread == instance._counted_unread and not created:
+        return
+    delta = (1 if unread else 0) - (1 if instance._counted_unread else 0)
+    instance._counted_unread = unread
+
+    def publish():
+        if delta:
+            adjust_unread_count(instance.user_id, delta)
+        if created:
+            push_notification(instance)
+        else:
+            push_unread_count(instance.user_id)
+
+    transaction.on_commit(publish)
+
+
+@receiver(post_delete, sender=Notification)
+def push_unread_count_on_delete(sender, instance, **kwargs):
+    if instance._counted_unread:
+        def publish():
+            adjust_unread_count(instance.user_id, -1)
+            push_unread_count(instance.user_id)
+
+        transaction.on_commit(publish)
@@ -1,3 +1,97 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from apps.users.models import User
+from config.asgi import application
+from .models import Notification
+from .push import _unread_key, notifications_created, unread_count
+
+
+class UnreadCountTests(TestCase):
+    """The cached unread count follows the table through creates, reads and deletes"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('student', 'student@example.com', 'password')
+        self.addCleanup(cache.delete, _unread_key(self.user.id))
+        cache.delete(_unread_key(self.user.id))
+        # Start from a cached count, so every change below has to move it
+        self.assertEqual(unread_count(self.user.id), 0)
+
+    def notification(self, title):
+        return Notification(user=self.user, title=title, message=f'{title} message')
+
+    def assert_count(self, expected):
+        self.assertEqual(cache.get(_unread_key(self.user.id)), expected)
+        self.assertEqual(Notification.objects.filter(user=self.user, is_read=False).count(), expected)
+
+    def test_create_read_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Notification.objects.create(user=self.user, message='First')
+            second = Notification.objects.create(user=self.user, message='Second')
+        self.assert_count(2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.is_read = True
+            first.save()
+            # Saving a read notification again doesn't count it twice
+            first.save()
+        self.assert_count(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+            second.delete()
+        self.assert_count(0)
+
+    def test_bulk_create_and_mark_all_read(self):
+        notifications = [self.notification(f'Bulk {number}') for number in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.bulk_create(notifications)
+            notifications_created(notifications)
+        self.assert_count(3)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/notifications/mark_all_read/')
+        self.assertEqual(response.data['count'], 3)
+        self.assert_count(0)
+        self.assertEqual(client.get('/api/notifications/unread_count/').data['unread_count'], 0)
+
+
+class NotificationPushTests(TransactionTestCase):
+    """New notifications and count changes reach sockets subscribed to the notification stream"""
+
+    def test_pushed_to_subscribed_socket(self):
+        user = User.objects.create_user('student', 'student@example.com', 'password')
+        self.addCleanup(cache.delete, _unread_key(user.id))
+        cache.delete(_unread_key(user.id))
+        token = str(AccessToken.for_user(user))
+
+        async def scenario():
+            communicator = WebsocketCommunicator(application, f'/ws/?token={token}')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()
+            await communicator.send_json_to({'type': 'subscribe', 'stream': 'notifications'})
+            frames = [await communicator.receive_json_from()]
+
+            notification = await database_sync_to_async(Notification.objects.create)(
+                user=user, title='Pushed', message='Pushed message'
+            )
+            frames.append(await communicator.receive_json_from())
+            notification.is_read = True
+            await database_sync_to_async(notification.save)()
+            frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return frames
+
+        subscribed, created, read = async_to_sync(scenario)()
+        self.assertEqual(subscribed, {'type': 'subscribed', 'stream': 'notifications'})
+        self.assertEqual((created['type'], created['unread_count']), ('notification', 1))
+        self.assertEqual(created['notification']['title'], 'Pushed')
+        self.assertEqual(read, {'type': 'unread_count', 'unread_count': 0})
@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework import viewsets, status
 from .models import Notification
+from .push import notifications_created, push_unread_count, reset_unread_count, unread_count
 from .serializers import NotificationSerializer
 
 # Utility function to create notifications
@@ -40,6 +41,7 @@ def create_debate_message_notification(message, exclude_user=None):
     # Bulk create notifications for efficiency
     if notifications_to_create:
         Notification.objects.bulk_create(notifications_to_create)
+        notifications_created(notifications_to_create)
     
     return len(notifications_to_create)
 
@@ -60,6 +62,9 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def mark_all_read(self, request):
         """Mark all notifications as read for the current user"""
         count = Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+        # update() sends no signals
+        reset_unread_count(request.user.id)
+        push_unread_count(request.user.id)
         return Response({
             'message': f'Marked {count} notifications as read',
             'count': count
@@ -78,7 +83,6 @@ class NotificationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
         """Get count of unread notifications for the current user"""
-        count = Notification.objects.filter(user=request.user, is_read=False).count()
         return Response({
-            'unread_count': count
+            'unread_count': unread_count(request.user.id)
         }, status=status.HTTP_200_OK)
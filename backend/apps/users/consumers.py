@@ -1,22 +1,179 @@
-from channels.generic.websocket import JsonWebsocketConsumer
-from asgiref.sync import async_to_sync
-
-class AuthConsumer(JsonWebsocketConsumer):
-    def connect(self):
-        if self.scope['user'].is_authenticated:
-            async_to_sync(self.channel_layer.group_add)(
-                'authenticated_users',
-                self.channel_name
-            )
-            self.accept()
+from django.contrib.auth.models import AnonymousUser
+
+from apps.debates.conf import realtime_setting
+from apps.debates.consumers import WS_CONNECTIONS, RealtimeConsumer
+from apps.debates.groups import user_group_name
+from apps.debates.streams import SESSION_FRAME_TYPES, SessionStream
+
+
+class UserConsumer(RealtimeConsumer):
+    """
+    One authenticated WebSocket per user, multiplexing any number of
+    debate sessions and the user's notification stream.
+
+    Clients subscribe with {"type": "subscribe", "stream": "session",
+    "session_id": 5, "resume_from": 12} or {"type": "subscribe", "stream":
+    "notifications"}, and leave with the same frame typed "unsubscribe".
+    Session frames (chat_message, typing, ping) name their session_id, as
+    does every frame sent for a session.
+    """
+    notifications = False
+    frame_types = ('subscribe', 'unsubscribe', *SESSION_FRAME_TYPES)
+
+    async def connect(self):
+        """Handle WebSocket connection"""
+        self.user = self.scope['user']
+        # session id -> SessionStream
+        self.streams = {}
+
+        if await self.reject_while_draining():
+            return
+
+        # Check if user is authenticated
+        if isinstance(self.user, AnonymousUser):
+            print("WebSocket connection rejected: Anonymous user")
+            WS_CONNECTIONS.inc(outcome='rejected_auth')
+            await self.close(code=4001)  # Custom close code for authentication error
+            return
+
+        await self.accept_client()
+        await self.send_json({
+            'type': 'connection_established',
+            'message': f'Connected as {self.user.username}',
+            'user_id': self.user.id
+        })
+
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection"""
+        await super().disconnect(close_code)
+        for stream in list(self.streams.values()):
+            await stream.close()
+        self.streams = {}
+        if self.notifications:
+            await self.unsubscribe_notifications()
+
+    async def receive_json(self, content):
+        """Handle incoming WebSocket messages"""
+        message_type = await self.read_frame_type(content)
+        if message_type is None:
+            return
+
+        if not await self.check_rate_limit(message_type):
+            return
+
+        if message_type in ('subscribe', 'unsubscribe'):
+            await self.handle_subscription(message_type, content)
+        elif message_type == 'ping' and content.get('session_id') is None:
+            await self.send_json({'type': 'pong'})
+        elif message_type in SESSION_FRAME_TYPES:
+            stream = self.streams.get(self.get_session_id(content))
+            if stream is None:
+                await self.send_error('not_subscribed', 'Subscribe to the session first', content)
+            else:
+                await stream.receive(message_type, content)
         else:
-            self.close()
+            await self.send_json({
+                'type': 'error',
+                'message': 'Unknown message type'
+            })
+
+    @staticmethod
+    def get_session_id(content):
+        try:
+            return int(content.get('session_id'))
+        except (TypeError, ValueError):
+            return None
+
+    async def send_error(self, code, message, content):
+        await self.send_json({
+            'type': 'error',
+            'code': code,
+            'message': message,
+            'session_id': content.get('session_id'),
+            'stream': content.get('stream')
+        })
+
+    async def handle_subscription(self, message_type, content):
+        stream = content.get('stream', 'session')
+        if stream == 'notifications':
+            if message_type == 'subscribe':
+                await self.subscribe_notifications()
+            else:
+                await self.unsubscribe_notifications()
+            await self.send_json({'type': f'{message_type}d', 'stream': 'notifications'})
+            return
+
+        session_id = self.get_session_id(content)
+        if stream != 'session' or session_id is None:
+            await self.send_error('invalid_stream', 'Unknown stream', content)
+        elif message_type == 'subscribe':
+            await self.subscribe_session(session_id, content)
+        else:
+            await self.unsubscribe_session(session_id, content)
+
+    async def subscribe_session(self, session_id, content):
+        """Join a debate session, replaying from resume_from if given"""
+        if session_id in self.streams:
+            await self.send_error('already_subscribed', 'Already subscribed to this session', content)
+            return
+        if len(self.streams) >= realtime_setting('MAX_SESSION_SUBSCRIPTIONS'):
+            await self.send_error('too_many_subscriptions', 'Too many sessions on one connection', content)
+            return
+
+        stream = SessionStream(self, session_id)
+        if not await stream.is_valid_participant():
+            print(f"Subscription rejected: User {self.user.username} is not a valid participant in session {session_id}")
+            await self.send_error('forbidden', 'Not a participant in this session', content)
+            return
+
+        try:
+            resume_from = max(int(content['resume_from']), 0)
+        except (KeyError, TypeError, ValueError):
+            resume_from = None
+        self.streams[session_id] = stream
+        await stream.open(resume_from=resume_from, frame_type='subscribed')
+
+    async def unsubscribe_session(self, session_id, content):
+        stream = self.streams.pop(session_id, None)
+        if stream is None:
+            await self.send_error('not_subscribed', 'Not subscribed to this session', content)
+            return
+        await stream.close()
+        await self.send_json({
+            'type': 'unsubscribed',
+            'stream': 'session',
+            'session_id': session_id
+        })
+
+    async def subscribe_notifications(self):
+        await self.channel_layer.group_add(user_group_name(self.user.id), self.channel_name)
+        self.notifications = True
+
+    async def unsubscribe_notifications(self):
+        await self.channel_layer.group_discard(user_group_name(self.user.id), self.channel_name)
+        self.notifications = False
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
-            'authenticated_users',
-            self.channel_name
-        )
+    async def broadcast_frame(self, event):
+        """Route a pre-encoded group event to its session, or the notification stream"""
+        session_id = event.get('session_id')
+        if session_id is None:
+            if self.notifications:
+                await self.send_broadcast(event)
+            return
+        # Frames still queued for a session the client has just left are dropped
+        stream = self.streams.get(session_id)
+        if stream is not None:
+            await stream.deliver(event)
 
-    def receive_json(self, content):
-        self.send_json(content)
+    async def sanction_update(self, event):
+        """Apply a moderation action; a removed user is unsubscribed from the session"""
+        stream = self.streams.get(event['session_id'])
+        if stream is not None and await stream.apply_sanction(event):
+            del self.streams[event['session_id']]
+            await stream.close()
+            await self.send_json({
+                'type': 'unsubscribed',
+                'stream': 'session',
+                'session_id': event['session_id'],
+                'reason': 'removed'
+            })
@@ -21,7 +21,11 @@ from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.urls import path
 from apps.debates.consumers import DebateConsumer
+from apps.debates.message_writer import message_writer
 from apps.debates.middleware import JWTAuthMiddlewareStack
+from apps.users.consumers import UserConsumer
+
+message_writer.check_configuration()
 
 # ASGI application with both HTTP and WebSocket support
 application = ProtocolTypeRouter({
@@ -29,6 +33,8 @@ application = ProtocolTypeRouter({
     "websocket": JWTAuthMiddlewareStack(
         URLRouter([
             path("ws/debate/<int:session_id>/", DebateConsumer.as_asgi()),
+            # One socket per user, multiplexing sessions and notifications
+            path("ws/", UserConsumer.as_asgi()),
         ])
     ),
 })
@@ -54,9 +54,11 @@ INSTALLED_APPS = [
     'apps.moderation',
     'apps.notifications',
     'apps.voting',
+    'apps.metrics',
 ]
 
 MIDDLEWARE = [
+    'apps.metrics.middleware.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -181,6 +183,42 @@ else:
         },
     }
 
+# Cache shared by all workers (unread notification counts)
+if DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f"redis://{config('REDIS_HOST', default='127.0.0.1')}:{config('REDIS_PORT', default=6379, cast=int)}/1",
+        }
+    }
+
+# Real-time debate room settings; anything not set here keeps its default
+# from DEFAULTS in apps/debates/conf.py, which describes each setting
+DEBATE_REALTIME = {
+    'REDIS_URL': f"redis://{config('REDIS_HOST', default='127.0.0.1')}:{config('REDIS_PORT', default=6379, cast=int)}/0",
+    'PRESENCE_FLUSH_INTERVAL': config('PRESENCE_FLUSH_INTERVAL', default=5.0, cast=float),
+    'TYPING_PERSIST': config('TYPING_PERSIST', default=False, cast=bool),
+    'MESSAGE_WRITE_MODE': config('MESSAGE_WRITE_MODE', default='batched'),
+    'MESSAGE_WRITER_WORKER_ID': config('MESSAGE_WRITER_WORKER_ID', default=None, cast=lambda v: None if v is None else int(v)),
+    'ASYNC_ORM': config('ASYNC_ORM', default=False, cast=bool),
+    'ARCHIVE_AFTER_DAYS': config('ARCHIVE_AFTER_DAYS', default=30, cast=int),
+}
+if DEBUG:
+    # Single process: presence and message sequences stay in memory (the
+    # defaults), and its message writer can't clash with another's ids
+    if DEBATE_REALTIME['MESSAGE_WRITER_WORKER_ID'] is None:
+        DEBATE_REALTIME['MESSAGE_WRITER_WORKER_ID'] = 0
+else:
+    # Multiple workers: share presence and message sequences through Redis
+    DEBATE_REALTIME['PRESENCE_BACKEND'] = 'apps.debates.presence.RedisPresenceBackend'
+    DEBATE_REALTIME['SEQUENCE_BACKEND'] = 'apps.debates.sequences.RedisSequenceBackend'
+
 # Custom User Model
 AUTH_USER_MODEL = 'users.User'
 
@@ -27,6 +27,7 @@ urlpatterns = [
     path('api/moderation/', include('apps.moderation.urls')),
     path('api/notifications/', include('apps.notifications.urls')),
     path('api/voting/', include('apps.voting.urls')),
+    path('metrics/', include('apps.metrics.urls')),
     # API documentation
     path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='api-schema'), name='api-docs'),
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Bell, Check, Clock } from 'lucide-react';
 import { 
   DropdownMenu,
@@ -40,10 +40,68 @@ export function NotificationDropdown() {
     fetchNotifications();
   }, []);
 
-  // Poll for new notifications every 30 seconds
+  // New notifications and unread counts are pushed over the user's socket
+  const wsRef = useRef<WebSocket | null>(null);
   useEffect(() => {
-    const interval = setInterval(fetchNotifications, 30000);
-    return () => clearInterval(interval);
+    let closed = false;
+    // Delay the server asked for before reconnecting, in seconds
+    let retryAfter: number | null = null;
+
+    const connectWebSocket = (reconnecting: boolean) => {
+      const token = localStorage.getItem('accessToken');
+      const ws = new WebSocket(`ws://localhost:8001/ws/?token=${token}`);
+      wsRef.current = ws;
+
+      ws.onopen = () => {
+        ws.send(JSON.stringify({ type: 'subscribe', stream: 'notifications' }));
+        if (reconnecting) {
+          // Catch up on anything pushed while disconnected
+          fetchNotifications();
+        }
+      };
+
+      ws.onmessage = (event) => {
+        try {
+          const data = JSON.parse(event.data);
+          switch (data.type) {
+            case 'notification':
+              setNotifications(prev => [
+                data.notification as Notification,
+                ...prev.filter(n => n.id !== data.notification.id)
+              ]);
+              setUnreadCount(data.unread_count);
+              break;
+
+            case 'unread_count':
+              setUnreadCount(data.unread_count);
+              break;
+
+            case 'reconnect':
+              // The server is restarting; come back after its jittered delay
+              retryAfter = data.retry_after;
+              break;
+          }
+        } catch (error) {
+          console.error('Error parsing notification message:', error);
+        }
+      };
+
+      ws.onclose = (event) => {
+        // Attempt to reconnect if not closed intentionally
+        if (!closed && event.code !== 1000 && event.code !== 4001) {
+          const delay = retryAfter !== null ? retryAfter * 1000 : 3000 + Math.random() * 2000;
+          retryAfter = null;
+          setTimeout(() => connectWebSocket(true), delay);
+        }
+      };
+    };
+
+    connectWebSocket(false);
+
+    return () => {
+      closed = true;
+      wsRef.current?.close(1000);
+    };
   }, []);
 
   const handleNotificationClick = async (notification: Notification) => {
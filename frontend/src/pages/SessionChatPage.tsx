@@ -70,6 +70,26 @@ const safeFormatTime = (dateString: string): string => {
   }
 };
 
+// Transform API messages to match our ChatMessage interface
+const toChatMessages = (messageHistory: any[], sessionId: number): ChatMessage[] => {
+  return messageHistory
+    .filter((msg: any) => msg && msg.user && msg.content) // Filter out invalid messages
+    .map((msg: any) => ({
+      id: msg.id.toString(),
+      user: {
+        id: msg.user.id || 0,
+        username: msg.user.username || 'Unknown User',
+        email: msg.user.email || '',
+        role: msg.user.role || 'STUDENT',
+        is_active: msg.user.is_active || true,
+        date_joined: msg.user.date_joined || new Date().toISOString()
+      },
+      content: msg.content,
+      timestamp: msg.created_at || msg.timestamp || new Date().toISOString(),
+      session_id: sessionId
+    }));
+};
+
 const getInitials = (name: string): string => {
   return name.split(' ').map(n => n[0]).join('').toUpperCase().slice(0, 2);
 };
@@ -100,6 +120,14 @@ export function SessionChatPage() {
   const wsRef = useRef<WebSocket | null>(null);
   const inputRef = useRef<HTMLTextAreaElement>(null);
   const typingTimeoutRef = useRef<NodeJS.Timeout | null>(null);
+  // Highest message sequence seen, sent as resume_from when reconnecting
+  const lastSequenceRef = useRef<number | null>(null);
+  // Cursor link to the page of history before the oldest loaded message
+  const [olderMessagesUrl, setOlderMessagesUrl] = useState<string | null>(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const keepScrollRef = useRef(false);
+  // Delay the server asked for before reconnecting, in seconds
+  const retryAfterRef = useRef<number | null>(null);
 
   console.log('SessionChatPage rendered with sessionId:', sessionId, 'user:', user?.username);
   console.log('Component state:', { 
@@ -127,9 +155,33 @@ export function SessionChatPage() {
   };
 
   useEffect(() => {
+    // Earlier history is added above what the user is reading
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
+  const loadOlderMessages = async () => {
+    if (!olderMessagesUrl || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const response = await apiService.getSessionMessages(parseInt(sessionId!), olderMessagesUrl);
+      const older = toChatMessages(response.data.results || [], parseInt(sessionId!));
+      keepScrollRef.current = true;
+      setMessages(prev => {
+        const loaded = new Set(prev.map(msg => msg.id));
+        return [...older.filter(msg => !loaded.has(msg.id)), ...prev];
+      });
+      setOlderMessagesUrl(response.data.previous);
+    } catch (error) {
+      console.error('Failed to load earlier messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   // Fetch session data and handle join/enter chat logic
   useEffect(() => {
     const fetchSessionAndSetupChat = async () => {
@@ -204,25 +256,15 @@ export function SessionChatPage() {
           const messageHistory = messagesResponse.data.results || [];
           console.log('Message history:', messageHistory);
           
-          // Transform API messages to match our ChatMessage interface
-          const transformedMessages = messageHistory
-            .filter((msg: any) => msg && msg.user && msg.content) // Filter out invalid messages
-            .map((msg: any) => ({
-              id: msg.id.toString(),
-              user: {
-                id: msg.user.id || 0,
-                username: msg.user.username || 'Unknown User',
-                email: msg.user.email || '',
-                role: msg.user.role || 'STUDENT',
-                is_active: msg.user.is_active || true,
-                date_joined: msg.user.date_joined || new Date().toISOString()
-              },
-              content: msg.content,
-              timestamp: msg.created_at || msg.timestamp || new Date().toISOString(),
-              session_id: parseInt(sessionId)
-            }));
+          const transformedMessages = toChatMessages(messageHistory, parseInt(sessionId));
           
           setMessages(transformedMessages);
+          setOlderMessagesUrl(messagesResponse.data.previous);
+          messageHistory.forEach((msg: any) => {
+            if (typeof msg?.sequence === 'number' && msg.sequence > (lastSequenceRef.current ?? 0)) {
+              lastSequenceRef.current = msg.sequence;
+            }
+          });
         } catch (error) {
           console.error('Failed to fetch message history:', error);
           // Don't set error for message history failure, just log it
@@ -245,7 +287,11 @@ export function SessionChatPage() {
 
     const connectWebSocket = () => {
       const token = localStorage.getItem('accessToken');
-      const wsUrl = `ws://localhost:8001/ws/debate/${sessionId}/?token=${token}`;
+      let wsUrl = `ws://localhost:8001/ws/debate/${sessionId}/?token=${token}`;
+      if (lastSequenceRef.current !== null) {
+        // Only replay what was missed while disconnected
+        wsUrl += `&resume_from=${lastSequenceRef.current}`;
+      }
       
       console.log('Connecting to WebSocket:', wsUrl);
       const ws = new WebSocket(wsUrl);
@@ -271,6 +317,19 @@ export function SessionChatPage() {
               if (data.total_participants !== undefined) {
                 setTotalParticipants(data.total_participants);
               }
+              if (Array.isArray(data.typing_users)) {
+                setTypingUsers(data.typing_users.filter((name: string) => name !== user.username));
+              }
+              if (lastSequenceRef.current === null && typeof data.last_sequence === 'number') {
+                lastSequenceRef.current = data.last_sequence;
+              }
+              break;
+
+            case 'replay_complete':
+              console.log(`Replayed ${data.replayed} missed messages`);
+              if (!data.complete) {
+                setError('Some messages were missed while disconnected. Refresh the page to see the full history.');
+              }
               break;
               
             case 'online_count_update':
@@ -290,6 +349,9 @@ export function SessionChatPage() {
               break;
               
             case 'chat_message':
+              if (typeof data.message.sequence === 'number' && data.message.sequence > (lastSequenceRef.current ?? 0)) {
+                lastSequenceRef.current = data.message.sequence;
+              }
               // Add new message
               setMessages(prev => {
                 // Check for duplicates by ID
@@ -310,6 +372,21 @@ export function SessionChatPage() {
               });
               break;
               
+            case 'moderation_action':
+              if (data.action === 'mute') {
+                setError(data.expires_at
+                  ? `You have been muted until ${new Date(data.expires_at).toLocaleTimeString()}`
+                  : 'You have been muted by the moderator');
+              } else if (data.action === 'remove') {
+                setError('You have been removed from this session by the moderator');
+              }
+              break;
+
+            case 'reconnect':
+              // The server is restarting; come back after its jittered delay
+              retryAfterRef.current = data.retry_after;
+              break;
+
             case 'error':
               console.error('WebSocket error:', data.message);
               setError(data.message);
@@ -327,9 +404,14 @@ export function SessionChatPage() {
         console.log('WebSocket disconnected:', event.code, event.reason);
         setWsConnected(false);
         
-        // Attempt to reconnect if not closed intentionally
-        if (event.code !== 1000) {
-          setTimeout(connectWebSocket, 3000);
+        // Attempt to reconnect if not closed intentionally or removed,
+        // spread out so clients don't all come back at once
+        if (event.code !== 1000 && event.code !== 4004) {
+          const delay = retryAfterRef.current !== null
+            ? retryAfterRef.current * 1000
+            : 3000 + Math.random() * 2000;
+          retryAfterRef.current = null;
+          setTimeout(connectWebSocket, delay);
         }
       };
 
@@ -779,6 +861,17 @@ export function SessionChatPage() {
               </div>
             ) : (
               <div className="space-y-4 pb-4">
+                {olderMessagesUrl && (
+                  <div className="flex justify-center">
+                    <button
+                      onClick={loadOlderMessages}
+                      disabled={loadingOlder}
+                      className="text-sm text-blue-600 dark:text-blue-400 hover:underline disabled:opacity-50"
+                    >
+                      {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+                    </button>
+                  </div>
+                )}
                 {messages.filter(msg => msg && msg.user).map((message, index) => {
                   const isCurrentUser = message.user.id === user?.id;
                   const isModerator = message.user.role === 'MODERATOR';
@@ -12,6 +12,7 @@ import type {
   DebateSession,
   Message,
   PaginatedResponse,
+  CursorPaginatedResponse,
   CreateTopicForm,
   CreateSessionForm,
   UserStats,
@@ -205,8 +206,9 @@ class ApiService {
     return this.api.post(`/api/debates/sessions/${sessionId}/enter_chat/`);
   }
 
-  async getSessionMessages(sessionId: number): Promise<AxiosResponse<PaginatedResponse<Message>>> {
-    return this.api.get(`/api/debates/sessions/${sessionId}/messages/`);
+  // Latest messages, or the page at a previous/next link of an earlier response
+  async getSessionMessages(sessionId: number, pageUrl?: string): Promise<AxiosResponse<CursorPaginatedResponse<Message>>> {
+    return this.api.get(pageUrl ?? `/api/debates/sessions/${sessionId}/messages/`);
   }
 
   // New dashboard endpoints
@@ -245,7 +247,7 @@ class ApiService {
   }
 
   // Message methods
-  async getMessages(sessionId: number): Promise<AxiosResponse<PaginatedResponse<Message>>> {
+  async getMessages(sessionId: number): Promise<AxiosResponse<CursorPaginatedResponse<Message>>> {
     return this.api.get(`/api/debates/messages/?session=${sessionId}`);
   }
 
@@ -315,10 +317,11 @@ class ApiService {
     });
   }
 
-  async moderateParticipant(sessionId: number, participantId: number, action: 'mute' | 'warn' | 'remove'): Promise<AxiosResponse<any>> {
+  async moderateParticipant(sessionId: number, participantId: number, action: 'mute' | 'warn' | 'remove', durationMinutes?: number): Promise<AxiosResponse<any>> {
     return this.api.post(`/api/debates/sessions/${sessionId}/moderate_participant/`, {
       participant_id: participantId,
-      action: action
+      action: action,
+      duration_minutes: durationMinutes
     });
   }
 }
@@ -129,6 +129,14 @@ export interface PaginatedResponse<T> {
   results: T[];
 }
 
+// Message history is paged with cursors: `previous` fetches older
+// messages and `next` newer ones
+export interface CursorPaginatedResponse<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+}
+
 export interface DashboardStats {
   debates_participated: number;
   debates_won: number;